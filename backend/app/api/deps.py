@@ -1,17 +1,59 @@
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from sqlalchemy.orm import Session
+from sqlalchemy import inspect
+import hashlib
 import secrets
+import threading
+import time
+from typing import Dict, Optional, Tuple
 from app.models import models
 from app.core.database import get_db
 
 security = HTTPBasic()
 
+# Authenticated users are reused this long; update_user / delete_user clear them in this worker at once
+AUTH_CACHE_TTL_SECONDS = 30.0
+
+_auth_cache: Dict[Tuple[str, bytes], Tuple[float, models.User]] = {}
+_auth_lock = threading.Lock()
+
+def invalidate_auth_cache():
+    with _auth_lock:
+        _auth_cache.clear()
+
+def _detached_user(user: models.User) -> models.User:
+    """Session-free copy of the user's columns, safe to share between requests."""
+    return models.User(**{attr.key: getattr(user, attr.key) for attr in inspect(models.User).column_attrs})
+
+def authenticate_user(db: Session, username: str, password: str) -> Optional[models.User]:
+    """Return the user for a username/password pair, or None.
+
+    Successful logins are cached for AUTH_CACHE_TTL_SECONDS under the
+    username and a SHA-256 digest of the password, so polling clients skip
+    the users query. The password is still checked with compare_digest
+    against the stored one on every call; failures are never cached.
+    """
+    key = (username, hashlib.sha256(password.encode()).digest())
+    now = time.monotonic()
+    hit = _auth_cache.get(key)
+    fresh = hit is not None and hit[0] > now
+    if fresh:
+        user = hit[1]
+    else:
+        user = db.query(models.User).filter(models.User.username == username).first()
+        if not user:
+            return None
+        user = _detached_user(user)
+    if not secrets.compare_digest(password.encode(), user.password_hash.encode()):
+        return None
+    if not fresh:
+        with _auth_lock:
+            _auth_cache[key] = (now + AUTH_CACHE_TTL_SECONDS, user)
+    return user
+
 def verify_credentials(credentials: HTTPBasicCredentials = Depends(security), db: Session = Depends(get_db)) -> models.User:
-    username = credentials.username
-    password = credentials.password
-    
-    user = db.query(models.User).filter(models.User.username == username).first()
+    user = authenticate_user(db, credentials.username, credentials.password)
     
     if not user:
         raise HTTPException(
@@ -20,13 +62,6 @@ def verify_credentials(credentials: HTTPBasicCredentials = Depends(security), db
             headers={"WWW-Authenticate": "Basic"},
         )
     
-    if not secrets.compare_digest(password.encode(), user.password_hash.encode()):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid credentials",
-            headers={"WWW-Authenticate": "Basic"},
-        )
-    
     return user
 
 def require_admin(user: models.User = Depends(verify_credentials)) -> models.User:
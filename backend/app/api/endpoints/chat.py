@@ -1,14 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, WebSocket, WebSocketDisconnect
 from sqlalchemy.orm import Session
-from app.core.database import get_db
+from starlette.concurrency import run_in_threadpool
+from app.core.database import get_db, SessionLocal
 from app.models import models
-from app.api.deps import require_admin
+from app.api.deps import require_admin, authenticate_user
+from app.services.chat_hub import hub, add_chat_message, mark_chat_read, publish_session, query_session_messages
 from app.schemas import ChatSessionCreate, ChatSession, ChatMessage, ChatMessageCreate
 import shutil
 import os
 import uuid
+import asyncio
+import base64
 from datetime import datetime, timezone
-from typing import List
+from typing import List, Optional
 
 router = APIRouter()
 
@@ -21,23 +25,21 @@ async def init_chat_session(session_create: ChatSessionCreate, db: Session = Dep
         db.add(session)
         db.commit()
         db.refresh(session)
+        publish_session(db, session)
     return session
 
 @router.get("/messages", response_model=List[ChatMessage])
-async def get_chat_messages(session_id: str, db: Session = Depends(get_db)):
-    """User fetching their messages"""
+async def get_chat_messages(session_id: str, after_id: Optional[int] = None, since: Optional[datetime] = None, db: Session = Depends(get_db)):
+    """User fetching their messages (only newer than after_id / since when given)"""
     session = db.query(models.ChatSession).filter(models.ChatSession.session_id == session_id).first()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    messages = db.query(models.ChatMessage).filter(models.ChatMessage.session_id == session.id).order_by(models.ChatMessage.created_at.asc()).all()
+    messages = query_session_messages(db, session, after_id, since)
     
     # Mark admin messages as read by user
-    unread_admin_msgs = [m for m in messages if m.sender == 'admin' and not m.is_read]
-    if unread_admin_msgs:
-        for m in unread_admin_msgs:
-            m.is_read = True
-        db.commit()
+    if any(m.sender == 'admin' and not m.is_read for m in messages):
+        mark_chat_read(db, session, 'admin')
 
     for m in messages:
         if m.created_at and m.created_at.tzinfo is None:
@@ -52,24 +54,7 @@ async def send_chat_message(session_id: str, msg: ChatMessageCreate, db: Session
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    new_msg = models.ChatMessage(
-        session_id=session.id,
-        sender="user",
-        content=msg.content
-    )
-    db.add(new_msg)
-    
-    session.last_message_at = datetime.now(timezone.utc)
-    # Reopen session if it was previously closed by admin
-    if session.status == models.ChatSessionStatus.CLOSED:
-        session.status = models.ChatSessionStatus.ACTIVE
-        
-    db.commit()
-    db.refresh(new_msg)
-    
-    if new_msg.created_at and new_msg.created_at.tzinfo is None:
-        new_msg.created_at = new_msg.created_at.replace(tzinfo=timezone.utc)
-    return new_msg
+    return add_chat_message(db, session, "user", msg.content)
 @router.get("/admin/sessions", response_model=List[ChatSession])
 async def admin_get_chat_sessions(user: models.User = Depends(require_admin), db: Session = Depends(get_db)):
     """Admin get all active chat sessions sorted by recent activity, excluding empty sessions"""
@@ -91,13 +76,13 @@ async def admin_get_chat_sessions(user: models.User = Depends(require_admin), db
     return sessions
 
 @router.get("/admin/sessions/{session_id}/messages", response_model=List[ChatMessage])
-async def admin_get_session_messages(session_id: str, user: models.User = Depends(require_admin), db: Session = Depends(get_db)):
-    """Admin get messages for a session"""
+async def admin_get_session_messages(session_id: str, after_id: Optional[int] = None, since: Optional[datetime] = None, user: models.User = Depends(require_admin), db: Session = Depends(get_db)):
+    """Admin get messages for a session (only newer than after_id / since when given)"""
     session = db.query(models.ChatSession).filter(models.ChatSession.session_id == session_id).first()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    messages = db.query(models.ChatMessage).filter(models.ChatMessage.session_id == session.id).order_by(models.ChatMessage.created_at.asc()).all()
+    messages = query_session_messages(db, session, after_id, since)
     
     for m in messages:
         if m.created_at and m.created_at.tzinfo is None:
@@ -111,20 +96,7 @@ async def admin_send_chat_message(session_id: str, msg: ChatMessageCreate, user:
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    new_msg = models.ChatMessage(
-        session_id=session.id,
-        sender="admin",
-        content=msg.content
-    )
-    db.add(new_msg)
-    
-    session.last_message_at = datetime.now(timezone.utc)
-    db.commit()
-    db.refresh(new_msg)
-    
-    if new_msg.created_at and new_msg.created_at.tzinfo is None:
-        new_msg.created_at = new_msg.created_at.replace(tzinfo=timezone.utc)
-    return new_msg
+    return add_chat_message(db, session, "admin", msg.content)
 
 @router.post("/admin/sessions/{session_id}/read")
 async def admin_mark_messages_read(session_id: str, user: models.User = Depends(require_admin), db: Session = Depends(get_db)):
@@ -133,16 +105,7 @@ async def admin_mark_messages_read(session_id: str, user: models.User = Depends(
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    unread_user_msgs = db.query(models.ChatMessage).filter(
-        models.ChatMessage.session_id == session.id,
-        models.ChatMessage.sender == 'user',
-        models.ChatMessage.is_read == False
-    ).all()
-    
-    for m in unread_user_msgs:
-        m.is_read = True
-        
-    db.commit()
+    mark_chat_read(db, session, 'user')
     return {"success": True}
     
 @router.put("/admin/sessions/{session_id}/close")
@@ -154,6 +117,7 @@ async def admin_close_chat_session(session_id: str, user: models.User = Depends(
         
     session.status = models.ChatSessionStatus.CLOSED
     db.commit()
+    publish_session(db, session)
     return {"success": True}
 
 UPLOAD_DIR = "static/uploads/chat"
@@ -213,24 +177,7 @@ async def upload_chat_image_user(
 
     image_url = f"/{file_path}"
 
-    new_msg = models.ChatMessage(
-        session_id=session.id,
-        sender="user",
-        content="",
-        image_url=image_url
-    )
-    db.add(new_msg)
-
-    session.last_message_at = datetime.now(timezone.utc)
-    if session.status == models.ChatSessionStatus.CLOSED:
-        session.status = models.ChatSessionStatus.ACTIVE
-
-    db.commit()
-    db.refresh(new_msg)
-
-    if new_msg.created_at and new_msg.created_at.tzinfo is None:
-        new_msg.created_at = new_msg.created_at.replace(tzinfo=timezone.utc)
-    return new_msg
+    return add_chat_message(db, session, "user", "", image_url)
 
 @router.post("/admin/sessions/{session_id}/messages/image", response_model=ChatMessage)
 async def admin_upload_chat_image(
@@ -253,19 +200,92 @@ async def admin_upload_chat_image(
 
     image_url = f"/{file_path}"
 
-    new_msg = models.ChatMessage(
-        session_id=session.id,
-        sender="admin",
-        content="",
-        image_url=image_url
-    )
-    db.add(new_msg)
-
-    session.last_message_at = datetime.now(timezone.utc)
-    db.commit()
-    db.refresh(new_msg)
-
-    if new_msg.created_at and new_msg.created_at.tzinfo is None:
-        new_msg.created_at = new_msg.created_at.replace(tzinfo=timezone.utc)
-    return new_msg
-
+    return add_chat_message(db, session, "admin", "", image_url)
+
+
+
+# ============== WEBSOCKETS ==============
+# Events pushed to clients: {"type": "message" | "message_updated" | "message_deleted" | "read" | "session", "session_id": ..., ...}
+# Frames accepted from clients: {"type": "message", "content": ...} and {"type": "read"} (admins also pass "session_id").
+
+WS_AUTH_TIMEOUT_SECONDS = 10
+
+def _handle_chat_frame(session_id: str, sender: str, frame: dict):
+    """Apply a client frame; the resulting events reach sockets through the hub.
+
+    Blocking DB work: the socket loops run it in the threadpool.
+    """
+    db = SessionLocal()
+    try:
+        session = db.query(models.ChatSession).filter(models.ChatSession.session_id == session_id).first()
+        if not session:
+            return
+        if frame.get("type") == "message":
+            content = (frame.get("content") or "").strip()
+            if content:
+                add_chat_message(db, session, sender, content)
+        elif frame.get("type") == "read":
+            # A side reads the messages sent by the other side
+            mark_chat_read(db, session, "admin" if sender == "user" else "user")
+    finally:
+        db.close()
+
+def _authenticate_admin(frame: dict) -> bool:
+    username, password = frame.get("username"), frame.get("password")
+    if frame.get("token"):
+        try:
+            username, _, password = base64.b64decode(frame["token"]).decode().partition(":")
+        except Exception:
+            return False
+    if not username or password is None:
+        return False
+    db = SessionLocal()
+    try:
+        user = authenticate_user(db, username, password)
+        return bool(user and user.role == models.UserRole.ADMIN)
+    finally:
+        db.close()
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket, session_id: str):
+    """Visitor live chat: pushes events of one session"""
+    await websocket.accept()
+    hub.add_visitor(session_id, websocket)
+    try:
+        while True:
+            frame = await websocket.receive_json()
+            if isinstance(frame, dict):
+                await run_in_threadpool(_handle_chat_frame, session_id, "user", frame)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Chat socket error: {e}")
+    finally:
+        hub.remove(websocket)
+
+@router.websocket("/admin/ws")
+async def admin_chat_socket(websocket: WebSocket):
+    """Admin live chat: first frame must be {"type": "auth", "token": <basic auth token>}; pushes events of all sessions"""
+    await websocket.accept()
+    try:
+        frame = await asyncio.wait_for(websocket.receive_json(), WS_AUTH_TIMEOUT_SECONDS)
+    except (asyncio.TimeoutError, WebSocketDisconnect, ValueError):
+        await websocket.close(code=4401)
+        return
+    if not isinstance(frame, dict) or frame.get("type") != "auth" or not await run_in_threadpool(_authenticate_admin, frame):
+        await websocket.close(code=4401)
+        return
+
+    hub.add_admin(websocket)
+    try:
+        await websocket.send_json({"type": "ready"})
+        while True:
+            frame = await websocket.receive_json()
+            if isinstance(frame, dict) and frame.get("session_id"):
+                await run_in_threadpool(_handle_chat_frame, frame["session_id"], "admin", frame)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Admin chat socket error: {e}")
+    finally:
+        hub.remove(websocket)
@@ -1,39 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.core.state import state, get_rates_updated_at
 from app.models import models
 from app.schemas import Currency, CrossRate, RatesUploadResponseV2, BranchRate
 from app.services.rates_service import RatesService
-from datetime import datetime
-from typing import List, Dict
+from app.services.rates_cache import get_rate_snapshot
+from app.services.rates_stream import rates_event_stream
+from app.services.rate_history import rate_history_series, HISTORY_MODES
+from datetime import datetime, timedelta
+import math
+from typing import List, Dict, Optional
 
 router = APIRouter()
 
 router = APIRouter()
 
+HISTORY_MAX_POINTS = 1000
+HISTORY_MAX_DAYS = 3660
+
 @router.get("")
 async def get_base_rates(db: Session = Depends(get_db)):
-    """Get all base rates (public). Always fetches from DB to stay current."""
-    currencies = db.query(models.Currency).filter(models.Currency.is_active == True).order_by(models.Currency.order).all()
-    result = {}
-    for c in currencies:
-        result[c.code] = {
-            "code": c.code,
-            "name": c.name,
-            "name_uk": c.name_uk,
-            "flag": c.flag,
-            "buy_rate": round(c.buy_rate, 4),
-            "sell_rate": round(c.sell_rate, 4),
-            "wholesale_buy_rate": round(c.wholesale_buy_rate, 4),
-            "wholesale_sell_rate": round(c.wholesale_sell_rate, 4),
-            "is_popular": c.is_popular
-        }
+    """Get all base rates (public). Served from the rate snapshot for the current rates version."""
+    snapshot = get_rate_snapshot(db)
     return {
-        "updated_at": get_rates_updated_at(db).isoformat(),
-        "rates": result
+        "updated_at": snapshot.version.isoformat(),
+        "rates": snapshot.base_rates()
     }
 
+@router.get("/stream")
+async def stream_rates(request: Request, branch_id: Optional[int] = None, with_rates: bool = False):
+    """Server-Sent Events: a `rates` event with the new version whenever rates change.
+
+    Pass with_rates=true (and optionally branch_id) to receive the /api/currencies payload in the event.
+    """
+    return StreamingResponse(
+        rates_event_stream(request, branch_id, with_rates),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.get("/cross")
 async def get_cross_rates(db: Session = Depends(get_db)):
     """Get all active cross-rate pairs from manually configured data"""
@@ -53,85 +60,90 @@ async def get_cross_rates(db: Session = Depends(get_db)):
         "cross_rates": results
     }
 
+@router.get("/cross/matrix")
+async def get_cross_rate_matrix(branch_id: int = 1, db: Session = Depends(get_db)):
+    """Full buy/sell cross-rate matrix (rows = base, columns = quote, UAH included) for a branch"""
+    snapshot = get_rate_snapshot(db)
+    return {
+        "updated_at": snapshot.version.isoformat(),
+        "branch_id": branch_id,
+        **snapshot.cross_matrix(branch_id)
+    }
+
 @router.get("/cross/{pair}")
-async def get_cross_rate(pair: str, db: Session = Depends(get_db)):
+async def get_cross_rate(pair: str, branch_id: int = 1, db: Session = Depends(get_db)):
     """Get specific cross-rate (e.g., EUR/USD)"""
     pair = pair.upper()
     parts = pair.split('/')
     if len(parts) != 2:
         raise HTTPException(status_code=400, detail="Invalid pair format. Use BASE/QUOTE")
     
-    base_r = db.query(models.BranchRate).filter(models.BranchRate.branch_id == 1, models.BranchRate.currency_code == parts[0]).first()
-    quote_r = db.query(models.BranchRate).filter(models.BranchRate.branch_id == 1, models.BranchRate.currency_code == parts[1]).first()
-    
-    if not base_r or not quote_r:
+    rates = get_rate_snapshot(db).cross_rate(branch_id, parts[0], parts[1])
+    if rates is None:
         raise HTTPException(status_code=404, detail="One or both currencies not found")
-        
-    try:
-        return {
-            "pair": pair,
-            "base": parts[0],
-            "quote": parts[1],
-            "buy": round(base_r.buy_rate / quote_r.sell_rate, 4),
-            "sell": round(base_r.sell_rate / quote_r.buy_rate, 4),
-            "calculated": True,
-            "timestamp": datetime.now().isoformat()
-        }
-    except ZeroDivisionError:
+    buy, sell = rates
+    if not (math.isfinite(buy) and math.isfinite(sell)):
         raise HTTPException(status_code=500, detail="Calculation error due to zero rates")
 
+    return {
+        "pair": pair,
+        "base": parts[0],
+        "quote": parts[1],
+        "buy": round(buy, 4),
+        "sell": round(sell, 4),
+        "calculated": True,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/history/{code}")
+async def get_rate_history(
+    code: str,
+    branch_id: int = 1,
+    days: int = 30,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    points: int = 200,
+    mode: str = "lttb",
+    db: Session = Depends(get_db)
+):
+    """Downsampled buy/sell history of a currency for charts.
+
+    The range is [start, end], or the last `days` days when start is omitted.
+    mode=lttb returns up to `points` published values, mode=ohlc `points` candles.
+    """
+    code = code.upper()
+    if mode not in HISTORY_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(HISTORY_MODES)}")
+    if not 2 <= points <= HISTORY_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"points must be between 2 and {HISTORY_MAX_POINTS}")
+
+    # Published versions are naive local times
+    end = end.astimezone().replace(tzinfo=None) if end and end.tzinfo else end
+    start = start.astimezone().replace(tzinfo=None) if start and start.tzinfo else start
+    end = min(end or datetime.now(), datetime.now())
+    start = start or end - timedelta(days=days)
+    if start >= end or end - start > timedelta(days=HISTORY_MAX_DAYS):
+        raise HTTPException(status_code=400, detail=f"Invalid range (at most {HISTORY_MAX_DAYS} days)")
+
+    if not db.query(models.Currency.id).filter(models.Currency.code == code).first():
+        raise HTTPException(status_code=404, detail="Currency not found")
+
+    return {
+        "code": code,
+        "branch_id": branch_id,
+        "updated_at": get_rates_updated_at(db).isoformat(),
+        **rate_history_series(db, code, branch_id, start, end, points, mode)
+    }
+
 @router.get("/{branch_id}")
 async def get_branch_rates(branch_id: int, db: Session = Depends(get_db)):
     """Get base rates + branch specific overrides"""
     try:
-        # Fetch base currencies
-        currencies = db.query(models.Currency).filter(models.Currency.is_active == True).order_by(models.Currency.order).all()
-        base_map = {c.code: c for c in currencies}
-        
-        # Fetch ALL branch rates (both active and inactive) so we know if a currency was explicitly disabled here
-        branch_rates = db.query(models.BranchRate).filter(
-            models.BranchRate.branch_id == branch_id
-        ).all()
-        br_map = {r.currency_code: r for r in branch_rates}
-        
-        result = {}
-        for code, base_c in base_map.items():
-            br = br_map.get(code)
-            
-            is_active = br.is_active if br else base_c.is_active
-            
-            # If explicitly disabled for this branch, return 0s
-            if not is_active:
-                actual_buy = 0.0
-                actual_sell = 0.0
-                actual_w_buy = 0.0
-                actual_w_sell = 0.0
-                actual_threshold = base_c.wholesale_threshold
-            else:
-                actual_buy = br.buy_rate if br and br.buy_rate > 0 else base_c.buy_rate
-                actual_sell = br.sell_rate if br and br.sell_rate > 0 else base_c.sell_rate
-                actual_w_buy = br.wholesale_buy_rate if br and br.wholesale_buy_rate > 0 else base_c.wholesale_buy_rate
-                actual_w_sell = br.wholesale_sell_rate if br and br.wholesale_sell_rate > 0 else base_c.wholesale_sell_rate
-                actual_threshold = br.wholesale_threshold if br and br.wholesale_threshold and br.wholesale_threshold != 1000 else base_c.wholesale_threshold
-
-            result[code] = {
-                "code": code,
-                "name": base_c.name,
-                "name_uk": base_c.name_uk,
-                "flag": base_c.flag,
-                "buy_rate": round(actual_buy, 4),
-                "sell_rate": round(actual_sell, 4),
-                "wholesale_buy_rate": round(actual_w_buy, 4),
-                "wholesale_sell_rate": round(actual_w_sell, 4),
-                "wholesale_threshold": actual_threshold,
-                "is_popular": base_c.is_popular,
-                "is_active": is_active
-            }
-                
+        snapshot = get_rate_snapshot(db)
         return {
-            "updated_at": get_rates_updated_at(db).isoformat(),
+            "updated_at": snapshot.version.isoformat(),
             "branch_id": branch_id,
-            "rates": result
+            "rates": snapshot.branch_rates(branch_id)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
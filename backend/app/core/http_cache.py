@@ -0,0 +1,59 @@
+import hashlib
+import re
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+from app.core.state import content_versions_expired, get_content_versions
+
+# Public GET endpoints whose payload depends only on the listed content kinds
+ETAG_ROUTES = (
+    (re.compile(r"^/api/(currencies|currencies/info/all|rates|rates/\d+|rates/branch/\d+|rates/cross|rates/cross/matrix)/?$"), ("rates",)),
+    (re.compile(r"^/api/faq/?$"), ("faq",)),
+    (re.compile(r"^/api/services/?$"), ("services",)),
+    (re.compile(r"^/api/articles(/\d+)?/?$"), ("articles",)),
+    (re.compile(r"^/api/settings/?$"), ("settings",)),
+)
+
+
+def content_kinds(path: str) -> Optional[Tuple[str, ...]]:
+    for pattern, kinds in ETAG_ROUTES:
+        if pattern.match(path):
+            return kinds
+    return None
+
+
+def make_etag(request: Request, kinds: Tuple[str, ...], versions: Dict[str, datetime]) -> str:
+    """Strong validator from the content versions plus the full URL (query params select branch etc.).
+
+    The body is byte-identical for a given URL and versions, so no W/ prefix.
+    """
+    key = "|".join([str(request.url.path), str(request.url.query)] + [versions[k].isoformat() for k in kinds])
+    return '"%s"' % hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison: a W/ tag from a client still matches
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+async def conditional_get(request: Request, call_next):
+    """Answer If-None-Match with 304 from in-memory versions, before any endpoint or DB work."""
+    kinds = content_kinds(request.url.path) if request.method in ("GET", "HEAD") else None
+    if not kinds:
+        return await call_next(request)
+
+    # The periodic site_settings re-read is a DB query; keep it off the event loop
+    versions = await run_in_threadpool(get_content_versions) if content_versions_expired() else get_content_versions()
+    etag = make_etag(request, kinds, versions)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+    return response
@@ -10,6 +10,67 @@ def get_columns(conn, table_name):
         return [row[0] for row in res]
     return []
 
+# (table, index, columns, unique) for the hot queries below. Unique ones are
+# deduplicated first, keeping the oldest row: lookups were .filter(...).first()
+# without ORDER BY, so that is the row uploads and balance edits kept updating.
+HOT_INDEXES = (
+    ("branch_rates", "ux_branch_rates_branch_currency", ("branch_id", "currency_code"), True),
+    ("branch_balances", "ux_branch_balances_key", ("branch_id", "currency_code", "category"), True),
+    ("reservations", "ix_reservations_status_expires_at", ("status", "expires_at"), False),
+    ("reservations", "ix_reservations_created_at_id", ("created_at", "id"), False),
+    ("reservations", "ix_reservations_branch_created_at", ("branch_id", "created_at", "id"), False),
+    ("chat_messages", "ix_chat_messages_session_id_id", ("session_id", "id"), False),
+)
+
+# Representative statements of the hottest paths, EXPLAINed before and after new indexes
+HOT_QUERIES = {
+    "branch rate lookup": "SELECT * FROM branch_rates WHERE branch_id = 1 AND currency_code = 'USD'",
+    "balance lookup": "SELECT * FROM branch_balances WHERE branch_id = 1 AND currency_code = 'USD' AND category = 'blue'",
+    "reservation expiry": "SELECT id FROM reservations WHERE status IN ('PENDING', 'PENDING_ADMIN') AND expires_at < '2000-01-01'",
+    "reservation list": "SELECT * FROM reservations ORDER BY created_at DESC, id DESC LIMIT 20",
+    "branch reservation list": "SELECT * FROM reservations WHERE branch_id = 1 ORDER BY created_at DESC, id DESC LIMIT 20",
+    "chat messages": "SELECT * FROM chat_messages WHERE session_id = 1 AND id > 0 ORDER BY id",
+}
+
+def index_exists(conn, name):
+    if engine.dialect.name == 'sqlite':
+        return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :n"), {"n": name}).first() is not None
+    elif engine.dialect.name == 'postgresql':
+        return conn.execute(text("SELECT 1 FROM pg_indexes WHERE indexname = :n"), {"n": name}).first() is not None
+    return False
+
+def explain(conn, sql):
+    """Query plan as one line ('SEARCH ... USING INDEX ...' on SQLite, the plan tree on Postgres)."""
+    if engine.dialect.name == 'sqlite':
+        return "; ".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    return "; ".join(row[0].strip() for row in conn.execute(text(f"EXPLAIN {sql}")))
+
+def run_index_migrations(conn):
+    """Create the missing HOT_INDEXES (deduplicating rows first for unique ones) and report plan changes."""
+    tables = {table: get_columns(conn, table) for table, _, _, _ in HOT_INDEXES}
+    missing = [i for i in HOT_INDEXES if tables[i[0]] and not index_exists(conn, i[1])]
+    if not missing:
+        return
+
+    queries = {name: sql for name, sql in HOT_QUERIES.items() if all(tables.get(t) for t in tables if f" {t} " in sql)}
+    before = {name: explain(conn, sql) for name, sql in queries.items()}
+
+    for table, name, columns, unique in missing:
+        cols = ", ".join(columns)
+        if unique:
+            removed = conn.execute(text(
+                f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {cols})"
+            )).rowcount
+            if removed:
+                print(f"Removed {removed} duplicate rows from '{table}' ({cols}).")
+        print(f"Creating index {name} on {table} ({cols})...")
+        conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({cols})"))
+
+    for name, sql in queries.items():
+        after = explain(conn, sql)
+        if after != before[name]:
+            print(f"Query plan of {name}:\n  before: {before[name]}\n  after:  {after}")
+
 def run_migrations():
     """Runs simple migrations on startup to ensure database schema matches the models."""
     print("Running database migrations...")
@@ -71,6 +132,13 @@ def run_migrations():
                     print("Adding rates_updated_at column to 'site_settings' table...")
                     conn.execute(text("ALTER TABLE site_settings ADD COLUMN rates_updated_at DATETIME"))
 
+                if 'faq_updated_at' not in ss_cols:
+                    print("Adding content version columns to 'site_settings' table...")
+                    ts_type = "TIMESTAMP" if engine.dialect.name == 'postgresql' else "DATETIME"
+                    for column in ('faq_updated_at', 'services_updated_at', 'articles_updated_at', 'settings_updated_at'):
+                        conn.execute(text(f"ALTER TABLE site_settings ADD COLUMN {column} {ts_type}"))
+                    print("Migration successful: added content version columns to site_settings.")
+
             # Check service_items table for SEO fields
             si_cols = get_columns(conn, "service_items")
             if si_cols:
@@ -97,6 +165,7 @@ def run_migrations():
                     except Exception:
                         pass
 
+
             # Create seo_pages table if it doesn't exist
             if engine.dialect.name == 'sqlite':
                 res = conn.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='seo_pages'"))
@@ -140,7 +209,12 @@ def run_migrations():
                     conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_seo_pages_slug ON seo_pages (slug)"))
                     print("Migration successful: created 'seo_pages' table.")
 
-            print("Database migrations completed.")
-
         except Exception as e:
             print(f"Migration error: {e}")
+
+    with engine.begin() as conn:
+        try:
+            run_index_migrations(conn)
+            print("Database migrations completed.")
+        except Exception as e:
+            print(f"Index migration error: {e}")
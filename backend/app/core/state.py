@@ -1,11 +1,36 @@
+import time
 from datetime import datetime
+from typing import Callable, Dict, List
 from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+
+# site_settings column holding the last-modified time of each public content kind
+CONTENT_VERSION_COLUMNS = {
+    "rates": "rates_updated_at",
+    "faq": "faq_updated_at",
+    "services": "services_updated_at",
+    "articles": "articles_updated_at",
+    "settings": "settings_updated_at",
+}
+
+# How long a worker trusts its in-memory content versions before re-reading site_settings.
+# Writes made by this worker are visible immediately; writes from other workers within this window.
+CONTENT_VERSION_TTL_SECONDS = 2.0
 
 class AppState:
     rates_updated_at: datetime = datetime.now()
+    started_at: datetime = datetime.now()
+    content_versions: Dict[str, datetime] = {}
+    content_versions_checked_at: float = 0.0
 
 state = AppState()
 
+# Called with the new version after every set_rates_updated_at (e.g. the SSE rates stream)
+_rates_listeners: List[Callable[[datetime], None]] = []
+
+def on_rates_updated(listener: Callable[[datetime], None]):
+    _rates_listeners.append(listener)
+
 def get_rates_updated_at(db: Session) -> datetime:
     from app.models import models
     try:
@@ -18,13 +43,51 @@ def get_rates_updated_at(db: Session) -> datetime:
     return state.rates_updated_at
 
 def set_rates_updated_at(db: Session, dt: datetime = None):
-    from app.models import models
     dt = dt or datetime.now()
     state.rates_updated_at = dt
+    set_content_updated_at(db, "rates", dt)
+    for listener in _rates_listeners:
+        try:
+            listener(dt)
+        except Exception as e:
+            print(f"Rates listener failed: {e}")
+
+def content_versions_expired() -> bool:
+    """True when the next get_content_versions() call re-reads site_settings."""
+    return time.monotonic() - state.content_versions_checked_at >= CONTENT_VERSION_TTL_SECONDS
+
+def get_content_versions() -> Dict[str, datetime]:
+    """Last-modified time per content kind, re-read from site_settings at most every CONTENT_VERSION_TTL_SECONDS."""
+    from app.models import models
+    if content_versions_expired():
+        now = time.monotonic()
+        db = SessionLocal()
+        try:
+            settings = db.query(models.SiteSettings).first()
+            if settings:
+                for kind, column in CONTENT_VERSION_COLUMNS.items():
+                    value = getattr(settings, column, None)
+                    if value:
+                        state.content_versions[kind] = value
+        except Exception:
+            pass
+        finally:
+            db.close()
+        state.content_versions_checked_at = now
+
+    for kind in CONTENT_VERSION_COLUMNS:
+        state.content_versions.setdefault(kind, state.started_at)
+    return state.content_versions
+
+def set_content_updated_at(db: Session, kind: str, dt: datetime = None):
+    """Bump the version of a content kind (commits the session)."""
+    from app.models import models
+    dt = dt or datetime.now()
+    state.content_versions[kind] = dt
     try:
         settings = db.query(models.SiteSettings).first()
         if settings:
-            settings.rates_updated_at = dt
+            setattr(settings, CONTENT_VERSION_COLUMNS[kind], dt)
             db.commit()
     except Exception:
         pass
@@ -1,21 +1,40 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, status
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Request, status
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, Response
 # Reload trigger
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Union
+from functools import partial
+import asyncio
 from datetime import datetime, timedelta, timezone
 import enum
+import math
 import random
 import secrets
 import io
 import os
 from app.models import models
 from app.core import database
-from app.core.state import state, get_rates_updated_at, set_rates_updated_at
+from app.core.state import state, get_rates_updated_at, set_rates_updated_at, set_content_updated_at
+from app.core.http_cache import conditional_get
+from app.services.rates_cache import get_rate_snapshot
+from app.services.rates_service import CURRENCY_FLAGS, POPULAR_CURRENCIES
+from app.services.rates_upsert import RateUpsert
+from app.services.rates_upload_jobs import submit_rates_upload, run_on_upload_worker, get_rates_upload_job
+from app.services.reservation_list import page_reservations
+from app.services.reservation_rollups import ROLLUP_GROUPS, ensure_reservation_rollups, move_branch_rollups, reservation_analytics
+from app.services.reservation_expiry import kyiv_now, start_reservation_expiry, stop_reservation_expiry
+from app.services.rates_template import rates_template_file, TEMPLATE_MEDIA_TYPE
+from app.services.rates_ingest import parse_rates_csv, parse_rates_json, apply_rates_ingest
+from app.services.rates_parser import RatesWorkbook, BaseRatesSheet, SheetTable, cell, cell_text, parse_rate, rate_type
+from app.services.rates_quote import compute_quotes, MAX_QUOTES_PER_REQUEST
+from app.services import rate_history  # noqa: F401 - appends rate history on every publish
+from app.services.chat_hub import add_chat_message, mark_chat_read, query_session_messages, publish_message, publish_message_deleted, publish_session
+from sqlalchemy import and_, case, func
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from app.schemas import *
 import shutil
 import uuid
@@ -24,7 +43,7 @@ import urllib.parse
 import json
 from app.core.database import engine, get_db, SessionLocal
 from app.api.router import api_router
-from app.api.deps import require_admin, require_operator_or_admin, verify_credentials, security
+from app.api.deps import require_admin, require_operator_or_admin, verify_credentials, security, invalidate_auth_cache
 
 app = FastAPI(title="Світ Валют API", version="2.0.0")
 
@@ -37,6 +56,9 @@ run_migrations()
 # Register API router AFTER tables are created
 app.include_router(api_router, prefix="/api")
 
+# ETag / If-None-Match for public content; registered before CORS so 304s still carry CORS headers
+app.middleware("http")(conditional_get)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -58,11 +80,11 @@ app.add_middleware(
 os.makedirs("static/uploads", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Prevent caching of API responses
+# Prevent caching of API responses (ETag-validated responses are revalidated instead)
 @app.middleware("http")
 async def add_no_cache_headers(request, call_next):
     response = await call_next(request)
-    if request.url.path.startswith("/api/"):
+    if request.url.path.startswith("/api/") and "etag" not in response.headers:
         response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate"
         response.headers["Pragma"] = "no-cache"
     return response
@@ -186,6 +208,9 @@ currencies_data = [
     Currency(code="TRY", name="Turkish Lira", name_uk="Турецька ліра", flag="🇹🇷", buy_rate=1.20, sell_rate=1.30, is_popular=False),
 ]
 
+# (name, name_uk) of known currencies, for currencies first seen in an upload
+CURRENCY_NAMES = {c.code: (c.name, c.name_uk) for c in currencies_data}
+
 # Data migration helper
 def init_db_data(db: Session):
     # Migrate Site Settings
@@ -291,6 +316,7 @@ def startup_db_client():
     db = SessionLocal()
     try:
         init_db_data(db)
+        ensure_reservation_rollups()
         # Automatically generate sitemap on server restart
         try:
             from backend.generate_sitemap import generate_sitemap
@@ -309,6 +335,17 @@ def startup_db_client():
     finally:
         db.close()
 
+
+@app.on_event("startup")
+async def start_background_jobs():
+    # Pending reservations past expires_at are expired here, not on every list request
+    start_reservation_expiry()
+
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    stop_reservation_expiry()
+
 reservations_db: List[ReservationResponse] = []
 
 # Routes
@@ -357,81 +394,8 @@ async def root():
 @app.get("/api/currencies", response_model=list[Currency])
 async def get_currencies(branch_id: int = 1, db: Session = Depends(get_db)):
     """Get all available currencies with rates (Base Rates merged with Branch Overrides)"""
-    
-    # 1. Get ALL Base Rates (Active ones)
-    base_currencies = db.query(models.Currency).filter(models.Currency.is_active == True).order_by(models.Currency.order).all()
-    
-    # 2. Get Branch Overrides (ALL valid overrides for this branch)
-    # If an override exists and is_active=False, we must EXCLUDE the currency.
-    overrides = {}
-    if branch_id:
-        branch_rates = db.query(models.BranchRate).filter(
-            models.BranchRate.branch_id == branch_id
-        ).all()
-        overrides = {r.currency_code: r for r in branch_rates}
-    
-    result = []
-    for base in base_currencies:
-        # Check override
-        ov = overrides.get(base.code)
-        
-        is_active = ov.is_active if ov is not None else True
-        
-        if not is_active:
-            buy = 0.0
-            sell = 0.0
-            w_buy = 0.0
-            w_sell = 0.0
-            w_threshold = base.wholesale_threshold
-            w2_buy = 0.0
-            w2_sell = 0.0
-            w2_threshold = base.wholesale2_threshold
-        else:
-            buy = ov.buy_rate if (ov and ov.buy_rate > 0) else base.buy_rate
-            sell = ov.sell_rate if (ov and ov.sell_rate > 0) else base.sell_rate
-            w_buy = ov.wholesale_buy_rate if (ov and ov.wholesale_buy_rate > 0) else base.wholesale_buy_rate
-            w_sell = ov.wholesale_sell_rate if (ov and ov.wholesale_sell_rate > 0) else base.wholesale_sell_rate
-            w_threshold = ov.wholesale_threshold if (ov and ov.wholesale_threshold and ov.wholesale_threshold != 1000) else base.wholesale_threshold
-            w2_buy = ov.wholesale2_buy_rate if (ov and ov.wholesale2_buy_rate > 0) else base.wholesale2_buy_rate
-            w2_sell = ov.wholesale2_sell_rate if (ov and ov.wholesale2_sell_rate > 0) else base.wholesale2_sell_rate
-            w2_threshold = ov.wholesale2_threshold if (ov and ov.wholesale2_threshold) else base.wholesale2_threshold
-
-        result.append(Currency(
-            code=base.code,
-            name=base.name,
-            name_uk=base.name_uk,
-            flag=base.flag,
-            buy_rate=buy,
-            sell_rate=sell,
-            wholesale_buy_rate=w_buy,
-            wholesale_sell_rate=w_sell,
-            wholesale_threshold=w_threshold,
-            wholesale2_buy_rate=w2_buy,
-            wholesale2_sell_rate=w2_sell,
-            wholesale2_threshold=w2_threshold,
-            is_popular=base.is_popular,
-            is_active=is_active,
-            buy_url=base.buy_url,
-            sell_url=base.sell_url,
-            seo_h1=base.seo_h1,
-            seo_h2=base.seo_h2,
-            seo_image=base.seo_image,
-            seo_text=base.seo_text,
-            seo_buy_h1=base.seo_buy_h1,
-            seo_buy_h2=base.seo_buy_h2,
-            seo_buy_title=base.seo_buy_title,
-            seo_buy_desc=base.seo_buy_desc,
-            seo_buy_text=base.seo_buy_text,
-            seo_buy_image=base.seo_buy_image,
-            seo_sell_h1=base.seo_sell_h1,
-            seo_sell_h2=base.seo_sell_h2,
-            seo_sell_title=base.seo_sell_title,
-            seo_sell_desc=base.seo_sell_desc,
-            seo_sell_text=base.seo_sell_text,
-            seo_sell_image=base.seo_sell_image
-        ))
-        
-    return result
+    # Served from the in-memory snapshot; rebuilt only when rates_updated_at changes
+    return get_rate_snapshot(db).currency_list(branch_id)
 
 @app.get("/api/currencies/{code}", response_model=Currency)
 async def get_currency(code: str, db: Session = Depends(get_db)):
@@ -464,101 +428,17 @@ async def get_currency(code: str, db: Session = Depends(get_db)):
 @app.get("/api/rates/branch/{branch_id}", response_model=list[Currency])
 async def get_branch_rates(branch_id: int, db: Session = Depends(get_db)):
     """Get currency rates for a specific branch"""
-    today = datetime.now()
-    
-    # Enable joining BranchRate with Currency to get proper order and names
-    # Filter by Active Currencies (and Active Rates?)
-    # Generally we want to show all active currencies for the branch
-    
-    query = (
-        db.query(models.BranchRate, models.Currency)
-        .join(models.Currency, models.BranchRate.currency_code == models.Currency.code)
-        .filter(models.BranchRate.branch_id == branch_id)
-        .filter(models.BranchRate.is_active == True)
-        .filter(models.Currency.is_active == True)
-        .order_by(models.Currency.order)
-    )
-    
-    db_rates = query.all()
-    
-    # Fallback if no rates for this branch?
-    # If empty, maybe try branch 1?
-    if not db_rates:
-        # Try branch 1
-        query = (
-            db.query(models.BranchRate, models.Currency)
-            .join(models.Currency, models.BranchRate.currency_code == models.Currency.code)
-            .filter(models.BranchRate.branch_id == 1)
-            .filter(models.BranchRate.is_active == True)
-            .filter(models.Currency.is_active == True)
-            .order_by(models.Currency.order)
-        )
-        db_rates = query.all()
-    
-    result = []
-    for rate, curr in db_rates:
-        result.append(Currency(
-            code=curr.code,
-            name=curr.name,
-            name_uk=curr.name_uk,
-            flag=curr.flag,
-            buy_rate=rate.buy_rate,
-            sell_rate=rate.sell_rate,
-            wholesale_buy_rate=rate.wholesale_buy_rate,
-            wholesale_sell_rate=rate.wholesale_sell_rate,
-            wholesale_threshold=rate.wholesale_threshold if rate.wholesale_threshold else curr.wholesale_threshold,
-            wholesale2_buy_rate=rate.wholesale2_buy_rate,
-            wholesale2_sell_rate=rate.wholesale2_sell_rate,
-            wholesale2_threshold=rate.wholesale2_threshold if rate.wholesale2_threshold else curr.wholesale2_threshold,
-            is_popular=curr.is_popular,
-            is_active=curr.is_active,
-            buy_url=curr.buy_url,
-            sell_url=curr.sell_url,
-            seo_h1=curr.seo_h1,
-            seo_h2=curr.seo_h2,
-            seo_image=curr.seo_image,
-            seo_text=curr.seo_text,
-            seo_buy_h1=curr.seo_buy_h1,
-            seo_buy_h2=curr.seo_buy_h2,
-            seo_buy_title=curr.seo_buy_title,
-            seo_buy_desc=curr.seo_buy_desc,
-            seo_buy_text=curr.seo_buy_text,
-            seo_buy_image=curr.seo_buy_image,
-            seo_sell_h1=curr.seo_sell_h1,
-            seo_sell_h2=curr.seo_sell_h2,
-            seo_sell_title=curr.seo_sell_title,
-            seo_sell_desc=curr.seo_sell_desc,
-            seo_sell_text=curr.seo_sell_text,
-            seo_sell_image=curr.seo_sell_image
-        ))
-    return result
+    # Active branch rates ordered by Currency.order; falls back to branch 1 if the branch has none
+    return get_rate_snapshot(db).branch_currency_list(branch_id)
 
 @app.get("/api/rates")
 async def get_rates(db: Session = Depends(get_db)):
     """Get current exchange rates"""
-    # Join with Currency to sort by order
-    db_rates = (
-        db.query(models.BranchRate, models.Currency)
-        .join(models.Currency, models.BranchRate.currency_code == models.Currency.code)
-        .filter(models.BranchRate.branch_id == 1)
-        .filter(models.BranchRate.is_active == True)
-        .filter(models.Currency.is_active == True)
-        .order_by(models.Currency.order)
-        .all()
-    )
-    
-    # Construct rates dict using ordered list
-    # Python 3.7+ preserves insertion order in dicts
-    rates_dict = {}
-    for r, c in db_rates:
-        buy = r.buy_rate if r.buy_rate > 0 else c.buy_rate
-        sell = r.sell_rate if r.sell_rate > 0 else c.sell_rate
-        rates_dict[r.currency_code] = {"buy": buy, "sell": sell}
-        
+    snapshot = get_rate_snapshot(db)
     return {
-        "updated_at": get_rates_updated_at(db).isoformat(),
+        "updated_at": snapshot.version.isoformat(),
         "base": "UAH",
-        "rates": rates_dict
+        "rates": snapshot.simple_rates()
     }
 
 @app.get("/api/calculate")
@@ -641,6 +521,17 @@ async def calculate_exchange(
         "rate": rate
     }
 
+@app.post("/api/calculate/batch", response_model=QuoteBatchResponse)
+async def calculate_exchange_batch(request: QuoteBatchRequest, db: Session = Depends(get_db)):
+    """Calculate many (amount, from, to, branch) quotes in one request against the current rate snapshot"""
+    if len(request.quotes) > MAX_QUOTES_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"Too many quotes (max {MAX_QUOTES_PER_REQUEST})")
+    snapshot = get_rate_snapshot(db)
+    return {
+        "updated_at": snapshot.version.isoformat(),
+        "quotes": compute_quotes(snapshot, request.quotes)
+    }
+
 @app.get("/api/orders", response_model=list[Order])
 async def get_orders(
     type: Optional[str] = None,
@@ -699,6 +590,30 @@ async def update_branch_balances(
     db.commit()
     return {"message": "Balances updated successfully"}
 
+def reservation_response(r: models.Reservation) -> ReservationResponse:
+    """API shape of a reservation; list pages preload Reservation.branch so this adds no queries."""
+    branch = r.branch
+    return ReservationResponse(
+        id=r.id,
+        give_amount=r.give_amount,
+        give_currency=r.give_currency,
+        get_amount=r.get_amount,
+        get_currency=r.get_currency,
+        rate=r.rate,
+        phone=r.phone,
+        customer_name=r.customer_name,
+        status=r.status,
+        branch_id=r.branch_id,
+        branch_address=branch.address if branch else None,
+        branch_number=branch.number if branch else None,
+        created_at=r.created_at.isoformat(),
+        updated_at=r.updated_at.isoformat() if r.updated_at else None,
+        expires_at=r.expires_at.isoformat(),
+        completed_at=r.completed_at.isoformat() if r.completed_at else None,
+        operator_note=r.operator_note
+    )
+
+
 @app.post("/api/reservations", response_model=ReservationResponse)
 async def create_reservation(request: ReservationRequest, db: Session = Depends(get_db)):
     """Create a new currency reservation"""
@@ -806,25 +721,7 @@ async def create_reservation(request: ReservationRequest, db: Session = Depends(
     db.commit()
     db.refresh(db_res)
     
-    branch = db.query(models.Branch).filter(models.Branch.id == db_res.branch_id).first()
-    
-    return ReservationResponse(
-        id=db_res.id,
-        give_amount=db_res.give_amount,
-        give_currency=db_res.give_currency,
-        get_amount=db_res.get_amount,
-        get_currency=db_res.get_currency,
-        rate=db_res.rate,
-        phone=db_res.phone,
-        customer_name=db_res.customer_name,
-        status=db_res.status,
-        branch_id=db_res.branch_id,
-        branch_address=branch.address if branch else None,
-        branch_number=branch.number if branch else None,
-        created_at=db_res.created_at.isoformat(),
-        updated_at=db_res.updated_at.isoformat() if db_res.updated_at else None,
-        expires_at=db_res.expires_at.isoformat()
-    )
+    return reservation_response(db_res)
 
 @app.get("/api/reservations/{reservation_id}", response_model=ReservationResponse)
 async def get_reservation(reservation_id: int, db: Session = Depends(get_db)):
@@ -833,27 +730,7 @@ async def get_reservation(reservation_id: int, db: Session = Depends(get_db)):
     if not db_res:
         raise HTTPException(status_code=404, detail="Reservation not found")
     
-    branch = db.query(models.Branch).filter(models.Branch.id == db_res.branch_id).first()
-    
-    return ReservationResponse(
-        id=db_res.id,
-        give_amount=db_res.give_amount,
-        give_currency=db_res.give_currency,
-        get_amount=db_res.get_amount,
-        get_currency=db_res.get_currency,
-        rate=db_res.rate,
-        phone=db_res.phone,
-        customer_name=db_res.customer_name,
-        status=db_res.status,
-        branch_id=db_res.branch_id,
-        branch_address=branch.address if branch else None,
-        branch_number=branch.number if branch else None,
-        created_at=db_res.created_at.isoformat(),
-        updated_at=db_res.updated_at.isoformat() if db_res.updated_at else None,
-        expires_at=db_res.expires_at.isoformat(),
-        completed_at=db_res.completed_at.isoformat() if db_res.completed_at else None,
-        operator_note=db_res.operator_note
-    )
+    return reservation_response(db_res)
 
 @app.get("/api/health")
 async def health_check():
@@ -929,35 +806,93 @@ async def upload_image(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not save image: {str(e)}")
 
-@app.post("/api/admin/rates/upload", response_model=RatesUploadResponseV2)
+@app.post("/api/admin/rates/upload", response_model=Union[RatesUploadJob, RatesUploadPreview], status_code=202)
 async def upload_rates(
+    response: Response,
     file: UploadFile = File(...),
-    user: User = Depends(require_admin),
-    db: Session = Depends(get_db)
+    dry_run: bool = False,
+    user: User = Depends(require_admin)
 ):
     """
-    Upload Excel file with rates.
+    Queue an Excel file with rates for processing (see apply_rates_upload).
+    Returns the job right away; poll GET /api/admin/rates/upload/{job_id} for the result.
+    With dry_run=true the file is parsed and compared with the current rates instead:
+    the diff is returned directly and nothing is written or published.
+    """
+    if not file.filename.endswith(('.xlsx', '.xls')):
+        raise HTTPException(status_code=400, detail="File must be .xlsx or .xls")
+
+    import zipfile
+    contents = await file.read()
+    if not zipfile.is_zipfile(io.BytesIO(contents)):
+        raise HTTPException(status_code=400, detail="Невірний формат файлу. Будь ласка, завантажте коректний .xlsx файл.")
+
+    if dry_run:
+        response.status_code = 200
+        return await asyncio.wrap_future(run_on_upload_worker(partial(apply_rates_upload, dry_run=True), contents))
+
+    return await run_in_threadpool(submit_rates_upload, apply_rates_upload, contents, file.filename, user.username)
+
+
+@app.get("/api/admin/rates/upload/{job_id}", response_model=RatesUploadJob)
+async def get_rates_upload_status(job_id: str, user: User = Depends(require_admin)):
+    """Status, progress and counts of a rates upload job."""
+    job = await run_in_threadpool(get_rates_upload_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Завантаження не знайдено")
+    return job
+
+
+@app.post("/api/admin/rates/ingest", response_model=RatesUploadResponseV2)
+async def ingest_rates(request: Request, user: User = Depends(require_admin)):
+    """
+    Publish rates from a machine-readable document (e.g. the treasury system).
+    application/json: RatesIngestRequest, base and branch rates as equally long columns.
+    text/csv: branch_id,currency_code,buy_rate,sell_rate[,wholesale_buy_rate,wholesale_sell_rate];
+    rows with an empty branch_id are base rates.
+    The document is validated as a whole (400 with all errors, nothing written), then applied
+    in one transaction with the same FINAL SYNC and publish as the Excel upload.
+    """
+    global currencies_data
+
+    body = await request.body()
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    if content_type in ("text/csv", "application/csv"):
+        doc = parse_rates_csv(body)
+    elif content_type == "application/json":
+        doc = parse_rates_json(body)
+    else:
+        raise HTTPException(status_code=415, detail="Use application/json or text/csv")
+
+    result = await asyncio.wrap_future(run_on_upload_worker(apply_rates_ingest, doc))
+
+    codes = {c.strip().upper() for c in doc.base.code}
+    for cd in currencies_data:
+        cd.is_active = cd.code in codes
+    return result
+
+
+def apply_rates_upload(db: Session, contents: bytes, progress=None, dry_run: bool = False) -> Union[RatesUploadResponseV2, RatesUploadPreview]:
+    """
+    Apply an Excel file with rates. Runs in the rates upload worker, not on the event loop.
     Supports two formats:
     1. Base rates: 'Курси' or first sheet
     2. Branch rates: 'Відділення' (Vertical format) or Sheet with branch columns (Matrix)
+    All changes are committed together and published at the end.
+    dry_run: compute the same changes, return their diff and roll back.
     """
     global currencies_data
-    
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="File must be .xlsx or .xls")
+    progress = progress or (lambda stage, rows_processed=None: None)
     
     try:
-        import pandas as pd
         import zipfile
-        import io # Ensure io is imported for BytesIO
+        from openpyxl.utils.exceptions import InvalidFileException
     except ImportError:
-        raise HTTPException(status_code=500, detail="Необхідні бібліотеки (pandas, zipfile) не встановлені.")
+        raise HTTPException(status_code=500, detail="Необхідні бібліотеки (openpyxl, zipfile) не встановлені.")
 
     try:
-        contents = await file.read()
-        xlsx = pd.ExcelFile(io.BytesIO(contents)) # Use io.BytesIO for pd.ExcelFile
-        sheet_names = [s.lower() for s in xlsx.sheet_names]
-    except zipfile.BadZipFile:
+        workbook = RatesWorkbook(contents)
+    except (zipfile.BadZipFile, InvalidFileException):
         print("DEBUG: BadZipFile Error")
         raise HTTPException(status_code=400, detail="Невірний формат файлу. Будь ласка, завантажте коректний .xlsx файл.")
     except ValueError as e:
@@ -974,498 +909,262 @@ async def upload_rates(
         branch_updated = 0
         processed_codes = set()
         explicitly_updated_branches = set()  # Track (branch_id, currency_code) pairs updated from Excel
+        # Existing currencies / branch rates / branches in keyed maps; written back in bulk at the end
+        store = RateUpsert(db)
         
-        # 1. Process BASE RATES
-        base_sheet = None
-        if 'курси' in sheet_names:
-            base_sheet = xlsx.sheet_names[sheet_names.index('курси')]
-        elif 'rates' in sheet_names:
-            base_sheet = xlsx.sheet_names[sheet_names.index('rates')]
-        else:
-            base_sheet = xlsx.sheet_names[0]
+        # 1. Process BASE RATES ('Курси' / 'Rates' or the first sheet)
+        base_sheet = workbook.base_sheet
         
-        # Detect format:
+        # Detect format (header row = first row naming a code/currency column):
         # Standard: Row 0 = Headers
         # Old "ID" row: Row 0 = ID, Row 1 = Headers
         # New "3-row": Row 0 = Number, Row 1 = Address, Row 2 = Headers
+        progress("base_rates", 0)
+        sheet = BaseRatesSheet(workbook.rows(base_sheet))
+        header_row = sheet.header_row
+        row_headers = sheet.headers
         
-        # Read first 10 rows to dynamically find the header row
-        df_preview = pd.read_excel(xlsx, sheet_name=base_sheet, header=None, nrows=10)
-        
-        header_row = 0
         branch_col_definitions = {} # {col_idx: {'branch_id': ..., 'type': ...}}
-        branch_col_map = {}
         
-        if not df_preview.empty:
-            for i, row in df_preview.iterrows():
-                row_vals = [str(x).lower() for x in row.values]
-                if any('код' in x or 'code' in x or 'валют' in x for x in row_vals):
-                    header_row = i
-                    break
-                    
-            if header_row >= 2:
-                # Check for 3-row format (Addresses in header_row - 1, Numbers in header_row - 2)
-                row_numbers = df_preview.iloc[header_row - 2].astype(str).values
-                row_addresses = df_preview.iloc[header_row - 1].astype(str).values
-                row_headers = df_preview.iloc[header_row].astype(str).values
-                
-                # We check if there are any valid addresses to trigger this branch logic
-                has_valid_addresses = any(str(x).strip() and str(x).strip() != 'nan' and 'unnamed' not in str(x).lower() for x in row_addresses[2:])
-                
-                if has_valid_addresses:
-                # Start logging checking logic
-                    print(f"DEBUG BRANCH DETECT: row_numbers={row_numbers.tolist()}")
-                    print(f"DEBUG BRANCH DETECT: row_addresses={row_addresses.tolist()}")
-                    print(f"DEBUG BRANCH DETECT: row_headers={row_headers.tolist()}")
-                    
-                    current_branch = None
-                    for i in range(2, len(row_numbers)):
-                        addr_val = str(row_addresses[i]).strip()
-                        number_val = str(row_numbers[i]).strip()
-                        
-                        if addr_val and addr_val != 'nan' and 'unnamed' not in addr_val.lower():
-                            branch = None
-                            new_number = None
-
-                            import re
-                            match = re.search(r'(\d+)', number_val)
-                            if match:
-                                new_number = int(match.group(1))
-                            
-                            print(f"DEBUG BRANCH: Col {i}, addr='{addr_val}', number={new_number}")
-                            
-                            if new_number:
-                                # Prioritize exact number match
-                                branch = db.query(models.Branch).filter(models.Branch.number == new_number).first()
-                                print(f"DEBUG BRANCH: Number lookup {new_number} -> {'FOUND id=' + str(branch.id) if branch else 'NOT FOUND'}")
-                                # If branch exists but address changed, we update the address
-                                if branch and branch.address != addr_val:
-                                    branch.address = addr_val
-                                    db.add(branch)
-                            
-                            if not branch:
-                                # Try exact address match. BUT if we have a new_number, 
-                                # we must restrict this to branches that either have no number yet, 
-                                # or have the exact same number, to prevent merging "№ 612" into "№ 611" just because they share an address.
-                                query = db.query(models.Branch).filter(models.Branch.address == addr_val)
-                                if new_number:
-                                    # Only map to an existing address-matched branch if its number is unset or matches our target number
-                                    from sqlalchemy import or_
-                                    query = query.filter(or_(models.Branch.number == None, models.Branch.number == new_number))
-                                
-                                branch = query.first()
-                                print(f"DEBUG BRANCH: Exact addr lookup '{addr_val}' (with safety) -> {'FOUND id=' + str(branch.id) if branch else 'NOT FOUND'}")
-                            
-                            if not branch:
-                                # Check if another branch exists at this address to copy coordinates
-                                existing_at_addr = db.query(models.Branch).filter(models.Branch.address == addr_val).first()
-                                
-                                print(f"DEBUG BRANCH: Creating new branch addr='{addr_val}', number={new_number}")
-                                branch = models.Branch(
-                                    address=addr_val,
-                                    number=new_number or (db.query(models.Branch).count() + 1),
-                                    order=i,
-                                    is_open=True,
-                                    hours=existing_at_addr.hours if existing_at_addr else "щодня: 8:00-20:00",
-                                    lat=existing_at_addr.lat if existing_at_addr else 50.4501,
-                                    lng=existing_at_addr.lng if existing_at_addr else 30.5234,
-                                    phone=existing_at_addr.phone if existing_at_addr else None,
-                                    telegram_chat=existing_at_addr.telegram_chat if existing_at_addr else None
-                                )
-                                db.add(branch)
-                                db.commit()
-                                db.refresh(branch)
-                                print(f"DEBUG BRANCH: Created branch id={branch.id}")
-                                
-                            if branch:
-                                current_branch = branch
-                                print(f"DEBUG BRANCH: current_branch set to id={branch.id}, addr='{branch.address}'")
-                        
-                        # Map EVERY column (including those without an address) to its branch
-                        if current_branch:
-                            h_val = str(row_headers[i]).lower()
-                            rate_type = None
-                            if 'опт' in h_val:
-                                if 'куп' in h_val: rate_type = 'wholesale_buy'
-                                elif 'прод' in h_val: rate_type = 'wholesale_sell'
-                            else:
-                                if 'куп' in h_val: rate_type = 'buy'
-                                elif 'прод' in h_val: rate_type = 'sell'
-                                
-                            if rate_type:
-                                branch_col_definitions[i] = {'branch_id': current_branch.id, 'type': rate_type}
-                                print(f"DEBUG BRANCH: Mapped Col {i} ({rate_type}) to branch id={current_branch.id}")
-                                
-            elif header_row == 1:
-                # 2-Row format (could be Numbers or Addresses in header_row - 1)
-                row_identifiers = df_preview.iloc[0].astype(str).values
-                row_headers = df_preview.iloc[1].astype(str).values
-                order_counter = 1
+        if header_row >= 2:
+            # Check for 3-row format (Addresses in header_row - 1, Numbers in header_row - 2)
+            row_numbers = sheet.branch_header[header_row - 2]
+            row_addresses = sheet.branch_header[header_row - 1]
+            
+            # We check if there are any valid addresses to trigger this branch logic
+            has_valid_addresses = any(cell_text(cell(row_addresses, i)) for i in range(2, sheet.width))
+            
+            if has_valid_addresses:
                 current_branch = None
-                
-                for i in range(2, len(row_identifiers)):
-                    val = str(row_identifiers[i]).strip()
-                    if val and val.lower() != 'nan' and 'unnamed' not in val.lower():
+                for i in range(2, sheet.width):
+                    addr_val = cell_text(cell(row_addresses, i))
+                    number_val = cell_text(cell(row_numbers, i))
+                    
+                    if addr_val:
+                        branch = None
+                        new_number = None
+
                         import re
-                        match = re.search(r'(\d+)', val)
-                        bid = int(match.group(1)) if match else None
+                        match = re.search(r'(\d+)', number_val)
+                        if match:
+                            new_number = int(match.group(1))
                         
-                        b = None
-                        if bid:
-                            b = db.query(models.Branch).filter(models.Branch.number == bid).first()
-                        if not b:
-                            b = db.query(models.Branch).filter(models.Branch.address == val).first()
+                        if new_number:
+                            # Prioritize exact number match
+                            branch = store.resolver.by_number(new_number)
+                            # If branch exists but address changed, we update the address
+                            if branch and branch.address != addr_val:
+                                branch.address = addr_val
+                                store.resolver.add(branch)
                         
-                        if not b:
-                            b = models.Branch(
-                                address=val if not bid or len(val) > 5 else f"Відділення {bid}",
-                                number=bid or (db.query(models.Branch).count() + 1),
-                                order=order_counter,
+                        if not branch:
+                            # Try address match (normalized, then fuzzy). BUT if we have a new_number, 
+                            # we must restrict this to branches that either have no number yet, 
+                            # or have the exact same number, to prevent merging "№ 612" into "№ 611" just because they share an address.
+                            branch = store.resolver.by_address(addr_val, number=new_number)
+                        
+                        if not branch:
+                            # Check if another branch exists at this address to copy coordinates
+                            existing_at_addr = store.resolver.by_address(addr_val)
+                            
+                            branch = models.Branch(
+                                address=addr_val,
+                                number=new_number or (len(store.resolver) + 1),
+                                order=i,
                                 is_open=True,
-                                hours="щодня: 8:00-20:00",
-                                lat=50.4501,
-                                lng=30.5234
+                                hours=existing_at_addr.hours if existing_at_addr else "щодня: 8:00-20:00",
+                                lat=existing_at_addr.lat if existing_at_addr else 50.4501,
+                                lng=existing_at_addr.lng if existing_at_addr else 30.5234,
+                                phone=existing_at_addr.phone if existing_at_addr else None,
+                                telegram_chat=existing_at_addr.telegram_chat if existing_at_addr else None
                             )
-                            db.add(b)
-                            db.commit()
-                            db.refresh(b)
+                            store.add_branch(branch)
                             
-                        current_branch = b
-                        if b.order != order_counter:
-                            b.order = order_counter
-                            db.add(b)
-                            db.commit()
-                        order_counter += 1
-                        
+                        if branch:
+                            current_branch = branch
+                    
+                    # Map EVERY column (including those without an address) to its branch
                     if current_branch:
-                        h_val = str(row_headers[i]).lower()
-                        rate_type = None
-                        if 'опт' in h_val:
-                            if 'куп' in h_val: rate_type = 'wholesale_buy'
-                            elif 'прод' in h_val: rate_type = 'wholesale_sell'
-                        else:
-                            if 'куп' in h_val: rate_type = 'buy'
-                            elif 'прод' in h_val: rate_type = 'sell'
+                        col_type = rate_type(cell(row_headers, i))
+                        if col_type:
+                            branch_col_definitions[i] = {'branch_id': current_branch.id, 'type': col_type}
                             
-                        if rate_type:
-                            branch_col_definitions[i] = {'branch_id': current_branch.id, 'type': rate_type}
-
-        # Read actual data
-        df_base = pd.read_excel(xlsx, sheet_name=base_sheet, header=header_row)
-        print(f"DEBUG: Header Row: {header_row}, DF Shape: {df_base.shape}")
-        
-        # Deduplicate base columns
-        new_cols_base = []
-        counts_base = {}
-        for col in df_base.columns:
-            c_clean = str(col).strip().lower()
-            if c_clean in counts_base:
-                counts_base[c_clean] += 1
-                new_cols_base.append(f"{c_clean}_{counts_base[c_clean]}")
-            else:
-                counts_base[c_clean] = 0
-                new_cols_base.append(c_clean)
-        df_base.columns = new_cols_base
-        
-        # Find columns
-        # ... (standard find logic)
-        code_col = next((c for c in df_base.columns if any(x in str(c).lower() for x in ['код', 'code', 'iso'])), None)
-        if not code_col:
-             code_col = next((c for c in df_base.columns if any(x in str(c).lower() for x in ['валют', 'currency']) and not any(x in str(c).lower() for x in ['назва', 'name'])), None)
-             
-        name_col = next((c for c in df_base.columns if c != code_col and any(x in str(c).lower() for x in ['назва', 'name', 'валют', 'currency'])), None)
-        buy_col = next((c for c in df_base.columns if any(x in str(c).lower() for x in ['купів', 'buy', 'покуп']) and not 'опт' in str(c).lower()), None)
-        sell_col = next((c for c in df_base.columns if any(x in str(c).lower() for x in ['прода', 'sell']) and not 'опт' in str(c).lower()), None)
-        wholesale_buy_col = next((c for c in df_base.columns if 'опт' in str(c).lower() and any(x in str(c).lower() for x in ['купів', 'buy', 'покуп'])), None)
-        wholesale_sell_col = next((c for c in df_base.columns if 'опт' in str(c).lower() and any(x in str(c).lower() for x in ['прода', 'sell'])), None)
-        flag_col = next((c for c in df_base.columns if any(x in str(c).lower() for x in ['прапор', 'flag'])), None)
-        
-        if code_col and 'валют' in str(code_col).lower() and not 'код' in str(code_col).lower():
-             first_valid = df_base[df_base[code_col].notna()].head(1)
-             if not first_valid.empty and len(str(first_valid.iloc[0][code_col])) > 3:
-                 code_col = None
- 
-        if not code_col or code_col == buy_col or code_col == sell_col:
-             for col in df_base.columns:
-                 sample = df_base[df_base[col].notna()].head(3)
-                 if not sample.empty and all(len(str(x).strip()) == 3 and str(x).strip().isalpha() for x in sample[col]):
-                     code_col = col
-                     break
+        elif header_row == 1:
+            # 2-Row format (could be Numbers or Addresses in header_row - 1)
+            row_identifiers = sheet.branch_header[0]
+            order_counter = 1
+            current_branch = None
+            
+            for i in range(2, sheet.width):
+                val = cell_text(cell(row_identifiers, i))
+                if val:
+                    import re
+                    match = re.search(r'(\d+)', val)
+                    bid = int(match.group(1)) if match else None
+                    
+                    b = store.resolver.by_number(bid)
+                    if not b:
+                        b = store.resolver.by_address(val)
+                    
+                    if not b:
+                        b = models.Branch(
+                            address=val if not bid or len(val) > 5 else f"Відділення {bid}",
+                            number=bid or (len(store.resolver) + 1),
+                            order=order_counter,
+                            is_open=True,
+                            hours="щодня: 8:00-20:00",
+                            lat=50.4501,
+                            lng=30.5234
+                        )
+                        store.add_branch(b)
+                        
+                    current_branch = b
+                    if b.order != order_counter:
+                        b.order = order_counter
+                    order_counter += 1
+                    
+                if current_branch:
+                    col_type = rate_type(cell(row_headers, i))
+                    if col_type:
+                        branch_col_definitions[i] = {'branch_id': current_branch.id, 'type': col_type}
  
-        if code_col and buy_col and sell_col:
-            for idx, row in df_base.iterrows():
-                if idx < 3: print(f"DEBUG: Process Loop Row {idx}")
-                try:
-                    code_val = row[code_col]
-                    if pd.isna(code_val): continue
-                    code = str(code_val).strip().upper()
-                    if len(code) != 3: continue
+        # Rows come typed from the parser: 3-letter code, positive buy/sell, wholesale 0.0 when empty
+        for rate_row in sheet:
+            idx = rate_row.index
+            progress("base_rates", idx + 1)
+            code = rate_row.code
+            buy_rate = rate_row.buy_rate
+            sell_rate = rate_row.sell_rate
+            wholesale_buy = rate_row.wholesale_buy_rate
+            wholesale_sell = rate_row.wholesale_sell_rate
+            try:
+                # Determine Flag and Name
+                flag = rate_row.flag or CURRENCY_FLAGS.get(code, "🏳️")
+                name_uk = rate_row.name_uk
+                
+                # 2. Branch values of this row: {branch_id: {buy: ..., sell: ..., ...}}
+                branch_updates = {}
+                for col_idx, defs in branch_col_definitions.items():
+                    val_float = parse_rate(cell(rate_row.cells, col_idx))
+                    if val_float is None or val_float <= 0: continue
+                    branch_updates.setdefault(defs['branch_id'], {})[defs['type']] = val_float
+                
+                # Backfill Global Wholesale if missing
+                if wholesale_buy <= 0 and branch_updates:
+                    for b_data in branch_updates.values():
+                        if b_data.get('wholesale_buy', 0) > 0:
+                            wholesale_buy = b_data['wholesale_buy']
+                            break
+                
+                if wholesale_sell <= 0 and branch_updates:
+                    for b_data in branch_updates.values():
+                        if b_data.get('wholesale_sell', 0) > 0:
+                            wholesale_sell = b_data['wholesale_sell']
+                            break
+
+                # Upsert Currency (Base Rate)
+                curr_db = store.currency(code)
+                if curr_db:
+                    changes = dict(
+                        buy_rate=buy_rate, sell_rate=sell_rate,
+                        wholesale_buy_rate=wholesale_buy, wholesale_sell_rate=wholesale_sell,
+                        is_active=True
+                    )
+                    if not curr_db['flag'] or rate_row.flag:
+                        changes['flag'] = flag
+                    if name_uk:
+                         # Optional: update 'name' too
+                         changes['name_uk'] = changes['name'] = name_uk
+                    store.set_currency(curr_db, **changes)
+                    base_updated += 1
+                else:
+                    names = CURRENCY_NAMES.get(code, (code, code))
+                    final_name = name_uk if name_uk else names[0]
+                    final_name_uk = name_uk if name_uk else names[1]
                     
-                    try:
-                        b_val = str(row[buy_col]).replace(',', '.').replace(' ', '').strip()
-                        buy_rate = float(b_val)
-                        s_val = str(row[sell_col]).replace(',', '.').replace(' ', '').strip()
-                        sell_rate = float(s_val)
-                    except:
-                        continue
+                    store.add_currency(
+                        code=code, name=final_name, name_uk=final_name_uk,
+                        buy_rate=buy_rate, sell_rate=sell_rate,
+                        wholesale_buy_rate=wholesale_buy, wholesale_sell_rate=wholesale_sell,
+                        flag=flag,
+                        is_active=True, is_popular=code in POPULAR_CURRENCIES
+                    )
+                    base_updated += 1
+                
+                processed_codes.add(code)
                     
-                    if buy_rate <= 0 or sell_rate <= 0: continue
+                # Update cache
+                existing_cache = next((c for c in currencies_data if c.code == code), None)
+                if existing_cache:
+                    existing_cache.buy_rate = buy_rate
+                    existing_cache.sell_rate = sell_rate
+                    existing_cache.wholesale_buy_rate = wholesale_buy
+                    existing_cache.wholesale_sell_rate = wholesale_sell
+            
+                # 2. Process BRANCH RATES (2-/3-row formats: branch columns next to the base rates)
+                for b_id, rates in branch_updates.items():
+                    br_rate = store.branch_rate(b_id, code)
                     
-                    wholesale_buy = 0.0
-                    wholesale_sell = 0.0
-                    if wholesale_buy_col and pd.notna(row[wholesale_buy_col]):
-                         try: 
-                             wb_val = str(row[wholesale_buy_col]).replace(',', '.').replace(' ', '').strip()
-                             wholesale_buy = float(wb_val)
-                         except: pass
-                    if wholesale_sell_col and pd.notna(row[wholesale_sell_col]):
-                         try: 
-                             ws_val = str(row[wholesale_sell_col]).replace(',', '.').replace(' ', '').strip()
-                             wholesale_sell = float(ws_val)
-                         except: pass
+                    # Fallback to global values if missing
+                    r_buy = rates.get('buy', 0)
+                    if r_buy <= 0 and buy_rate > 0: r_buy = buy_rate
                     
-                    # Determine Flag
-                    flag = "🏳️"
-                    if flag_col and pd.notna(row[flag_col]):
-                        flag = str(row[flag_col]).strip()
-                    else:
-                        flag = CURRENCY_FLAGS.get(code, "🏳️")
+                    r_sell = rates.get('sell', 0)
+                    if r_sell <= 0 and sell_rate > 0: r_sell = sell_rate
 
-                    # Determine Name
-                    name_uk = None
-                    if name_col and pd.notna(row[name_col]):
-                        name_uk = str(row[name_col]).strip()
-                    
-                    # 2. Process BRANCH RATES
-                    branch_updates = {} # {branch_id: {buy: ..., sell: ..., ...}}
+                    w_buy = rates.get('wholesale_buy', 0)
+                    if w_buy <= 0 and wholesale_buy > 0: w_buy = wholesale_buy
                     
-                    if branch_col_definitions:
-                        # Pre-fill all branches so backfill works even if local rates are empty
-                        for defs in branch_col_definitions.values():
-                             if defs['branch_id'] not in branch_updates:
-                                 branch_updates[defs['branch_id']] = {}
-
-                        if idx < 3:
-                             print(f"DEBUG: Row {idx} Values: {row.values.tolist()}")
-                        
-                        for col_idx, defs in branch_col_definitions.items():
-                            if col_idx >= len(row): continue
-                            
-                            val = row.iloc[col_idx]
-                            
-                            if pd.isna(val): continue
-                            
-                            try:
-                                val_str = str(val).replace(',', '.').replace(' ', '').strip()
-                                val_float = float(val_str)
-                                
-                                if val_float <= 0: continue
-                                
-                                b_id = defs['branch_id']
-                                r_type = defs['type']
-                                
-                                if b_id not in branch_updates:
-                                    branch_updates[b_id] = {}
-                                branch_updates[b_id][r_type] = val_float
-                            except Exception as e:
-                                pass
-                        
-                        if idx < 3:
-                            print(f"DEBUG: Branch Updates Row {idx}: {branch_updates}")
-
-                    # Backfill Global Wholesale if missing
-                    if wholesale_buy <= 0 and branch_updates:
-                        for b_data in branch_updates.values():
-                            if b_data.get('wholesale_buy', 0) > 0:
-                                wholesale_buy = b_data['wholesale_buy']
-                                if idx < 3: print(f"DEBUG: Backfilled Wholesale Buy: {wholesale_buy}")
-                                break
+                    w_sell = rates.get('wholesale_sell', 0)
+                    if w_sell <= 0 and wholesale_sell > 0: w_sell = wholesale_sell
                     
-                    if wholesale_sell <= 0 and branch_updates:
-                        for b_data in branch_updates.values():
-                            if b_data.get('wholesale_sell', 0) > 0:
-                                wholesale_sell = b_data['wholesale_sell']
-                                if idx < 3: print(f"DEBUG: Backfilled Wholesale Sell: {wholesale_sell}")
-                                break
-
-                    # Upsert Currency (Base Rate)
-                    curr_db = db.query(models.Currency).filter(models.Currency.code == code).first()
-                    if curr_db:
-                        curr_db.buy_rate = buy_rate
-                        curr_db.sell_rate = sell_rate
-                        curr_db.wholesale_buy_rate = wholesale_buy
-                        curr_db.wholesale_sell_rate = wholesale_sell
-                        curr_db.is_active = True
-                        if not curr_db.flag or (flag_col and pd.notna(row[flag_col])):
-                            curr_db.flag = flag
-                        if name_uk:
-                             curr_db.name_uk = name_uk
-                             # Optional: update 'name' too
-                             curr_db.name = name_uk 
-                        base_updated += 1
-                    else:
-                        names = CURRENCY_NAMES.get(code, (code, code))
-                        final_name = name_uk if name_uk else names[0]
-                        final_name_uk = name_uk if name_uk else names[1]
-                        
-                        curr_db = models.Currency(
-                            code=code, name=final_name, name_uk=final_name_uk,
-                            buy_rate=buy_rate, sell_rate=sell_rate,
-                            wholesale_buy_rate=wholesale_buy, wholesale_sell_rate=wholesale_sell,
-                            flag=flag,
-                            is_active=True, is_popular=code in POPULAR_CURRENCIES
+                    if not br_rate:
+                        store.add_branch_rate(
+                            branch_id=b_id,
+                            currency_code=code,
+                            buy_rate=r_buy,
+                            sell_rate=r_sell,
+                            wholesale_buy_rate=w_buy,
+                            wholesale_sell_rate=w_sell
                         )
-                        db.add(curr_db)
-                        db.commit()
-                        db.refresh(curr_db)
-                        base_updated += 1
+                    else:
+                        changes = {}
+                        if r_buy > 0: changes['buy_rate'] = r_buy
+                        if r_sell > 0: changes['sell_rate'] = r_sell
+                        if w_buy > 0: changes['wholesale_buy_rate'] = w_buy
+                        if w_sell > 0: changes['wholesale_sell_rate'] = w_sell
+                        store.set_branch_rate(br_rate, **changes)
                     
-                    processed_codes.add(code)
-                        
-                    # Update cache
-                    existing_cache = next((c for c in currencies_data if c.code == code), None)
-                    if existing_cache:
-                        existing_cache.buy_rate = buy_rate
-                        existing_cache.sell_rate = sell_rate
-                        existing_cache.wholesale_buy_rate = wholesale_buy
-                        existing_cache.wholesale_sell_rate = wholesale_sell
-                
-                
-                
-                    # 2. Process BRANCH RATES
-                    # If we found branch_col_definitions (New 3-Row Format), use it
-                    if branch_col_definitions:
-                        if idx < 3:
-                             print(f"DEBUG: Row {idx} Values: {row.values.tolist()}")
-                             
-                        # Group values by branch first
-                        branch_updates = {} # {branch_id: {buy: ..., sell: ..., ...}}
-                        
-                        for col_idx, defs in branch_col_definitions.items():
-                            if col_idx >= len(row): continue
-                            
-                            val = row.iloc[col_idx]
-                            if idx < 3: print(f"DEBUG: Row {idx} Col {col_idx} RAW: {val} (isna: {pd.isna(val)})")
-                            
-                            if pd.isna(val): continue
-                            
-                            try:
-                                val_str = str(val).replace(',', '.').replace(' ', '').strip()
-                                val_float = float(val_str)
-                                if idx < 5: # Only debug first few rows
-                                     print(f"DEBUG: Row {idx} Col {col_idx} ({defs['type']}): '{val}' -> {val_float}")
-                                
-                                if val_float <= 0: continue
-                                
-                                b_id = defs['branch_id']
-                                r_type = defs['type']
-                                
-                                if b_id not in branch_updates:
-                                    branch_updates[b_id] = {}
-                                branch_updates[b_id][r_type] = val_float
-                            except Exception as e:
-                                if idx < 5:
-                                    print(f"DEBUG: Failed to parse '{val}': {e}")
-                                pass
-                        
-                        # Apply updates
-                        if idx < 5:
-                            print(f"DEBUG: Branch Updates Row {idx}: {branch_updates}")
-                        
-                        for b_id, rates in branch_updates.items():
-                            # Continue even if local rates are empty, because we should backfill with base rates
-                            
-                            br_rate = db.query(models.BranchRate).filter(
-                                models.BranchRate.branch_id == b_id,
-                                models.BranchRate.currency_code == code
-                            ).first()
-                            
-                            # Fallback to global values if missing
-                            r_buy = rates.get('buy', 0)
-                            if r_buy <= 0 and buy_rate > 0: r_buy = buy_rate
-                            
-                            r_sell = rates.get('sell', 0)
-                            if r_sell <= 0 and sell_rate > 0: r_sell = sell_rate
-
-                            w_buy = rates.get('wholesale_buy', 0)
-                            if w_buy <= 0 and wholesale_buy > 0: w_buy = wholesale_buy
-                            
-                            w_sell = rates.get('wholesale_sell', 0)
-                            if w_sell <= 0 and wholesale_sell > 0: w_sell = wholesale_sell
-                            
-                            if not br_rate:
-                                br_rate = models.BranchRate(
-                                    branch_id=b_id,
-                                    currency_code=code,
-                                    buy_rate=r_buy,
-                                    sell_rate=r_sell,
-                                    wholesale_buy_rate=w_buy,
-                                    wholesale_sell_rate=w_sell
-                                )
-                                db.add(br_rate)
-                            else:
-                                if r_buy > 0: br_rate.buy_rate = r_buy
-                                if r_sell > 0: br_rate.sell_rate = r_sell
-                                if w_buy > 0: br_rate.wholesale_buy_rate = w_buy
-                                if w_sell > 0: br_rate.wholesale_sell_rate = w_sell
-                            
-                            explicitly_updated_branches.add((b_id, code))
-                            branch_updated += 1
-
-                        pass
-            
-                except Exception:
-                    pass
-            
-            db.commit()
+                    explicitly_updated_branches.add((b_id, code))
+                    branch_updated += 1
         
-        # 2. Process BRANCH RATES
-        branch_sheet = None
-        if 'відділення' in sheet_names:
-            branch_sheet = xlsx.sheet_names[sheet_names.index('відділення')]
-        elif 'branches' in sheet_names:
-            branch_sheet = xlsx.sheet_names[sheet_names.index('branches')]
-        elif 'філії' in sheet_names:
-            branch_sheet = xlsx.sheet_names[sheet_names.index('філії')]
-        elif base_sheet:
-            # Fallback: Check if base_sheet contains branch columns
-            # This supports the single-sheet hybrid format
-            branch_sheet = base_sheet
-            
-        if branch_sheet and branch_sheet != base_sheet: # Only process if it's a separate sheet
-            df_branch = pd.read_excel(xlsx, sheet_name=branch_sheet)
-            
-            # Deduplicate columns (handle '$' and '$ ' becoming same after strip)
-            new_cols = []
-            counts = {}
-            for col in df_branch.columns:
-                c_clean = str(col).strip().lower()
-                if c_clean in counts:
-                    counts[c_clean] += 1
-                    new_cols.append(f"{c_clean}_{counts[c_clean]}")
-                else:
-                    counts[c_clean] = 0
-                    new_cols.append(c_clean)
-            df_branch.columns = new_cols
+            except Exception:
+                pass
+        
+        # 2. Process BRANCH RATES from a separate sheet ('Відділення' / 'Branches' / 'Філії')
+        branch_sheet = workbook.branch_sheet
+        if branch_sheet:
+            progress("branch_rates")
+            table = SheetTable(workbook.rows(branch_sheet))
+            columns = table.columns
             
             # Check format type
-            has_branch_col = any(x in str(c).lower() for c in df_branch.columns for x in ['відділ', 'branch', 'філі', 'каса', 'cashier'])
+            has_branch_col = any(x in c for c in columns for x in ['відділ', 'branch', 'філі', 'каса', 'cashier'])
             
             if has_branch_col:
                 # Vertical Format OR Hybrid Matrix (Row=Branch)
-                branch_col_name = next((c for c in df_branch.columns if any(x in str(c).lower() for x in ['відділ', 'branch', 'філі'])), None)
-                cashier_col_name = next((c for c in df_branch.columns if any(x in str(c).lower() for x in ['каса', 'cashier', 'касир'])), None)
-                code_col_b = next((c for c in df_branch.columns if any(x in str(c).lower() for x in ['код', 'code', 'валют'])), None)
-                buy_col_b = next((c for c in df_branch.columns if any(x in str(c).lower() for x in ['купів', 'buy'])), None)
-                sell_col_b = next((c for c in df_branch.columns if any(x in str(c).lower() for x in ['прода', 'sell'])), None)
+                branch_col = table.find(['відділ', 'branch', 'філі'])
+                cashier_col = table.find(['каса', 'cashier', 'касир'])
+                code_col_b = table.find(['код', 'code', 'валют'])
+                buy_col_b = table.find(['купів', 'buy'])
+                sell_col_b = table.find(['прода', 'sell'])
 
                 # Check for Branch Matrix Cols (Hybrid)
                 # Map lower cased symbols and codes to canonical codes
                 # FIX: Include ALL currencies from DB + allowed defaults to ensure we don't skip valid ones
-                all_currencies_db = db.query(models.Currency).all()
                 curr_map = {}
-                for c in all_currencies_db:
-                    curr_map[c.code.lower()] = c.code
+                for code in store.currencies:
+                    curr_map[code.lower()] = code
                 
                 # Also ensure ORDERED_CURRENCIES are in the map even if not in DB yet (though they should be)
                 for code in ORDERED_CURRENCIES:
@@ -1479,8 +1178,7 @@ async def upload_rates(
                 curr_map['gbp'] = 'GBP'
                 curr_map['chf'] = 'CHF'
                 matrix_cols = []
-                for idx, col in enumerate(df_branch.columns):
-                    c_clean = str(col).strip() # already lower cased by deduplication
+                for idx, c_clean in enumerate(columns):
                     found_curr = None
                     
                     # Exact match to find the "Buy" column (the first one, no suffix)
@@ -1488,14 +1186,13 @@ async def upload_rates(
                         found_curr = curr_map[c_clean]
                     
                     # If we found a "Buy" column, the next one is "Sell"
-                    if found_curr and idx + 1 < len(df_branch.columns):
+                    if found_curr and idx + 1 < len(columns):
                          mc = {'code': found_curr, 'buy_idx': idx, 'sell_idx': idx + 1}
                          
                          # Check for Wholesale columns (idx+2, idx+3)
                          # We enable wholesale reading if we have enough columns and they are not another currency's start
-                         if idx + 3 < len(df_branch.columns):
-                             next_c_clean = str(df_branch.columns[idx+2]).strip()
-                             if next_c_clean not in curr_map:
+                         if idx + 3 < len(columns):
+                             if columns[idx + 2] not in curr_map:
                                  mc['wh_buy_idx'] = idx + 2
                                  mc['wh_sell_idx'] = idx + 3
                          
@@ -1506,83 +1203,62 @@ async def upload_rates(
                 
                 # Cache branches for cashier lookup if needed
                 branch_cashier_map = {}
-                if cashier_col_name:
-                     all_branches = db.query(models.Branch).all()
-                     for b in all_branches:
+                if cashier_col is not None:
+                     for b in store.branches.values():
                          if b.cashier:
                              branch_cashier_map[b.cashier.strip().lower()] = b.id
 
-                for row_idx, (_, row) in enumerate(df_branch.iterrows(), start=1):
+                for row_idx, row in enumerate(table, start=1):
                     try:
                         branch_id = None
                         # Resolve Branch ID
-                        if branch_col_name and pd.notna(row[branch_col_name]):
+                        bid_val = cell(row, branch_col)
+                        if bid_val is not None:
                             try:
-                                bid_val = row[branch_col_name]
                                 if isinstance(bid_val, (int, float)):
                                     branch_id = int(bid_val)
                                 else:
                                     branch_id = int(str(bid_val).strip())
                             except: pass
                         
-                        if not branch_id and cashier_col_name and pd.notna(row[cashier_col_name]):
-                            c_val = str(row[cashier_col_name]).strip().lower()
+                        if not branch_id and cell(row, cashier_col) is not None:
+                            c_val = cell_text(cell(row, cashier_col)).lower()
                             branch_id = branch_cashier_map.get(c_val)
                         
                         if not branch_id: continue
                         
                         # Update branch order by row index
-                        try:
-                            br_model = db.query(models.Branch).filter(models.Branch.id == branch_id).first()
-                            if br_model and br_model.order != row_idx:
-                                br_model.order = row_idx
-                                db.add(br_model)
-                        except: pass
+                        br_model = store.branches.get(branch_id)
+                        if br_model and br_model.order != row_idx:
+                            br_model.order = row_idx
 
                         # 1. Process Matrix Columns (Hybrid/Row-Matrix)
                         if use_hybrid:
                             for mc in matrix_cols:
                                 try:
-                                    buy_val = row.iloc[mc['buy_idx']]
-                                    sell_val = row.iloc[mc['sell_idx']]
-                                    if pd.isna(buy_val) or pd.isna(sell_val): continue
-                                    
-                                    buy_str = str(buy_val).replace(',', '.').replace(' ', '').strip()
-                                    sell_str = str(sell_val).replace(',', '.').replace(' ', '').strip()
-                                    if buy_str == '-' or sell_str == '-': continue
-                                    
-                                    buy = float(buy_str)
-                                    sell = float(sell_str)
+                                    buy = parse_rate(cell(row, mc['buy_idx']))
+                                    sell = parse_rate(cell(row, mc['sell_idx']))
+                                    if buy is None or sell is None: continue
 
                                     wh_buy = 0.0
                                     wh_sell = 0.0
                                     if 'wh_buy_idx' in mc and 'wh_sell_idx' in mc:
-                                        try:
-                                            wh_buy_val = row.iloc[mc['wh_buy_idx']]
-                                            wh_sell_val = row.iloc[mc['wh_sell_idx']]
-                                            if pd.notna(wh_buy_val):
-                                                wh_b_str = str(wh_buy_val).replace(',', '.').replace(' ', '').strip()
-                                                if wh_b_str and wh_b_str != '-': wh_buy = float(wh_b_str)
-                                            if pd.notna(wh_sell_val):
-                                                wh_s_str = str(wh_sell_val).replace(',', '.').replace(' ', '').strip()
-                                                if wh_s_str and wh_s_str != '-': wh_sell = float(wh_s_str)
-                                        except: pass
+                                        wh_buy = parse_rate(cell(row, mc['wh_buy_idx'])) or 0.0
+                                        wh_sell = parse_rate(cell(row, mc['wh_sell_idx'])) or 0.0
                                     
                                     # Upsert
-                                    rate_entry = db.query(models.BranchRate).filter(
-                                        models.BranchRate.branch_id == branch_id,
-                                        models.BranchRate.currency_code == mc['code']
-                                    ).first()
+                                    rate_entry = store.branch_rate(branch_id, mc['code'])
                                     if rate_entry:
-                                        rate_entry.buy_rate = buy
-                                        rate_entry.sell_rate = sell
-                                        rate_entry.wholesale_buy_rate = wh_buy
-                                        rate_entry.wholesale_sell_rate = wh_sell
-                                        rate_entry.is_active = True
+                                        store.set_branch_rate(
+                                            rate_entry,
+                                            buy_rate=buy, sell_rate=sell,
+                                            wholesale_buy_rate=wh_buy, wholesale_sell_rate=wh_sell,
+                                            is_active=True
+                                        )
                                         processed_codes.add(mc['code'])
                                     else:
                                         # Check if currency exists, if not construct it (safe fallback)
-                                        key_active = db.query(models.Currency).filter(models.Currency.code == mc['code']).first()
+                                        key_active = store.currency(mc['code'])
                                         if not key_active:
                                             # Create missing currency on the fly
                                             # Try to find metadata from defaults
@@ -1591,7 +1267,7 @@ async def upload_rates(
                                             name_uk = default_meta.name_uk if default_meta else mc['code']
                                             flag = default_meta.flag if default_meta else "🏳️"
                                             
-                                            new_curr = models.Currency(
+                                            store.add_currency(
                                                 code=mc['code'],
                                                 name=name,
                                                 name_uk=name_uk,
@@ -1600,10 +1276,8 @@ async def upload_rates(
                                                 buy_rate=buy, # Set base rate to first branch rate found
                                                 sell_rate=sell
                                             )
-                                            db.add(new_curr)
-                                            db.flush() # flush to make it available for FK
                                         
-                                        db.add(models.BranchRate(
+                                        store.add_branch_rate(
                                             branch_id=branch_id, 
                                             currency_code=mc['code'], 
                                             buy_rate=buy, 
@@ -1611,7 +1285,7 @@ async def upload_rates(
                                             wholesale_buy_rate=wh_buy, 
                                             wholesale_sell_rate=wh_sell, 
                                             is_active=True
-                                        ))
+                                        )
                                     branch_updated += 1
                                 except Exception as e:
                                     # print(f"Error processing {mc['code']}: {e}")
@@ -1627,23 +1301,19 @@ async def upload_rates(
                             pass
 
                         # 2. Process Vertical Columns (ONLY if NOT hybrid OR fallback needed)
-                        elif all([code_col_b, buy_col_b, sell_col_b]):
+                        elif all(c is not None for c in (code_col_b, buy_col_b, sell_col_b)):
                             try:
-                                code = str(row[code_col_b]).strip().upper()
-                                buy = float(row[buy_col_b])
-                                sell = float(row[sell_col_b])
+                                code = cell_text(cell(row, code_col_b)).upper()
+                                buy = parse_rate(cell(row, buy_col_b))
+                                sell = parse_rate(cell(row, sell_col_b))
+                                if not code or buy is None or sell is None: continue
                                 
-                                rate_entry = db.query(models.BranchRate).filter(
-                                    models.BranchRate.branch_id == branch_id,
-                                    models.BranchRate.currency_code == code
-                                ).first()
+                                rate_entry = store.branch_rate(branch_id, code)
                                 if rate_entry:
-                                    rate_entry.buy_rate = buy
-                                    rate_entry.sell_rate = sell
-                                    rate_entry.is_active = True
+                                    store.set_branch_rate(rate_entry, buy_rate=buy, sell_rate=sell, is_active=True)
                                 else:
                                     # Fallback create currency
-                                    key_active = db.query(models.Currency).filter(models.Currency.code == code).first()
+                                    key_active = store.currency(code)
                                     if not key_active:
                                         # Validate code length
                                         if len(code) != 3: continue
@@ -1653,14 +1323,12 @@ async def upload_rates(
                                         name_uk = default_meta.name_uk if default_meta else code
                                         flag = default_meta.flag if default_meta else "🏳️"
                                         
-                                        new_curr = models.Currency(
+                                        store.add_currency(
                                             code=code, name=name, name_uk=name_uk, flag=flag,
                                             is_active=True, buy_rate=buy, sell_rate=sell
                                         )
-                                        db.add(new_curr)
-                                        db.flush()
 
-                                    db.add(models.BranchRate(branch_id=branch_id, currency_code=code, buy_rate=buy, sell_rate=sell, is_active=True))
+                                    store.add_branch_rate(branch_id=branch_id, currency_code=code, buy_rate=buy, sell_rate=sell, is_active=True)
                                 branch_updated += 1
                             except: pass
 
@@ -1668,40 +1336,38 @@ async def upload_rates(
                         errors.append(f"Відділення (ряд): {str(e)}")
             else:
                 # Matrix Format (Legacy: Row=Currency, Cols=Branches[1_buy, 1_sell])
-                code_col_b = next((c for c in df_branch.columns if any(x in str(c).lower() for x in ['код', 'code', 'валют'])), df_branch.columns[0])
+                code_col_b = table.find(['код', 'code', 'валют'])
+                if code_col_b is None: code_col_b = 0
                 
                 branch_cols = {}
-                for col in df_branch.columns:
-                    if col == code_col_b: continue
+                for i, col in enumerate(columns):
+                    if i == code_col_b: continue
                     import re
                     match = re.search(r'(\d+)', col)
                     if match:
                         bid = int(match.group(1))
                         if bid not in branch_cols: branch_cols[bid] = {}
-                        if any(x in col for x in ['купів', 'buy']): branch_cols[bid]['buy'] = col
-                        elif any(x in col for x in ['прода', 'sell']): branch_cols[bid]['sell'] = col
+                        if any(x in col for x in ['купів', 'buy']): branch_cols[bid]['buy'] = i
+                        elif any(x in col for x in ['прода', 'sell']): branch_cols[bid]['sell'] = i
                 
-                for _, row in df_branch.iterrows():
+                for row in table:
                     try:
-                        code = str(row[code_col_b]).strip().upper()
-                        if not code or code == 'NAN': continue
+                        code = cell_text(cell(row, code_col_b)).upper()
+                        if not code: continue
                         
                         for bid, cols in branch_cols.items():
                             if 'buy' in cols and 'sell' in cols:
                                 try:
-                                    buy = float(row[cols['buy']])
-                                    sell = float(row[cols['sell']])
+                                    buy = parse_rate(cell(row, cols['buy']))
+                                    sell = parse_rate(cell(row, cols['sell']))
+                                    if buy is None or sell is None: continue
                                     
-                                    rate_entry = db.query(models.BranchRate).filter(
-                                        models.BranchRate.branch_id == bid,
-                                        models.BranchRate.currency_code == code
-                                    ).first()
+                                    rate_entry = store.branch_rate(bid, code)
                                     
                                     if rate_entry:
-                                        rate_entry.buy_rate = buy
-                                        rate_entry.sell_rate = sell
+                                        store.set_branch_rate(rate_entry, buy_rate=buy, sell_rate=sell)
                                     else:
-                                        key_active = db.query(models.Currency).filter(models.Currency.code == code).first()
+                                        key_active = store.currency(code)
                                         if not key_active:
                                              if len(code) != 3: continue
                                              default_meta = next((c for c in currencies_data if c.code == code), None)
@@ -1709,89 +1375,55 @@ async def upload_rates(
                                              name_uk = default_meta.name_uk if default_meta else code
                                              flag = default_meta.flag if default_meta else "🏳️"
                                              
-                                             new_curr = models.Currency(
+                                             store.add_currency(
                                                 code=code, name=name, name_uk=name_uk, flag=flag,
                                                 is_active=True, buy_rate=buy, sell_rate=sell
                                              )
-                                             db.add(new_curr)
-                                             db.flush()
                                         
-                                        db.add(models.BranchRate(
+                                        store.add_branch_rate(
                                             branch_id=bid,
                                             currency_code=code,
                                             buy_rate=buy,
                                             sell_rate=sell
-                                        ))
+                                        )
                                     explicitly_updated_branches.add((bid, code))
                                     branch_updated += 1
                                 except: pass
                     except Exception as e:
                         errors.append(f"Відділення (матриця): {str(e)}")
 
-            db.commit()
+        workbook.close()
 
+        progress("sync")
         if processed_codes:
-            # Final database sync for missing currencies
-            missing_currencies = db.query(models.Currency).filter(
-                models.Currency.is_active == True,
-                ~models.Currency.code.in_(processed_codes)
-            ).all()
-            
-            for mc in missing_currencies:
-                mc.is_active = False
-                print(f"SYNC: Deactivating currency {mc.code} (missing from Excel)")
-            
-            # Also deactivate branch overrides for these
-            db.query(models.BranchRate).filter(
-                ~models.BranchRate.currency_code.in_(processed_codes)
-            ).update({models.BranchRate.is_active: False}, synchronize_session=False)
-            
-            db.commit()
-            
-            # Sync base rates to BranchRate table for branches NOT explicitly updated
-            # This ensures all branches reflect the new base rates from the Excel
-            all_branches = db.query(models.Branch).all()
-            for code in processed_codes:
-                base_curr = db.query(models.Currency).filter(models.Currency.code == code).first()
-                if not base_curr:
-                    continue
-                for branch in all_branches:
-                    # Skip branches that were explicitly set from Excel columns
-                    if (branch.id, code) in explicitly_updated_branches:
-                        continue
-                    
-                    br = db.query(models.BranchRate).filter(
-                        models.BranchRate.branch_id == branch.id,
-                        models.BranchRate.currency_code == code
-                    ).first()
-                    if br:
-                        # Only update if NOT explicitly disabled for this branch
-                        if br.is_active:
-                            br.buy_rate = base_curr.buy_rate
-                            br.sell_rate = base_curr.sell_rate
-                            br.wholesale_buy_rate = base_curr.wholesale_buy_rate
-                            br.wholesale_sell_rate = base_curr.wholesale_sell_rate
-                    else:
-                        # Create BranchRate entry
-                        br = models.BranchRate(
-                            branch_id=branch.id,
-                            currency_code=code,
-                            buy_rate=base_curr.buy_rate,
-                            sell_rate=base_curr.sell_rate,
-                            wholesale_buy_rate=base_curr.wholesale_buy_rate,
-                            wholesale_sell_rate=base_curr.wholesale_sell_rate,
-                            is_active=True
-                        )
-                        db.add(br)
-                    branch_updated += 1
-            db.commit()
+            # Deactivate currencies missing from the file, copy base rates to branches it did not set
+            branch_updated += store.final_sync(processed_codes, explicitly_updated_branches)
             
             # Update global cache
-            for cd in currencies_data:
-                if cd.code not in processed_codes:
-                    cd.is_active = False
-                else:
-                    cd.is_active = True
+            if not dry_run:
+                for cd in currencies_data:
+                    if cd.code not in processed_codes:
+                        cd.is_active = False
+                    else:
+                        cd.is_active = True
+        
+        if dry_run:
+            changes = store.diff()
+            db.rollback()
+            summary = {f"{table}_{kind}": len(items) for table, groups in changes.items() for kind, items in groups.items()}
+            return RatesUploadPreview(
+                message="Попередній перегляд: зміни не збережено",
+                base_rates_updated=base_updated,
+                branch_rates_updated=branch_updated,
+                errors=errors[:10],
+                summary=summary,
+                **changes
+            )
+        
+        # One bulk write and a single commit for the whole upload
+        progress("publish")
+        store.flush()
+        db.commit()
             
         set_rates_updated_at(db)
         
@@ -1810,153 +1442,13 @@ async def upload_rates(
         raise HTTPException(status_code=500, detail=f"Помилка обробки файлу: {str(e)}")
 
 @app.get("/api/admin/rates/template")
-async def download_rates_template(
-    user: User = Depends(require_operator_or_admin),
-    db: Session = Depends(get_db)
-):
-    """Download Excel template for rates upload with vertical layout (Rows=Currencies, Cols=Branches)"""
-    from fastapi.responses import StreamingResponse
-    import pandas as pd
-    from openpyxl.utils import get_column_letter
-    from openpyxl.styles import Alignment, Font, PatternFill
-    
-    output = io.BytesIO()
-    
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        # Sheet "Курси"
-        
-        # 1. Fetch Data
-        branches = db.query(models.Branch).order_by(models.Branch.number).all()
-        all_rates = db.query(models.BranchRate).all()
-        
-        # Map: (branch_id, code) -> rate
-        rates_map = {(r.branch_id, r.currency_code): r for r in all_rates}
-        
-        # Map: code -> currency info (for names/flags)
-        db_currencies = db.query(models.Currency).all()
-        curr_info_map = {c.code: c for c in db_currencies}
+async def download_rates_template(user: User = Depends(require_operator_or_admin)):
+    """Download Excel template for rates upload with vertical layout (Rows=Currencies, Cols=Branches)
 
-        # 2. Prepare Columns (Row 3 headers)
-        # Base Columns
-        columns = ['Код', 'Прапор', 'Валюта']
-        
-        # Branch Columns - repeated for each branch
-        for branch in branches:
-            columns.extend(['Купівля', 'Продаж', 'Опт Купівля', 'Опт Продаж'])
-            
-        data_rows = []
-        
-        # 3. Build Rows (Iterate Strict List)
-        for code in ORDERED_CURRENCIES:
-            # Get info or default
-            curr_info = curr_info_map.get(code)
-            
-            # Default values if currency not in DB yet
-            flag = curr_info.flag if curr_info else CURRENCY_FLAGS.get(code, "🏳️")
-            name_uk = curr_info.name_uk if curr_info else CURRENCY_NAMES.get(code, (code, code))[1]
-            
-            row = [code, flag, name_uk]
-            
-            for branch in branches:
-                rate = rates_map.get((branch.id, code))
-                
-                # Default to 0.00 if no rate exists
-                buy = rate.buy_rate if rate else 0.00
-                sell = rate.sell_rate if rate else 0.00
-                wh_buy = rate.wholesale_buy_rate if rate else 0.00
-                wh_sell = rate.wholesale_sell_rate if rate else 0.00
-                
-                row.extend([buy, sell, wh_buy, wh_sell])
-            
-            data_rows.append(row)
-            
-        # Create DataFrame
-        df = pd.DataFrame(data_rows, columns=columns)
-        
-        # Write to Excel, starting at row 2 (0-indexed logic in pandas, so startrow=2 means Excel Row 3)
-        # We need space for Top Headers (Row 1 & 2)
-        df.to_excel(writer, index=False, sheet_name='Курси', startrow=2)
-        
-        # Access the workbook and sheet
-        workbook = writer.book
-        worksheet = writer.sheets['Курси']
-        
-        # Styles
-        header_font = Font(bold=True)
-        center_align = Alignment(horizontal='center', vertical='center')
-        
-        # Colors (approximate brand or logical colors)
-        fill_buy = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid") # Light Green
-        fill_sell = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid") # Light Red/Pink
-        fill_opt_buy = PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid") # Pale Green
-        fill_opt_sell = PatternFill(start_color="FCE4D6", end_color="FCE4D6", fill_type="solid") # Pale Orange
-        fill_neutral = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid") # Grey
-
-        # 4. Add Top Headers (Row 1 & 2)
-        # ... (Same as before) ...
-        # Apply Logic for Row 3 Styling (Headers)
-        for col_idx, col_name in enumerate(columns, 1):
-             cell = worksheet.cell(row=3, column=col_idx)
-             name_str = str(col_name).lower()
-             
-             if 'опт' in name_str and 'купів' in name_str:
-                 cell.fill = fill_opt_buy
-             elif 'опт' in name_str and 'прода' in name_str:
-                 cell.fill = fill_opt_sell
-             elif 'купів' in name_str:
-                 cell.fill = fill_buy
-             elif 'прода' in name_str:
-                 cell.fill = fill_sell
-             else:
-                 cell.fill = fill_neutral
-                 
-             cell.font = header_font
-             cell.alignment = center_align
-        # Row 1: Branch Numbers
-        # Row 2: Branch Addresses
-        
-        current_col = 4 # Column D (1-based index)
-        for branch in branches:
-            # Merge 4 cells
-            start_col_letter = get_column_letter(current_col)
-            end_col_letter = get_column_letter(current_col + 3)
-            cell_range_r1 = f"{start_col_letter}1:{end_col_letter}1"
-            cell_range_r2 = f"{start_col_letter}2:{end_col_letter}2"
-            
-            # Row 1: Number (Editable)
-            worksheet.merge_cells(cell_range_r1)
-            cell_r1 = worksheet.cell(row=1, column=current_col)
-            # Just the number, maybe with "№" prefix or just raw number? 
-            # User asked for "Number", let's put just number or "№ X"
-            # If user edits it to just "5", we need to parse.
-            # Let's stick to "№ {number}" for display, but user can edit.
-            cell_r1.value = f"№ {branch.number if branch.number else branch.id}" 
-            cell_r1.font = header_font
-            cell_r1.alignment = center_align
-
-            # Row 2: Address (Identifier for logic if number changes)
-            worksheet.merge_cells(cell_range_r2)
-            cell_r2 = worksheet.cell(row=2, column=current_col)
-            cell_r2.value = branch.address
-            cell_r2.font = header_font
-            cell_r2.alignment = center_align
-            
-            current_col += 4
-            
-        # Adjust column widths
-        for i, col in enumerate(df.columns):
-            # +1 because openpyxl is 1-indexed
-            col_letter = get_column_letter(i + 1)
-            worksheet.column_dimensions[col_letter].width = 15 if i > 2 else 10 # Wider for rates
-            
-    
-    output.seek(0)
-    
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=svit_valut_rates.xlsx"}
-    )
+    Built once per rates version and branch list, then served from the on-disk cache.
+    """
+    path = await run_in_threadpool(rates_template_file, ORDERED_CURRENCIES, CURRENCY_NAMES)
+    return FileResponse(path, media_type=TEMPLATE_MEDIA_TYPE, filename="svit_valut_rates.xlsx")
 
 
 
@@ -1965,40 +1457,29 @@ async def calculate_cross_exchange(
     amount: float,
     from_currency: str,
     to_currency: str,
+    branch_id: int = 1,
     db: Session = Depends(get_db)
 ):
-    """Calculate exchange using automatic 2-step conversion via UAH"""
+    """Calculate exchange using automatic 2-step conversion via UAH (lookup in the precomputed cross matrix)"""
     from_currency = from_currency.upper()
     to_currency = to_currency.upper()
     
     if from_currency == to_currency:
         return {"from_amount": amount, "to_amount": amount, "rate": 1.0}
     
-    # Calculate via UAH
-    # Step 1: FROM -> UAH (Buy rate for from_currency)
-    # Step 2: UAH -> TO (Sell rate for to_currency)
-    
-    from_r = db.query(models.BranchRate).filter(models.BranchRate.branch_id == 1, models.BranchRate.currency_code == from_currency).first()
-    to_r = db.query(models.BranchRate).filter(models.BranchRate.branch_id == 1, models.BranchRate.currency_code == to_currency).first()
-    
-    if from_currency == "UAH":
-        if not to_r:
+    # FROM -> UAH at the from_currency buy rate, UAH -> TO at the to_currency sell rate
+    rates = get_rate_snapshot(db).cross_rate(branch_id, from_currency, to_currency)
+    if rates is None:
+        if from_currency == "UAH":
             raise HTTPException(status_code=404, detail=f"Currency {to_currency} not found")
-        to_amount = amount / to_r.sell_rate
-        effective_rate = 1 / to_r.sell_rate
-    elif to_currency == "UAH":
-        if not from_r:
+        if to_currency == "UAH":
             raise HTTPException(status_code=404, detail=f"Currency {from_currency} not found")
-        to_amount = amount * from_r.buy_rate
-        effective_rate = from_r.buy_rate
-    else:
-        if not from_r or not to_r:
-            raise HTTPException(status_code=404, detail="Currency not found")
-        
-        # FROM -> UAH -> TO
-        uah_amount = amount * from_r.buy_rate
-        to_amount = uah_amount / to_r.sell_rate
-        effective_rate = from_r.buy_rate / to_r.sell_rate
+        raise HTTPException(status_code=404, detail="Currency not found")
+    
+    effective_rate = rates[0]
+    if not math.isfinite(effective_rate):
+        raise HTTPException(status_code=500, detail="Calculation error due to zero rates")
+    to_amount = amount * effective_rate
     
     return {
         "from_amount": amount,
@@ -2051,6 +1532,7 @@ async def update_branch_rate(
                 # Use Base Rate -> Delete Branch Override
                 if rate:
                     db.delete(rate)
+                    set_rates_updated_at(db)
                     db.commit()
                 return {"message": "Reverted to Base Rate"}
                 
@@ -2136,78 +1618,95 @@ async def get_all_rates_admin(user: models.User = Depends(require_admin), db: Se
         "branches": branches_out
     }
 
-@app.get("/api/admin/dashboard", response_model=DashboardStats)
-async def get_admin_dashboard(user: models.User = Depends(require_admin), db: Session = Depends(get_db)):
-    """Get admin dashboard statistics"""
+def reservation_dashboard_stats(db: Session, pending_statuses, branch_id: Optional[int] = None) -> DashboardStats:
+    """DashboardStats from one conditional-aggregate query plus the pending ids, optionally for one branch."""
+    R = models.Reservation
     today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    total = db.query(models.Reservation).count()
-    
-    pending_query = db.query(models.Reservation).filter(
-        models.Reservation.status.in_([models.ReservationStatus.PENDING, models.ReservationStatus.PENDING_ADMIN])
-    )
-    pending = pending_query.count()
-    pending_ids = [r[0] for r in pending_query.with_entities(models.Reservation.id).all()]
-    
-    confirmed = db.query(models.Reservation).filter(models.Reservation.status == models.ReservationStatus.CONFIRMED).count()
-    completed_today = db.query(models.Reservation).filter(
-        models.Reservation.status == models.ReservationStatus.COMPLETED,
-        models.Reservation.completed_at >= today_start
-    ).count()
-    
-    # Volume Today
-    volume_today_reservations = db.query(models.Reservation).filter(
-        models.Reservation.status == models.ReservationStatus.COMPLETED,
-        models.Reservation.completed_at >= today_start,
-        (models.Reservation.get_currency == "UAH") | (models.Reservation.give_currency == "UAH")
-    ).all()
-    
-    total_volume_uah = sum(
-        r.get_amount if r.get_currency == "UAH" else r.give_amount
-        for r in volume_today_reservations
-    )
-    
-    # Calculate MONTHLY volume
     month_start = today_start.replace(day=1)
-    
-    volume_month_reservations = db.query(models.Reservation).filter(
-        models.Reservation.status == models.ReservationStatus.COMPLETED,
-        models.Reservation.completed_at >= month_start,
-        (models.Reservation.get_currency == "UAH") | (models.Reservation.give_currency == "UAH")
-    ).all()
-    
-    total_volume_uah_month = sum(
-        r.get_amount if r.get_currency == "UAH" else r.give_amount
-        for r in volume_month_reservations
+
+    completed = R.status == models.ReservationStatus.COMPLETED
+    completed_today = and_(completed, R.completed_at >= today_start)
+
+    def uah_volume(since):
+        # UAH side of the deal: what the client got in UAH, otherwise what they gave
+        done = and_(completed, R.completed_at >= since)
+        return func.coalesce(func.sum(case(
+            (and_(done, R.get_currency == "UAH"), R.get_amount),
+            (and_(done, R.give_currency == "UAH"), R.give_amount),
+            else_=0.0
+        )), 0.0)
+
+    def count_if(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    query = db.query(
+        func.count(R.id),
+        count_if(R.status == models.ReservationStatus.CONFIRMED),
+        count_if(completed_today),
+        uah_volume(today_start),
+        uah_volume(month_start),
     )
-    
+    pending_query = db.query(R.id).filter(R.status.in_(pending_statuses))
+    if branch_id:
+        query = query.filter(R.branch_id == branch_id)
+        pending_query = pending_query.filter(R.branch_id == branch_id)
+
+    total, confirmed, completed_count, volume_today, volume_month = query.one()
+    pending_ids = [r[0] for r in pending_query.all()]
+
     return DashboardStats(
         total_reservations=total,
-        pending_reservations=pending,
+        pending_reservations=len(pending_ids),
         confirmed_reservations=confirmed,
-        completed_today=completed_today,
-        total_volume_uah=total_volume_uah,
-        total_volume_uah_month=total_volume_uah_month,
+        completed_today=completed_count,
+        total_volume_uah=volume_today,
+        total_volume_uah_month=volume_month,
         pending_ids=pending_ids
     )
 
-def auto_expire_reservations(db: Session):
+@app.get("/api/admin/dashboard", response_model=DashboardStats)
+async def get_admin_dashboard(user: models.User = Depends(require_admin), db: Session = Depends(get_db)):
+    """Get admin dashboard statistics"""
+    return reservation_dashboard_stats(db, [models.ReservationStatus.PENDING, models.ReservationStatus.PENDING_ADMIN])
+
+@app.get("/api/admin/analytics/reservations", response_model=ReservationAnalytics)
+async def get_reservation_analytics(
+    user: models.User = Depends(require_admin),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    group_by: str = "branch,currency",
+    branch_id: Optional[int] = None,
+    currency: Optional[str] = None,
+    status: Optional[models.ReservationStatus] = None,
+    db: Session = Depends(get_db)
+):
+    """Reservation counts and UAH / foreign volumes by branch, currency, status and period.
+
+    Dates are YYYY-MM-DD of reservation creation in Kyiv time, date_to inclusive (default: the last 30 days).
+    group_by is a comma separated subset of branch, currency, status and one of hour / day / month.
+    Soft-deleted reservations are left out unless status=deleted is asked for.
+    """
+    groups = [g.strip() for g in group_by.split(",") if g.strip()]
+    unknown = [g for g in groups if g not in ROLLUP_GROUPS]
+    if unknown or len({"hour", "day", "month"} & set(groups)) > 1:
+        raise HTTPException(status_code=400, detail=f"group_by must be a subset of: {', '.join(ROLLUP_GROUPS)} (one period at most)")
     try:
-        from zoneinfo import ZoneInfo
-        kyiv = ZoneInfo("Europe/Kyiv")
-        now = datetime.now(kyiv).replace(tzinfo=None)
-    except ImportError:
-        now = datetime.utcnow() + timedelta(hours=2)
+        end = datetime.strptime(date_to, "%Y-%m-%d") if date_to else kyiv_now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = datetime.strptime(date_from, "%Y-%m-%d") if date_from else end - timedelta(days=29)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    if start > end:
+        raise HTTPException(status_code=400, detail="date_from is after date_to")
 
-    expired_res = db.query(models.Reservation).filter(
-        models.Reservation.status.in_([models.ReservationStatus.PENDING, models.ReservationStatus.PENDING_ADMIN]),
-        models.Reservation.expires_at < now
-    ).all()
-    
-    if expired_res:
-        for r in expired_res:
-             r.status = models.ReservationStatus.EXPIRED
-        db.commit()
+    if status:
+        statuses = [status.value]
+    else:
+        statuses = [s.value for s in models.ReservationStatus if s != models.ReservationStatus.DELETED]
+    result = reservation_analytics(
+        db, start, end + timedelta(days=1), groups,
+        branch_id=branch_id, currency=currency.upper() if currency else None, statuses=statuses
+    )
+    return ReservationAnalytics(date_from=start.strftime("%Y-%m-%d"), date_to=end.strftime("%Y-%m-%d"), group_by=groups, **result)
 
 @app.get("/api/admin/reservations")
 async def get_all_reservations(
@@ -2218,10 +1717,10 @@ async def get_all_reservations(
     date_to: Optional[str] = None,
     page: int = 1,
     limit: int = 20,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get all reservations (Admin only)"""
-    auto_expire_reservations(db)
     query = db.query(models.Reservation)
     
     if status:
@@ -2246,40 +1745,10 @@ async def get_all_reservations(
         except ValueError:
             pass
     
-    total = query.count()
-    
-    # Sort by created_at descending
-    db_items = query.order_by(models.Reservation.created_at.desc()).offset((page - 1) * limit).limit(limit).all()
-    
-    items = []
-    for r in db_items:
-        branch = db.query(models.Branch).filter(models.Branch.id == r.branch_id).first()
-        items.append(ReservationResponse(
-            id=r.id,
-            give_amount=r.give_amount,
-            give_currency=r.give_currency,
-            get_amount=r.get_amount,
-            get_currency=r.get_currency,
-            rate=r.rate,
-            phone=r.phone,
-            customer_name=r.customer_name,
-            status=r.status,
-            branch_id=r.branch_id,
-            branch_address=branch.address if branch else None,
-            branch_number=branch.number if branch else None,
-            created_at=r.created_at.isoformat(),
-            updated_at=r.updated_at.isoformat() if r.updated_at else None,
-            expires_at=r.expires_at.isoformat(),
-            completed_at=r.completed_at.isoformat() if r.completed_at else None,
-            operator_note=r.operator_note
-        ))
-    
-    return {
-        "items": items,
-        "total": total,
-        "page": page,
-        "pages": (total + limit - 1) // limit
-    }
+    # Newest first; with cursor, keyset pagination continuing after the previous page's next_cursor
+    result = page_reservations(query, ("admin", status, branch_id, date_from, date_to), page, limit, cursor)
+    result["items"] = [reservation_response(r) for r in result.pop("rows")]
+    return result
 
 
 class ReservationEdit(BaseModel):
@@ -2331,25 +1800,7 @@ async def admin_create_reservation(
     db.commit()
     db.refresh(db_res)
     
-    return ReservationResponse(
-        id=db_res.id,
-        give_amount=db_res.give_amount,
-        give_currency=db_res.give_currency,
-        get_amount=db_res.get_amount,
-        get_currency=db_res.get_currency,
-        rate=db_res.rate,
-        phone=db_res.phone,
-        customer_name=db_res.customer_name,
-        status=db_res.status,
-        branch_id=db_res.branch_id,
-        branch_address=branch.address if branch else None,
-        branch_number=branch.number if branch else None,
-        created_at=db_res.created_at.isoformat(),
-        updated_at=db_res.updated_at.isoformat() if db_res.updated_at else None,
-        expires_at=db_res.expires_at.isoformat(),
-        completed_at=db_res.completed_at.isoformat() if db_res.completed_at else None,
-        operator_note=db_res.operator_note
-    )
+    return reservation_response(db_res)
 
 
 @app.put("/api/admin/reservations/{reservation_id}")
@@ -2401,26 +1852,7 @@ async def update_reservation(
     db.commit()
     db.refresh(res)
     
-    branch = db.query(models.Branch).filter(models.Branch.id == res.branch_id).first()
-    return ReservationResponse(
-        id=res.id,
-        give_amount=res.give_amount,
-        give_currency=res.give_currency,
-        get_amount=res.get_amount,
-        get_currency=res.get_currency,
-        rate=res.rate,
-        phone=res.phone,
-        customer_name=res.customer_name,
-        status=res.status,
-        branch_id=res.branch_id,
-        branch_address=branch.address if branch else None,
-        branch_number=branch.number if branch else None,
-        created_at=res.created_at.isoformat(),
-        updated_at=res.updated_at.isoformat() if res.updated_at else None,
-        expires_at=res.expires_at.isoformat(),
-        completed_at=res.completed_at.isoformat() if res.completed_at else None,
-        operator_note=res.operator_note
-    )
+    return reservation_response(res)
 
 
 @app.post("/api/admin/reservations/{reservation_id}/assign")
@@ -2445,26 +1877,7 @@ async def assign_reservation_to_operator(
     db.commit()
     db.refresh(res)
     
-    branch = db.query(models.Branch).filter(models.Branch.id == res.branch_id).first()
-    return ReservationResponse(
-        id=res.id,
-        give_amount=res.give_amount,
-        give_currency=res.give_currency,
-        get_amount=res.get_amount,
-        get_currency=res.get_currency,
-        rate=res.rate,
-        phone=res.phone,
-        customer_name=res.customer_name,
-        status=res.status,
-        branch_id=res.branch_id,
-        branch_address=branch.address if branch else None,
-        branch_number=branch.number if branch else None,
-        created_at=res.created_at.isoformat(),
-        updated_at=res.updated_at.isoformat() if res.updated_at else None,
-        expires_at=res.expires_at.isoformat(),
-        completed_at=res.completed_at.isoformat() if res.completed_at else None,
-        operator_note=res.operator_note
-    )
+    return reservation_response(res)
 
 
 # ============== OPERATOR ENDPOINTS ==============
@@ -2472,56 +1885,8 @@ async def assign_reservation_to_operator(
 @app.get("/api/operator/dashboard", response_model=DashboardStats)
 async def get_operator_dashboard(user: models.User = Depends(require_operator_or_admin), db: Session = Depends(get_db)):
     """Get operator dashboard statistics for their branch"""
-    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    query = db.query(models.Reservation)
-    if user.role == models.UserRole.OPERATOR and user.branch_id:
-        query = query.filter(models.Reservation.branch_id == user.branch_id)
-    
-    total = query.count()
-    
-    pending_query = query.filter(models.Reservation.status == models.ReservationStatus.PENDING)
-    pending = pending_query.count()
-    pending_ids = [r[0] for r in pending_query.with_entities(models.Reservation.id).all()]
-    
-    confirmed = query.filter(models.Reservation.status == models.ReservationStatus.CONFIRMED).count()
-    completed_today = query.filter(
-        models.Reservation.status == models.ReservationStatus.COMPLETED,
-        models.Reservation.completed_at >= today_start
-    ).count()
-    
-    # Volume Today
-    volume_today_query = query.filter(
-        (models.Reservation.get_currency == "UAH") | (models.Reservation.give_currency == "UAH"),
-        models.Reservation.status == models.ReservationStatus.COMPLETED,
-        models.Reservation.completed_at >= today_start
-    )
-    total_volume_uah = sum(
-        r.get_amount if r.get_currency == "UAH" else r.give_amount 
-        for r in volume_today_query.all()
-    )
-    
-    # Volume Month
-    month_start = today_start.replace(day=1)
-    volume_month_query = query.filter(
-        (models.Reservation.get_currency == "UAH") | (models.Reservation.give_currency == "UAH"),
-        models.Reservation.status == models.ReservationStatus.COMPLETED,
-        models.Reservation.completed_at >= month_start
-    )
-    total_volume_uah_month = sum(
-        r.get_amount if r.get_currency == "UAH" else r.give_amount 
-        for r in volume_month_query.all()
-    )
-    
-    return DashboardStats(
-        total_reservations=total,
-        pending_reservations=pending,
-        confirmed_reservations=confirmed,
-        completed_today=completed_today,
-        total_volume_uah=total_volume_uah,
-        total_volume_uah_month=total_volume_uah_month,
-        pending_ids=pending_ids
-    )
+    branch_id = user.branch_id if user.role == models.UserRole.OPERATOR else None
+    return reservation_dashboard_stats(db, [models.ReservationStatus.PENDING], branch_id)
 
 @app.get("/api/operator/reservations")
 async def get_branch_reservations(
@@ -2531,10 +1896,10 @@ async def get_branch_reservations(
     date_to: Optional[str] = None,
     page: int = 1,
     limit: int = 20,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get reservations for operator's branch"""
-    auto_expire_reservations(db)
     query = db.query(models.Reservation)
     if user.role == models.UserRole.OPERATOR and user.branch_id:
         query = query.filter(models.Reservation.branch_id == user.branch_id)
@@ -2556,38 +1921,10 @@ async def get_branch_reservations(
         except ValueError:
             pass
     
-    total = query.count()
-    db_items = query.order_by(models.Reservation.created_at.desc()).offset((page - 1) * limit).limit(limit).all()
-    
-    items = []
-    for r in db_items:
-        branch = db.query(models.Branch).filter(models.Branch.id == r.branch_id).first()
-        items.append(ReservationResponse(
-            id=r.id,
-            give_amount=r.give_amount,
-            give_currency=r.give_currency,
-            get_amount=r.get_amount,
-            get_currency=r.get_currency,
-            rate=r.rate,
-            phone=r.phone,
-            customer_name=r.customer_name,
-            status=r.status,
-            branch_id=r.branch_id,
-            branch_address=branch.address if branch else None,
-            branch_number=branch.number if branch else None,
-            created_at=r.created_at.isoformat(),
-            updated_at=r.updated_at.isoformat() if r.updated_at else None,
-            expires_at=r.expires_at.isoformat(),
-            completed_at=r.completed_at.isoformat() if r.completed_at else None,
-            operator_note=r.operator_note
-        ))
-    
-    return {
-        "items": items,
-        "total": total,
-        "page": page,
-        "pages": (total + limit - 1) // limit
-    }
+    scope = user.branch_id if user.role == models.UserRole.OPERATOR else None
+    result = page_reservations(query, ("operator", scope, status, date_from, date_to), page, limit, cursor)
+    result["items"] = [reservation_response(r) for r in result.pop("rows")]
+    return result
 
 @app.put("/api/operator/reservations/{reservation_id}")
 async def update_reservation(
@@ -2624,27 +1961,7 @@ async def update_reservation(
     db.commit()
     db.refresh(db_res)
     
-    branch = db.query(models.Branch).filter(models.Branch.id == db_res.branch_id).first()
-    
-    return ReservationResponse(
-        id=db_res.id,
-        give_amount=db_res.give_amount,
-        give_currency=db_res.give_currency,
-        get_amount=db_res.get_amount,
-        get_currency=db_res.get_currency,
-        rate=db_res.rate,
-        phone=db_res.phone,
-        customer_name=db_res.customer_name,
-        status=db_res.status,
-        branch_id=db_res.branch_id,
-        branch_address=branch.address if branch else None,
-        branch_number=branch.number if branch else None,
-        created_at=db_res.created_at.isoformat(),
-        updated_at=db_res.updated_at.isoformat() if db_res.updated_at else None,
-        expires_at=db_res.expires_at.isoformat(),
-        completed_at=db_res.completed_at.isoformat() if db_res.completed_at else None,
-        operator_note=db_res.operator_note
-    )
+    return reservation_response(db_res)
 
 @app.post("/api/operator/reservations/{reservation_id}/confirm")
 async def confirm_reservation(
@@ -2768,6 +2085,7 @@ async def create_cross_rate(data: CrossRateCreate, user: models.User = Depends(r
     )
     db.add(cr)
     db.commit()
+    set_rates_updated_at(db)
     db.refresh(cr)
     return {"id": cr.id, "base_currency": cr.base_currency, "quote_currency": cr.quote_currency, "buy_rate": cr.buy_rate, "sell_rate": cr.sell_rate, "is_active": cr.is_active, "order": cr.order}
 
@@ -2790,6 +2108,7 @@ async def update_cross_rate(rate_id: int, data: CrossRateUpdate, user: models.Us
     if data.order is not None:
         cr.order = data.order
     db.commit()
+    set_rates_updated_at(db)
     db.refresh(cr)
     return {"id": cr.id, "base_currency": cr.base_currency, "quote_currency": cr.quote_currency, "buy_rate": cr.buy_rate, "sell_rate": cr.sell_rate, "is_active": cr.is_active, "order": cr.order}
 
@@ -2801,6 +2120,7 @@ async def delete_cross_rate(rate_id: int, user: models.User = Depends(require_ad
         raise HTTPException(status_code=404, detail="Cross-rate not found")
     db.delete(cr)
     db.commit()
+    set_rates_updated_at(db)
     return {"success": True}
 
 
@@ -2833,6 +2153,7 @@ async def update_settings(settings: SiteSettings, user: models.User = Depends(re
         setattr(db_settings, key, value)
     
     db.commit()
+    set_content_updated_at(db, "settings")
     return {"success": True, "message": "Налаштування оновлено"}
 
 @app.get("/api/admin/faq")
@@ -2852,6 +2173,7 @@ async def create_faq(item: FAQItem, user: models.User = Depends(require_admin),
     )
     db.add(db_item)
     db.commit()
+    set_content_updated_at(db, "faq")
     db.refresh(db_item)
     return db_item
 
@@ -2869,6 +2191,7 @@ async def update_faq(faq_id: int, item: FAQItem, user: models.User = Depends(req
     db_item.order = item.order
     
     db.commit()
+    set_content_updated_at(db, "faq")
     db.refresh(db_item)
     return db_item
 
@@ -2880,6 +2203,7 @@ async def delete_faq(faq_id: int, user: models.User = Depends(require_admin), db
         raise HTTPException(status_code=404, detail="FAQ not found")
     db.delete(db_item)
     db.commit()
+    set_content_updated_at(db, "faq")
     return {"success": True}
 
 @app.get("/api/admin/services")
@@ -2907,6 +2231,7 @@ async def create_service(item: ServiceItem, user: models.User = Depends(require_
     )
     db.add(db_item)
     db.commit()
+    set_content_updated_at(db, "services")
     db.refresh(db_item)
     return db_item
 
@@ -2932,6 +2257,7 @@ async def update_service(service_id: int, item: ServiceItem, user: models.User =
     db_item.seo_image = item.seo_image
     
     db.commit()
+    set_content_updated_at(db, "services")
     db.refresh(db_item)
     return db_item
 
@@ -2943,6 +2269,7 @@ async def delete_service(service_id: int, user: models.User = Depends(require_ad
         raise HTTPException(status_code=404, detail="Service not found")
     db.delete(db_item)
     db.commit()
+    set_content_updated_at(db, "services")
     return {"success": True}
 
 
@@ -3083,6 +2410,7 @@ async def create_branch(branch: BranchCreate, user: models.User = Depends(requir
             buy_rate=rate.buy_rate,
             sell_rate=rate.sell_rate
         ))
+    set_rates_updated_at(db)
     db.commit()
     
     return db_branch
@@ -3110,8 +2438,10 @@ async def delete_branch(branch_id: int, user: models.User = Depends(require_admi
     
     # Nullify reservations' branch_id instead of deleting them to preserve history
     db.query(models.Reservation).filter(models.Reservation.branch_id == branch_id).update({models.Reservation.branch_id: None})
+    move_branch_rollups(db, branch_id)
 
     db.delete(branch)
+    set_rates_updated_at(db)
     db.commit()
     return {"success": True}
 
@@ -3216,6 +2546,7 @@ async def update_user(user_id: int, user_data: UserUpdate, user: models.User = D
         target_user.password_hash = user_data.password  # In production, hash this!
     
     db.commit()
+    invalidate_auth_cache()
     db.refresh(target_user)
     
     branch_address = None
@@ -3244,6 +2575,7 @@ async def delete_user(user_id: int, user: models.User = Depends(require_admin),
     
     db.delete(target_user)
     db.commit()
+    invalidate_auth_cache()
     return {"success": True}
 
 
@@ -3643,13 +2975,13 @@ async def admin_get_chat_sessions(user: models.User = Depends(require_admin), db
     return sessions
 
 @app.get("/api/admin/chat/sessions/{session_id}/messages", response_model=List[ChatMessage])
-async def admin_get_session_messages(session_id: str, user: models.User = Depends(require_admin), db: Session = Depends(get_db)):
-    """Admin get messages for a session"""
+async def admin_get_session_messages(session_id: str, after_id: Optional[int] = None, since: Optional[datetime] = None, user: models.User = Depends(require_admin), db: Session = Depends(get_db)):
+    """Admin get messages for a session (only newer than after_id / since when given)"""
     session = db.query(models.ChatSession).filter(models.ChatSession.session_id == session_id).first()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    messages = db.query(models.ChatMessage).filter(models.ChatMessage.session_id == session.id).order_by(models.ChatMessage.created_at.asc()).all()
+    messages = query_session_messages(db, session, after_id, since)
     
     for m in messages:
         if m.created_at and m.created_at.tzinfo is None:
@@ -3663,20 +2995,7 @@ async def admin_send_chat_message(session_id: str, msg: ChatMessageCreate, user:
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    new_msg = models.ChatMessage(
-        session_id=session.id,
-        sender="admin",
-        content=msg.content
-    )
-    db.add(new_msg)
-    
-    session.last_message_at = datetime.now(timezone.utc)
-    db.commit()
-    db.refresh(new_msg)
-    
-    if new_msg.created_at and new_msg.created_at.tzinfo is None:
-        new_msg.created_at = new_msg.created_at.replace(tzinfo=timezone.utc)
-    return new_msg
+    return add_chat_message(db, session, "admin", msg.content)
 
 @app.post("/api/admin/chat/sessions/{session_id}/read")
 async def admin_mark_messages_read(session_id: str, user: models.User = Depends(require_admin), db: Session = Depends(get_db)):
@@ -3685,16 +3004,7 @@ async def admin_mark_messages_read(session_id: str, user: models.User = Depends(
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    unread_user_msgs = db.query(models.ChatMessage).filter(
-        models.ChatMessage.session_id == session.id,
-        models.ChatMessage.sender == 'user',
-        models.ChatMessage.is_read == False
-    ).all()
-    
-    for m in unread_user_msgs:
-        m.is_read = True
-        
-    db.commit()
+    mark_chat_read(db, session, 'user')
     return {"success": True}
 
 class ChatMessageUpdate(BaseModel):
@@ -3710,6 +3020,7 @@ async def admin_edit_message(message_id: int, update: ChatMessageUpdate, user: m
     msg.content = update.content
     db.commit()
     db.refresh(msg)
+    publish_message(db, msg.session, msg, kind="message_updated")
     
     if msg.created_at and msg.created_at.tzinfo is None:
         msg.created_at = msg.created_at.replace(tzinfo=timezone.utc)
@@ -3722,8 +3033,10 @@ async def admin_delete_message(message_id: int, user: models.User = Depends(requ
     if not msg:
         raise HTTPException(status_code=404, detail="Message not found or not editable")
         
+    session = msg.session
     db.delete(msg)
     db.commit()
+    publish_message_deleted(db, session, message_id)
     return {"success": True}
 
 @app.put("/api/admin/chat/sessions/{session_id}/close")
@@ -3735,6 +3048,7 @@ async def admin_close_chat_session(session_id: str, user: models.User = Depends(
         
     session.status = models.ChatSessionStatus.CLOSED
     db.commit()
+    publish_session(db, session)
     return {"success": True}
 
 @app.get("/sitemap.xml", response_class=Response)
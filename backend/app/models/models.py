@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Text, DateTime, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Text, DateTime, Date, LargeBinary, Index, Enum as SQLEnum
 from sqlalchemy.orm import relationship
 from app.core.database import Base
 import datetime
@@ -43,6 +43,10 @@ class SiteSettings(Base):
     faq_url = Column(String, default="/faq")
     rates_url = Column(String, default="/rates")
     rates_updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    faq_updated_at = Column(DateTime, nullable=True)
+    services_updated_at = Column(DateTime, nullable=True)
+    articles_updated_at = Column(DateTime, nullable=True)
+    settings_updated_at = Column(DateTime, nullable=True)
 
 class FAQItem(Base):
     __tablename__ = "faq_items"
@@ -129,6 +133,15 @@ class Reservation(Base):
     
     branch = relationship("Branch", back_populates="reservations")
 
+    __table_args__ = (
+        # Expiry sweep: WHERE status IN (pending, pending_admin) AND expires_at < now
+        Index("ix_reservations_status_expires_at", "status", "expires_at"),
+        # Keyset pagination of the reservation lists: ORDER BY created_at DESC, id DESC
+        Index("ix_reservations_created_at_id", "created_at", "id"),
+        # Operator list: WHERE branch_id = ? ORDER BY created_at DESC, id DESC
+        Index("ix_reservations_branch_created_at", "branch_id", "created_at", "id"),
+    )
+
 class BranchRate(Base):
     __tablename__ = "branch_rates"
     id = Column(Integer, primary_key=True, index=True)
@@ -149,6 +162,11 @@ class BranchRate(Base):
 
     branch = relationship("Branch", back_populates="rates")
 
+    __table_args__ = (
+        # One row per branch and currency; almost every rate lookup filters on exactly this
+        Index("ux_branch_rates_branch_currency", "branch_id", "currency_code", unique=True),
+    )
+
 class Currency(Base):
     __tablename__ = "currencies"
     id = Column(Integer, primary_key=True, index=True)
@@ -218,6 +236,19 @@ class ChatMessage(Base):
     
     session = relationship("ChatSession", back_populates="messages")
 
+    __table_args__ = (
+        Index("ix_chat_messages_session_id_id", "session_id", "id"),
+    )
+
+class ChatEvent(Base):
+    """Outbox of chat changes; every worker tails it to fan out to its WebSocket subscribers"""
+    __tablename__ = "chat_events"
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, nullable=False) # ChatSession.session_id (UUID)
+    kind = Column(String, nullable=False) # message, message_updated, message_deleted, read, session
+    payload = Column(Text, nullable=False) # JSON
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
 class SeoMetadata(Base):
     __tablename__ = "seo_metadata"
     id = Column(Integer, primary_key=True, index=True)
@@ -262,3 +293,75 @@ class BranchBalance(Base):
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     branch = relationship("Branch", back_populates="balances")
+
+    __table_args__ = (
+        Index("ux_branch_balances_key", "branch_id", "currency_code", "category", unique=True),
+    )
+
+class RateHistoryChunk(Base):
+    """One day of published rates for a branch/currency, stored column-wise.
+
+    `data` is a zlib-compressed float64 block of shape (5, points):
+    timestamp, buy, sell, wholesale buy, wholesale sell.
+    """
+    __tablename__ = "rate_history_chunks"
+    id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, nullable=False)
+    currency_code = Column(String, nullable=False)
+    day = Column(Date, nullable=False)
+    points = Column(Integer, default=0)
+    last_at = Column(DateTime, nullable=True)
+    data = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        Index("ix_rate_history_chunks_key", "currency_code", "branch_id", "day", unique=True),
+    )
+
+
+class RateUploadJob(Base):
+    """An Excel rates upload processed in the background; see services/rates_upload_jobs.py."""
+    __tablename__ = "rate_upload_jobs"
+    id = Column(String(32), primary_key=True)
+    status = Column(String, default="queued", nullable=False)  # queued / running / done / failed
+    filename = Column(String, nullable=True)
+    created_by = Column(String, nullable=True)
+    stage = Column(String, nullable=True)
+    rows_processed = Column(Integer, default=0)
+    message = Column(Text, nullable=True)
+    base_rates_updated = Column(Integer, default=0)
+    branch_rates_updated = Column(Integer, default=0)
+    errors = Column(Text, nullable=True)  # JSON list
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class SchedulerLease(Base):
+    """Which worker currently runs a periodic job; taken over once `expires_at` passes"""
+    __tablename__ = "scheduler_leases"
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class ReservationRollup(Base):
+    """Reservation counts and volumes per branch, foreign currency, status and creation hour.
+
+    Maintained incrementally by services/reservation_rollups.py; every
+    reservation is counted once, in its current status. branch_id 0 stands
+    for reservations without a branch.
+    """
+    __tablename__ = "reservation_rollups"
+    id = Column(Integer, primary_key=True)
+    branch_id = Column(Integer, nullable=False, default=0)
+    currency_code = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    hour = Column(DateTime, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    uah_volume = Column(Float, nullable=False, default=0.0)
+    foreign_volume = Column(Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        Index("ix_reservation_rollups_key", "branch_id", "currency_code", "status", "hour", unique=True),
+        Index("ix_reservation_rollups_hour", "hour"),
+    )
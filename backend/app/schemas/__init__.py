@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 import enum
 
@@ -291,6 +291,28 @@ class CrossRate(BaseModel):
     buy_rate: float
     sell_rate: float
 
+class QuoteRequest(BaseModel):
+    amount: float
+    from_currency: str
+    to_currency: str = "UAH"
+    branch_id: Optional[int] = None
+
+class QuoteBatchRequest(BaseModel):
+    quotes: List[QuoteRequest]
+
+class QuoteResult(BaseModel):
+    from_amount: float
+    from_currency: str
+    to_amount: Optional[float] = None
+    to_currency: str
+    rate: Optional[float] = None
+    branch_id: Optional[int] = None
+    error: Optional[str] = None
+
+class QuoteBatchResponse(BaseModel):
+    updated_at: str
+    quotes: List[QuoteResult]
+
 class RatesUploadResponse(BaseModel):
     success: bool
     message: str
@@ -304,6 +326,54 @@ class RatesUploadResponseV2(BaseModel):
     branch_rates_updated: int
     errors: List[str] = []
 
+class RatesUploadJob(BaseModel):
+    id: str
+    status: str  # queued / running / done / failed
+    filename: Optional[str] = None
+    stage: Optional[str] = None
+    rows_processed: int = 0
+    success: Optional[bool] = None  # set once the job has finished
+    message: Optional[str] = None
+    base_rates_updated: int = 0
+    branch_rates_updated: int = 0
+    errors: List[str] = []
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+class BaseRatesColumns(BaseModel):
+    """Base rates as equally long columns, one entry per currency."""
+    code: List[str]
+    buy_rate: List[float]
+    sell_rate: List[float]
+    wholesale_buy_rate: Optional[List[float]] = None
+    wholesale_sell_rate: Optional[List[float]] = None
+
+class BranchRatesColumns(BaseModel):
+    """Branch rates as equally long columns, one entry per branch/currency."""
+    branch_id: List[int]
+    currency_code: List[str]
+    buy_rate: List[float]
+    sell_rate: List[float]
+    wholesale_buy_rate: Optional[List[Optional[float]]] = None
+    wholesale_sell_rate: Optional[List[Optional[float]]] = None
+
+class RatesIngestRequest(BaseModel):
+    base: BaseRatesColumns
+    branches: Optional[BranchRatesColumns] = None
+
+class RatesUploadPreview(BaseModel):
+    """Result of an upload with dry_run=true: what would change, nothing written."""
+    dry_run: bool = True
+    message: str
+    base_rates_updated: int
+    branch_rates_updated: int
+    errors: List[str] = []
+    summary: Dict[str, int] = {}
+    currencies: Dict[str, List[Any]] = {}
+    branch_rates: Dict[str, List[Any]] = {}
+    branches: Dict[str, List[Any]] = {}
+
 # ============== USERS & BRANCHES ==============
 class User(BaseModel):
     id: int
@@ -384,6 +454,23 @@ class DashboardStats(BaseModel):
     total_volume_uah_month: float
     pending_ids: List[int] = []
 
+class ReservationAnalyticsRow(BaseModel):
+    """One group of the reservation analytics; dimensions not grouped by are None."""
+    branch_id: Optional[int] = None  # 0 = reservations without a branch
+    currency_code: Optional[str] = None
+    status: Optional[str] = None
+    period: Optional[str] = None
+    count: int
+    uah_volume: float
+    foreign_volume: float
+
+class ReservationAnalytics(BaseModel):
+    date_from: str
+    date_to: str
+    group_by: List[str]
+    rows: List[ReservationAnalyticsRow]
+    total: ReservationAnalyticsRow
+
 # ============== CHAT ==============
 class ChatMessageBase(BaseModel):
     sender: str
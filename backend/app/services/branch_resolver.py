@@ -0,0 +1,134 @@
+import re
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from app.models import models
+
+# Street-type words and their short forms, all mapped to one token
+ADDRESS_ABBREVIATIONS = {
+    "вулиця": "вул", "вул": "вул", "ул": "вул", "улица": "вул", "street": "вул", "st": "вул",
+    "проспект": "просп", "просп": "просп", "пр": "просп", "пр-т": "просп", "пр-кт": "просп", "avenue": "просп", "ave": "просп",
+    "бульвар": "бул", "бульв": "бул", "бул": "бул", "б-р": "бул",
+    "площа": "пл", "площадь": "пл", "пл": "пл",
+    "провулок": "пров", "пров": "пров", "переулок": "пров", "пер": "пров",
+    "шосе": "шосе", "ш": "шосе",
+    "набережна": "наб", "наб": "наб",
+    "будинок": "буд", "буд": "буд",
+    "місто": "м", "м": "м",
+}
+
+# Fuzzy matches below this similarity of the normalized addresses are ignored
+FUZZY_MIN_RATIO = 0.85
+
+_APOSTROPHES = str.maketrans({"’": "'", "ʼ": "'", "`": "'", "‘": "'"})
+_SEPARATORS = re.compile(r"[\s,.;:№#\"«»()/\\]+")
+
+
+def address_tokens(address: Optional[str]) -> Tuple[str, ...]:
+    """Lower-cased address words with street types abbreviated: 'Вулиця Хрещатик, 22' -> ('вул', 'хрещатик', '22')."""
+    text = (address or "").lower().translate(_APOSTROPHES)
+    return tuple(ADDRESS_ABBREVIATIONS.get(t, t) for t in _SEPARATORS.split(text) if t)
+
+
+def normalize_address(address: Optional[str]) -> str:
+    return " ".join(address_tokens(address))
+
+
+def _house_numbers(tokens: Iterable[str]) -> Set[str]:
+    return {t for t in tokens if t[0].isdigit()}
+
+
+class BranchResolver:
+    """Branches of one upload indexed by number and by normalized address.
+
+    Built once from the already loaded branches, so resolving a header
+    column costs dict lookups instead of queries. Address lookup tries,
+    in order: the exact normalized address; a unique branch whose address
+    contains every word of the header (the old `ilike '%addr%'`); the most
+    similar address sharing a street word and the same house numbers.
+    Headers made of numbers only are never matched fuzzily.
+    """
+
+    def __init__(self, branches: Iterable[models.Branch]):
+        self._by_number: Dict[int, models.Branch] = {}
+        self._by_address: Dict[str, List[models.Branch]] = {}
+        self._by_token: Dict[str, Set[int]] = {}
+        self._branches: Dict[int, models.Branch] = {}
+        self._indexed: Dict[int, Tuple[Optional[int], Tuple[str, ...]]] = {}
+        for branch in sorted(branches, key=lambda b: b.id):
+            self.add(branch)
+
+    def __len__(self) -> int:
+        return len(self._branches)
+
+    def add(self, branch: models.Branch):
+        """Index a new branch, or re-index one whose number or address changed."""
+        if branch.id in self._indexed:
+            self._remove(branch)
+        tokens = address_tokens(branch.address)
+        self._branches[branch.id] = branch
+        self._indexed[branch.id] = (branch.number, tokens)
+        if branch.number is not None:
+            self._by_number.setdefault(branch.number, branch)
+        self._by_address.setdefault(" ".join(tokens), []).append(branch)
+        for token in tokens:
+            self._by_token.setdefault(token, set()).add(branch.id)
+
+    def _remove(self, branch: models.Branch):
+        number, tokens = self._indexed.pop(branch.id)
+        if self._by_number.get(number) is branch:
+            del self._by_number[number]
+            # Another branch with the same number takes its place
+            other = next((b for b in self._branches.values() if b is not branch and b.number == number), None)
+            if other is not None:
+                self._by_number[number] = other
+        self._by_address[" ".join(tokens)].remove(branch)
+        for token in tokens:
+            self._by_token[token].discard(branch.id)
+        del self._branches[branch.id]
+
+    def by_number(self, number: Optional[int]) -> Optional[models.Branch]:
+        return self._by_number.get(number) if number is not None else None
+
+    def by_address(self, address: Optional[str], number: Optional[int] = None) -> Optional[models.Branch]:
+        """Best branch for a header address. With `number`, only branches without a number or with that number qualify."""
+        tokens = address_tokens(address)
+        if not tokens:
+            return None
+
+        def allowed(branch: models.Branch) -> bool:
+            return number is None or branch.number is None or branch.number == number
+
+        exact = [b for b in self._by_address.get(" ".join(tokens), []) if allowed(b)]
+        if exact:
+            return exact[0]
+
+        # A bare number ('№ 7') is a branch number, not an address to guess at
+        if all(t[0].isdigit() for t in tokens):
+            return None
+        houses = _house_numbers(tokens)
+
+        # Branches sharing at least one word, never across different house numbers
+        candidates = set()
+        for token in tokens:
+            candidates |= self._by_token.get(token, set())
+        candidates = [
+            self._branches[i] for i in sorted(candidates)
+            if allowed(self._branches[i]) and houses <= _house_numbers(self._indexed[i][1])
+        ]
+        if not candidates:
+            return None
+
+        containing = [b for b in candidates if set(tokens) <= set(self._indexed[b.id][1])]
+        if len(containing) == 1:
+            return containing[0]
+
+        text = " ".join(tokens)
+        best, best_ratio = None, FUZZY_MIN_RATIO
+        for branch in candidates:
+            other = self._indexed[branch.id][1]
+            if houses != _house_numbers(other):
+                continue
+            ratio = SequenceMatcher(None, text, " ".join(other)).ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = branch, ratio
+        return best
@@ -0,0 +1,221 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+from fastapi import WebSocket
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.core.database import SessionLocal
+from app.models import models
+from app.schemas import ChatMessage
+
+# How often each worker tails chat_events for changes written by other workers
+CHAT_POLL_SECONDS = 1.0
+# Events are only needed until every worker has delivered them
+CHAT_EVENT_RETENTION = timedelta(hours=1)
+CHAT_EVENT_BATCH = 500
+
+
+def message_payload(msg: models.ChatMessage) -> Dict[str, Any]:
+    data = ChatMessage.model_validate(msg).model_dump()
+    if data["created_at"] and data["created_at"].tzinfo is None:
+        data["created_at"] = data["created_at"].replace(tzinfo=timezone.utc)
+    return jsonable_encoder(data)
+
+
+def record_chat_event(db: Session, session_id: str, kind: str, payload: Dict[str, Any]):
+    """Persist a chat event (commits) and wake this worker's hub."""
+    db.add(models.ChatEvent(session_id=session_id, kind=kind, payload=json.dumps(payload, ensure_ascii=False)))
+    db.commit()
+    hub.wake()
+
+
+def publish_message(db: Session, session: models.ChatSession, msg: models.ChatMessage, kind: str = "message"):
+    record_chat_event(db, session.session_id, kind, {"message": message_payload(msg)})
+
+
+def publish_message_deleted(db: Session, session: models.ChatSession, message_id: int):
+    record_chat_event(db, session.session_id, "message_deleted", {"message_id": message_id})
+
+
+def publish_read(db: Session, session: models.ChatSession, sender: str, message_ids: List[int]):
+    """Read receipt: messages from `sender` were read by the other side."""
+    record_chat_event(db, session.session_id, "read", {"sender": sender, "message_ids": message_ids})
+
+
+def publish_session(db: Session, session: models.ChatSession):
+    status = session.status.value if session.status else models.ChatSessionStatus.ACTIVE.value
+    record_chat_event(db, session.session_id, "session", {"status": status})
+
+
+def _max_event_id() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(func.max(models.ChatEvent.id)).scalar() or 0
+    finally:
+        db.close()
+
+
+def _fetch_events(after_id: int, prune: bool) -> List[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        if prune:
+            cutoff = datetime.utcnow() - CHAT_EVENT_RETENTION
+            db.query(models.ChatEvent).filter(models.ChatEvent.created_at < cutoff).delete(synchronize_session=False)
+            db.commit()
+        rows = (
+            db.query(models.ChatEvent)
+            .filter(models.ChatEvent.id > after_id)
+            .order_by(models.ChatEvent.id.asc())
+            .limit(CHAT_EVENT_BATCH)
+            .all()
+        )
+        return [
+            {"id": r.id, "type": r.kind, "session_id": r.session_id, **json.loads(r.payload)}
+            for r in rows
+        ]
+    finally:
+        db.close()
+
+
+class ChatHub:
+    """Per-worker registry of chat WebSockets.
+
+    Writes go to the chat_events table; one task per worker tails it (woken
+    immediately by local writes, otherwise every CHAT_POLL_SECONDS) and sends
+    each event to the visitor's sockets for that session and to every admin.
+    """
+
+    def __init__(self):
+        self._visitors: Dict[str, Set[WebSocket]] = {}
+        self._admins: Set[WebSocket] = set()
+        self._last_id: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune = datetime.min
+
+    def _has_subscribers(self) -> bool:
+        return bool(self._admins) or any(self._visitors.values())
+
+    def _ensure_running(self):
+        # No await before create_task, so concurrent connects cannot start two tailers
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    def add_visitor(self, session_id: str, ws: WebSocket):
+        self._visitors.setdefault(session_id, set()).add(ws)
+        self._ensure_running()
+
+    def add_admin(self, ws: WebSocket):
+        self._admins.add(ws)
+        self._ensure_running()
+
+    def remove(self, ws: WebSocket):
+        self._admins.discard(ws)
+        for session_id, sockets in list(self._visitors.items()):
+            sockets.discard(ws)
+            if not sockets:
+                del self._visitors[session_id]
+
+    def wake(self):
+        """Thread-safe; called after every chat write in this worker."""
+        if self._loop is not None and self._wake is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self):
+        if self._last_id is None:
+            self._last_id = await run_in_threadpool(_max_event_id)
+        while self._has_subscribers():
+            try:
+                await asyncio.wait_for(self._wake.wait(), CHAT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+            prune = datetime.utcnow() - self._last_prune > CHAT_EVENT_RETENTION / 4
+            try:
+                events = await run_in_threadpool(_fetch_events, self._last_id, prune)
+            except Exception as e:
+                print(f"Chat hub poll failed: {e}")
+                continue
+            if prune:
+                self._last_prune = datetime.utcnow()
+
+            for event in events:
+                self._last_id = event["id"]
+                await self._deliver(event)
+        # Nobody listening: forget the cursor so a later start skips the backlog
+        self._last_id = None
+
+    async def _deliver(self, event: Dict[str, Any]):
+        targets = set(self._admins) | set(self._visitors.get(event["session_id"], ()))
+        for ws in targets:
+            try:
+                await ws.send_json(event)
+            except Exception:
+                self.remove(ws)
+
+
+hub = ChatHub()
+
+
+def add_chat_message(db: Session, session: models.ChatSession, sender: str, content: Optional[str] = "", image_url: Optional[str] = None) -> models.ChatMessage:
+    """Persist a message, reopen a visitor's closed session and fan both out."""
+    new_msg = models.ChatMessage(
+        session_id=session.id,
+        sender=sender,
+        content=content,
+        image_url=image_url
+    )
+    db.add(new_msg)
+
+    session.last_message_at = datetime.now(timezone.utc)
+    # Reopen session if it was previously closed by admin
+    reopened = sender == "user" and session.status == models.ChatSessionStatus.CLOSED
+    if reopened:
+        session.status = models.ChatSessionStatus.ACTIVE
+
+    db.commit()
+    db.refresh(new_msg)
+    publish_message(db, session, new_msg)
+    if reopened:
+        publish_session(db, session)
+
+    if new_msg.created_at and new_msg.created_at.tzinfo is None:
+        new_msg.created_at = new_msg.created_at.replace(tzinfo=timezone.utc)
+    return new_msg
+
+
+def mark_chat_read(db: Session, session: models.ChatSession, sender: str) -> List[int]:
+    """Mark unread messages from `sender` as read and send a read receipt."""
+    unread = db.query(models.ChatMessage).filter(
+        models.ChatMessage.session_id == session.id,
+        models.ChatMessage.sender == sender,
+        models.ChatMessage.is_read == False
+    ).all()
+    if not unread:
+        return []
+    for m in unread:
+        m.is_read = True
+    db.commit()
+    ids = [m.id for m in unread]
+    publish_read(db, session, sender, ids)
+    return ids
+
+
+def query_session_messages(db: Session, session: models.ChatSession, after_id: Optional[int] = None, since: Optional[datetime] = None):
+    """Messages of a session in order, optionally only those after a cursor (message id and/or time)."""
+    query = db.query(models.ChatMessage).filter(models.ChatMessage.session_id == session.id)
+    if after_id is not None:
+        query = query.filter(models.ChatMessage.id > after_id)
+    if since is not None:
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        query = query.filter(models.ChatMessage.created_at > since)
+    return query.order_by(models.ChatMessage.id.asc()).all()
@@ -0,0 +1,296 @@
+import math
+import zlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.core.state import on_rates_updated
+from app.models import models
+from app.services.rates_cache import RateSnapshot, get_rate_snapshot
+from app.services.rates_matrix import KIND
+
+# Rate kinds kept in history; stored after the timestamp row of every chunk
+HISTORY_FIELDS = ("buy_rate", "sell_rate", "wholesale_buy_rate", "wholesale_sell_rate")
+_HISTORY_KINDS = [KIND[f] for f in HISTORY_FIELDS]
+_ROWS = len(HISTORY_FIELDS) + 1
+
+# Downsampling modes of rate_history_series
+HISTORY_MODES = ("lttb", "ohlc")
+
+# Publishes are recorded one at a time, in order, on this thread
+_recorder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rate-history")
+
+# (branch_id, code, day) -> (points, last values) of the chunks this worker last wrote or read
+_tails: Dict[Tuple[int, str, date], Tuple[int, np.ndarray]] = {}
+
+
+def _encode(block: np.ndarray) -> bytes:
+    return zlib.compress(np.ascontiguousarray(block, dtype="<f8").tobytes())
+
+
+def _decode(chunk: models.RateHistoryChunk) -> np.ndarray:
+    return np.frombuffer(zlib.decompress(chunk.data), dtype="<f8").reshape(_ROWS, chunk.points)
+
+
+def record_rate_history(db: Session, snapshot: RateSnapshot) -> int:
+    """Append the snapshot's effective rates to today's chunk of every branch/currency.
+
+    A point is only written when the values differ from the last point of the
+    day, so republishing unchanged rates costs nothing; the first publish of a
+    day always writes one, which makes every chunk self-contained.
+    Disabled currencies are stored as NaN. Returns the number of points added.
+
+    New day chunks go in with one INSERT ... ON CONFLICT DO NOTHING; chunks
+    another worker created meanwhile are appended to like any other. Only
+    chunks whose values changed since this worker last wrote them are
+    decoded, and the appends are written with one bulk UPDATE.
+    """
+    m = snapshot.matrix
+    if not m.branch_ids or not m.codes:
+        return 0
+
+    C = models.RateHistoryChunk
+    day = snapshot.version.date()
+    ts = snapshot.version.timestamp()
+    values = m.effective[..., _HISTORY_KINDS].copy()
+    values[~m.active] = np.nan
+    cells = [(i, j, branch_id, code) for i, branch_id in enumerate(m.branch_ids) for j, code in enumerate(m.codes)]
+
+    def read_tails():
+        return {
+            (b, c): (chunk_id, points, last_at)
+            for chunk_id, b, c, points, last_at in db.query(C.id, C.branch_id, C.currency_code, C.points, C.last_at).filter(C.day == day)
+        }
+
+    tails = read_tails()
+    created = {(b, c) for _, _, b, c in cells if (b, c) not in tails}
+    if created:
+        insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+        db.execute(
+            insert(C.__table__).on_conflict_do_nothing(index_elements=["currency_code", "branch_id", "day"]),
+            [
+                dict(branch_id=b, currency_code=c, day=day, points=1, last_at=snapshot.version,
+                     data=_encode(np.r_[ts, values[i, j]][:, None]))
+                for i, j, b, c in cells if (b, c) in created
+            ],
+        )
+        tails = read_tails()
+
+    seen: Dict[Tuple[int, str, date], Tuple[int, np.ndarray]] = {}
+    added = 0
+    changed = []
+    for i, j, b, c in cells:
+        chunk_id, points, last_at = tails[(b, c)]
+        if last_at is not None and last_at >= snapshot.version:
+            # Written by this publish (the insert above) or by a newer one
+            if last_at == snapshot.version and (b, c) in created:
+                seen[(b, c, day)] = (1, values[i, j])
+                added += 1
+            continue
+        tail = _tails.get((b, c, day))
+        if tail is not None and tail[0] == points and np.array_equal(tail[1], values[i, j], equal_nan=True):
+            continue
+        changed.append((i, j, b, c, chunk_id, points))
+
+    updates = []
+    if changed:
+        data = dict(db.query(C.id, C.data).filter(C.id.in_([cell[4] for cell in changed])))
+        for i, j, b, c, chunk_id, points in changed:
+            block = np.frombuffer(zlib.decompress(data[chunk_id]), dtype="<f8").reshape(_ROWS, points)
+            if np.array_equal(block[1:, -1], values[i, j], equal_nan=True):
+                seen[(b, c, day)] = (points, values[i, j])
+                continue
+            point = np.r_[ts, values[i, j]][:, None]
+            updates.append(dict(id=chunk_id, data=_encode(np.hstack([block, point])), points=points + 1, last_at=snapshot.version))
+            seen[(b, c, day)] = (points + 1, values[i, j])
+        if updates:
+            db.execute(update(C), updates)
+            added += len(updates)
+
+    db.commit()
+    if any(key[2] != day for key in _tails):
+        _tails.clear()
+    _tails.update(seen)
+    return added
+
+
+def query_rate_history(db: Session, currency_code: str, branch_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, np.ndarray]:
+    """Published points of one currency/branch within [start, end], oldest first.
+
+    Returns equally long arrays: `timestamp` (POSIX seconds) and one per HISTORY_FIELDS.
+    Only the chunks of the days in range are read.
+    """
+    query = db.query(models.RateHistoryChunk).filter(
+        models.RateHistoryChunk.currency_code == currency_code.upper(),
+        models.RateHistoryChunk.branch_id == branch_id,
+    )
+    if start is not None:
+        query = query.filter(models.RateHistoryChunk.day >= start.date())
+    if end is not None:
+        query = query.filter(models.RateHistoryChunk.day <= end.date())
+
+    blocks = [_decode(c) for c in query.order_by(models.RateHistoryChunk.day.asc()).all()]
+    block = np.hstack(blocks) if blocks else np.empty((_ROWS, 0))
+
+    in_range = np.ones(block.shape[1], dtype=bool)
+    if start is not None:
+        in_range &= block[0] >= start.timestamp()
+    if end is not None:
+        in_range &= block[0] <= end.timestamp()
+    block = block[:, in_range]
+
+    return {"timestamp": block[0], **{f: block[k + 1] for k, f in enumerate(HISTORY_FIELDS)}}
+
+
+def last_rate_before(db: Session, currency_code: str, branch_id: int, when: datetime) -> Optional[np.ndarray]:
+    """The last point published before `when` (timestamp + HISTORY_FIELDS), or None.
+
+    Every day's chunk starts with that day's first publish, so at most the
+    chunk of that day and the one before it need to be read.
+    """
+    chunks = (
+        db.query(models.RateHistoryChunk)
+        .filter(
+            models.RateHistoryChunk.currency_code == currency_code.upper(),
+            models.RateHistoryChunk.branch_id == branch_id,
+            models.RateHistoryChunk.day <= when.date(),
+        )
+        .order_by(models.RateHistoryChunk.day.desc())
+        .limit(2)
+        .all()
+    )
+    ts = when.timestamp()
+    for chunk in chunks:
+        block = _decode(chunk)
+        before = np.flatnonzero(block[0] < ts)
+        if before.size:
+            return block[:, before[-1]]
+    return None
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the shape of y(x)."""
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        # No buckets between the ends: first and last point, or only the last one
+        return np.array([0, n - 1] if threshold == 2 else [n - 1])
+
+    every = (n - 2) / (threshold - 2)
+    indices = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        avg_start = int(math.floor((i + 1) * every)) + 1
+        avg_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        avg_x, avg_y = x[avg_start:avg_end].mean(), y[avg_start:avg_end].mean()
+
+        lo = int(math.floor(i * every)) + 1
+        hi = int(math.floor((i + 1) * every)) + 1
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        indices.append(a)
+    indices.append(n - 1)
+    return np.array(indices)
+
+
+def ohlc_buckets(t: np.ndarray, v: np.ndarray, start: float, end: float, buckets: int) -> np.ndarray:
+    """(buckets × 4) open/high/low/close of a step series over equal time buckets.
+
+    Buckets without a change repeat the previous close; buckets before the
+    first point are NaN.
+    """
+    out = np.full((buckets, 4), np.nan)
+    if len(t) == 0:
+        return out
+
+    edges = np.linspace(start, end, buckets + 1)
+    bucket = np.clip(np.searchsorted(edges, t, side="right") - 1, 0, buckets - 1)
+    first = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    last = np.r_[first[1:], len(t)] - 1
+    filled = bucket[first]
+
+    out[filled, 0] = v[first]
+    out[filled, 1] = np.maximum.reduceat(v, first)
+    out[filled, 2] = np.minimum.reduceat(v, first)
+    out[filled, 3] = v[last]
+
+    # Forward-fill empty buckets with a flat candle at the previous close
+    has_points = np.zeros(buckets, dtype=bool)
+    has_points[filled] = True
+    source = np.maximum.accumulate(np.where(has_points, np.arange(buckets), -1))
+    empty = (source >= 0) & ~has_points
+    out[empty] = out[source[empty], 3][:, None]
+    return out
+
+
+def _rounded(values) -> List[Optional[float]]:
+    return [round(v, 4) if math.isfinite(v) else None for v in values]
+
+
+def rate_history_series(db: Session, currency_code: str, branch_id: int, start: datetime, end: datetime, points: int, mode: str = "lttb") -> Dict[str, Any]:
+    """Chart-ready series of one currency/branch over [start, end], at most `points` long.
+
+    Rates are a step function, so the value in force at `start` is added
+    at `start` and the last value is carried to `end`. Periods when the
+    currency was disabled are left out.
+      * lttb: a subset of the published points (columns t/buy/sell/wholesale_*);
+      * ohlc: `points` equal time buckets with [open, high, low, close] for buy and sell.
+    """
+    history = query_rate_history(db, currency_code, branch_id, start, end)
+    columns = np.vstack([history["timestamp"]] + [history[f] for f in HISTORY_FIELDS])
+
+    previous = last_rate_before(db, currency_code, branch_id, start)
+    if previous is not None:
+        columns = np.hstack([np.r_[start.timestamp(), previous[1:]][:, None], columns])
+    if columns.shape[1] and columns[0, -1] < end.timestamp():
+        columns = np.hstack([columns, np.r_[end.timestamp(), columns[1:, -1]][:, None]])
+    columns = columns[:, ~np.isnan(columns[1:3]).all(axis=0)]
+
+    t = columns[0]
+    buy, sell = columns[1 + HISTORY_FIELDS.index("buy_rate")], columns[1 + HISTORY_FIELDS.index("sell_rate")]
+    result = {"mode": mode, "start": start.isoformat(), "end": end.isoformat()}
+
+    if mode == "ohlc":
+        edges = np.linspace(start.timestamp(), end.timestamp(), points + 1)[:-1]
+        result["t"] = [datetime.fromtimestamp(ts).isoformat() for ts in edges.tolist()]
+        result["buy"] = [_rounded(row) for row in ohlc_buckets(t, buy, start.timestamp(), end.timestamp(), points).tolist()]
+        result["sell"] = [_rounded(row) for row in ohlc_buckets(t, sell, start.timestamp(), end.timestamp(), points).tolist()]
+        return result
+
+    # Triangles are measured on the mid rate so buy and sell keep the same points
+    keep = lttb_indices(t, (np.nan_to_num(buy) + np.nan_to_num(sell)) / 2, points)
+    result["t"] = [datetime.fromtimestamp(ts).isoformat() for ts in t[keep].tolist()]
+    for k, field in enumerate(HISTORY_FIELDS):
+        result[field.removesuffix("_rate")] = _rounded(columns[k + 1, keep].tolist())
+    return result
+
+
+def _record_version(version: datetime):
+    db = SessionLocal()
+    try:
+        snapshot = get_rate_snapshot(db)
+        if snapshot.version == version:
+            record_rate_history(db, snapshot)
+    except Exception as e:
+        print(f"Rate history recording failed: {e}")
+    finally:
+        db.close()
+
+
+def wait_for_rate_history():
+    """Block until every publish queued so far is recorded (scripts and benchmarks)."""
+    _recorder.submit(lambda: None).result()
+
+
+def _record_published(version: datetime):
+    # Runs after the publish committed; the request or upload job does not wait for it
+    _recorder.submit(_record_version, version)
+
+
+on_rates_updated(_record_published)
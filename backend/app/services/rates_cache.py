@@ -0,0 +1,215 @@
+import math
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from app.models import models
+from app.schemas import Currency
+from app.core.state import get_rates_updated_at
+from app.services.rates_matrix import RateMatrix, RATE_FIELDS, KIND
+
+# Descriptive / SEO columns copied from Currency into public payloads
+CURRENCY_INFO_FIELDS = (
+    "name", "name_uk", "flag", "is_popular", "is_active",
+    "buy_url", "sell_url", "seo_h1", "seo_h2", "seo_image", "seo_text",
+    "seo_buy_h1", "seo_buy_h2", "seo_buy_title", "seo_buy_desc", "seo_buy_text", "seo_buy_image",
+    "seo_sell_h1", "seo_sell_h2", "seo_sell_title", "seo_sell_desc", "seo_sell_text", "seo_sell_image",
+)
+
+
+def _row_to_dict(row, fields) -> Dict[str, Any]:
+    return {f: getattr(row, f) for f in fields}
+
+
+class RateSnapshot:
+    """Read-only copy of the published rates for one rates_updated_at version.
+
+    Holds plain dicts (no ORM objects) plus a RateMatrix with every branch's
+    effective rates, so it can be shared across requests. Every derived
+    payload is a slice of the matrix, built once per branch and memoized.
+    """
+
+    def __init__(self, version: datetime, currencies: List[Dict[str, Any]], overrides: Dict[int, Dict[str, Dict[str, Any]]]):
+        self.version = version
+        self.currencies = currencies  # Active currencies ordered by Currency.order
+        self.matrix = RateMatrix(currencies, overrides)  # overrides: {branch_id: {code: BranchRate fields + is_active}}
+        self._views: Dict[Any, Any] = {}
+        self._lock = threading.Lock()
+
+    def _memo(self, key, build: Callable[[], Any]):
+        view = self._views.get(key)
+        if view is None:
+            with self._lock:
+                view = self._views.get(key)
+                if view is None:
+                    view = build()
+                    self._views[key] = view
+        return view
+
+    def currency_list(self, branch_id: Optional[int]) -> List[Currency]:
+        """Base rates merged with branch overrides (GET /api/currencies)."""
+        return self._memo(("currencies", branch_id), lambda: self._build_currency_list(branch_id))
+
+    def branch_currency_list(self, branch_id: int) -> List[Currency]:
+        """Active branch rates only, falling back to branch 1 (GET /api/rates/branch/{id})."""
+        return self._memo(("branch_currencies", branch_id), lambda: self._build_branch_currency_list(branch_id))
+
+    def base_rates(self) -> Dict[str, Dict[str, Any]]:
+        """Rounded base rates keyed by code (GET /api/rates)."""
+        return self._memo(("base",), self._build_base_rates)
+
+    def branch_rates(self, branch_id: int) -> Dict[str, Dict[str, Any]]:
+        """Rounded base + override rates keyed by code (GET /api/rates/{branch_id})."""
+        return self._memo(("branch", branch_id), lambda: self._build_branch_rates(branch_id))
+
+    def simple_rates(self) -> Dict[str, Dict[str, float]]:
+        """Buy/sell pairs for branch 1 (legacy /api/rates payload)."""
+        return self._memo(("simple",), self._build_simple_rates)
+
+    def cross_matrix(self, branch_id: int) -> Dict[str, Any]:
+        """Buy/sell cross rates for every currency pair of a branch (GET /api/rates/cross/matrix)."""
+        return self._memo(("cross", branch_id), lambda: self._build_cross_matrix(branch_id))
+
+    def cross_rate(self, branch_id: int, base: str, quote: str) -> Optional[Tuple[float, float]]:
+        """(buy, sell) of base/quote for a branch; None if either currency is unavailable."""
+        m = self.matrix
+        i = m.quote_index(branch_id)
+        if i < 0 or base not in m.cross_codes or quote not in m.cross_codes:
+            return None
+        j, k = m.cross_codes.index(base), m.cross_codes.index(quote)
+        buy, sell = float(m.cross_buy[i, j, k]), float(m.cross_sell[i, j, k])
+        if math.isnan(buy) or math.isnan(sell):
+            return None
+        return buy, sell
+
+    @staticmethod
+    def _rate_values(row: List[float]) -> Dict[str, Any]:
+        rates = dict(zip(RATE_FIELDS, row))
+        rates["wholesale_threshold"] = int(rates["wholesale_threshold"])
+        rates["wholesale2_threshold"] = int(rates["wholesale2_threshold"])
+        return rates
+
+    def _build_currency_list(self, branch_id):
+        effective = self.matrix.effective_rates(branch_id).tolist()
+        active = self.matrix.active_mask(branch_id).tolist()
+        result = []
+        for base, row, is_active in zip(self.currencies, effective, active):
+            info = {f: base[f] for f in CURRENCY_INFO_FIELDS}
+            info["is_active"] = is_active
+            result.append(Currency(code=base["code"], **info, **self._rate_values(row)))
+        return result
+
+    def _build_branch_currency_list(self, branch_id):
+        # Raw override values, restricted to currencies with an active BranchRate row
+        if not self.matrix.enabled_override_mask(branch_id).any():
+            branch_id = 1
+        enabled = self.matrix.enabled_override_mask(branch_id).tolist()
+        raw = self.matrix.override_rates(branch_id).tolist()
+        result = []
+        for curr, row, is_enabled in zip(self.currencies, raw, enabled):
+            if not is_enabled:
+                continue
+            rates = self._rate_values(row)
+            rates["wholesale_threshold"] = rates["wholesale_threshold"] or curr["wholesale_threshold"]
+            rates["wholesale2_threshold"] = rates["wholesale2_threshold"] or curr["wholesale2_threshold"]
+            info = {f: curr[f] for f in CURRENCY_INFO_FIELDS}
+            result.append(Currency(code=curr["code"], **info, **rates))
+        return result
+
+    def _build_base_rates(self):
+        result = {}
+        for c in self.currencies:
+            result[c["code"]] = {
+                "code": c["code"],
+                "name": c["name"],
+                "name_uk": c["name_uk"],
+                "flag": c["flag"],
+                "buy_rate": round(c["buy_rate"], 4),
+                "sell_rate": round(c["sell_rate"], 4),
+                "wholesale_buy_rate": round(c["wholesale_buy_rate"], 4),
+                "wholesale_sell_rate": round(c["wholesale_sell_rate"], 4),
+                "is_popular": c["is_popular"]
+            }
+        return result
+
+    def _build_branch_rates(self, branch_id):
+        effective = self.matrix.effective_rates(branch_id).tolist()
+        active = self.matrix.active_mask(branch_id).tolist()
+        result = {}
+        for base_c, row, is_active in zip(self.currencies, effective, active):
+            code = base_c["code"]
+            result[code] = {
+                "code": code,
+                "name": base_c["name"],
+                "name_uk": base_c["name_uk"],
+                "flag": base_c["flag"],
+                "buy_rate": round(row[KIND["buy_rate"]], 4),
+                "sell_rate": round(row[KIND["sell_rate"]], 4),
+                "wholesale_buy_rate": round(row[KIND["wholesale_buy_rate"]], 4),
+                "wholesale_sell_rate": round(row[KIND["wholesale_sell_rate"]], 4),
+                "wholesale_threshold": int(row[KIND["wholesale_threshold"]]),
+                "is_popular": base_c["is_popular"],
+                "is_active": is_active
+            }
+        return result
+
+    def _build_cross_matrix(self, branch_id):
+        m = self.matrix
+        i = m.quote_index(branch_id)
+        if i < 0:
+            return {"currencies": [], "buy": [], "sell": []}
+
+        def rounded(rows):
+            return [[round(v, 4) if math.isfinite(v) else None for v in row] for row in rows]
+
+        return {
+            "currencies": m.cross_codes,
+            "buy": rounded(m.cross_buy[i].tolist()),
+            "sell": rounded(m.cross_sell[i].tolist()),
+        }
+
+    def _build_simple_rates(self):
+        enabled = self.matrix.enabled_override_mask(1).tolist()
+        effective = self.matrix.effective_rates(1).tolist()
+        rates_dict = {}
+        for c, row, is_enabled in zip(self.currencies, effective, enabled):
+            if is_enabled:
+                rates_dict[c["code"]] = {"buy": row[KIND["buy_rate"]], "sell": row[KIND["sell_rate"]]}
+        return rates_dict
+
+
+def build_rate_snapshot(db: Session, version: datetime) -> RateSnapshot:
+    """Load active currencies and all branch overrides in two queries."""
+    currencies = [
+        dict(code=c.code, **_row_to_dict(c, RATE_FIELDS + CURRENCY_INFO_FIELDS))
+        for c in db.query(models.Currency).filter(models.Currency.is_active == True).order_by(models.Currency.order).all()
+    ]
+    active_codes = {c["code"] for c in currencies}
+
+    overrides: Dict[int, Dict[str, Dict[str, Any]]] = {}
+    for r in db.query(models.BranchRate).all():
+        if r.currency_code not in active_codes:
+            continue
+        entry = _row_to_dict(r, RATE_FIELDS + ("is_active",))
+        overrides.setdefault(r.branch_id, {})[r.currency_code] = entry
+
+    return RateSnapshot(version, currencies, overrides)
+
+
+_snapshot: Optional[RateSnapshot] = None
+_snapshot_lock = threading.Lock()
+
+
+def get_rate_snapshot(db: Session) -> RateSnapshot:
+    """Return the snapshot for the current rates version, rebuilding it only when the version moves."""
+    global _snapshot
+    version = get_rates_updated_at(db)
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = build_rate_snapshot(db, version)
+        return _snapshot
+
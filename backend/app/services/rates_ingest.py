@@ -0,0 +1,227 @@
+import csv
+import io
+import re
+import numpy as np
+from typing import Dict, List, Optional
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from app.core.state import set_rates_updated_at, get_rates_updated_at
+from app.schemas import RatesIngestRequest, RatesUploadResponseV2
+from app.services.rates_service import CURRENCY_FLAGS, POPULAR_CURRENCIES
+from app.services.rates_upsert import RateUpsert
+
+INGEST_MAX_ROWS = 50000
+# CSV header; rows with an empty branch_id are base rates
+CSV_COLUMNS = ("branch_id", "currency_code", "buy_rate", "sell_rate", "wholesale_buy_rate", "wholesale_sell_rate")
+CSV_REQUIRED = ("currency_code", "buy_rate", "sell_rate")
+
+_CODE = re.compile(r"^[A-Z]{3}$")
+
+
+def _reject(errors: List[str]):
+    raise HTTPException(status_code=400, detail={"message": "Документ не прийнято", "errors": errors[:20]})
+
+
+def parse_rates_json(body: bytes) -> RatesIngestRequest:
+    try:
+        return RatesIngestRequest.model_validate_json(body)
+    except ValidationError as e:
+        _reject([f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()])
+
+
+def parse_rates_csv(body: bytes) -> RatesIngestRequest:
+    """CSV with a CSV_COLUMNS header (any order, wholesale and branch_id optional) into the columnar document."""
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        _reject(["CSV must be UTF-8"])
+    reader = csv.reader(io.StringIO(text))
+    header = [h.strip().lower() for h in next(reader, [])]
+    unknown = [h for h in header if h not in CSV_COLUMNS]
+    missing = [h for h in CSV_REQUIRED if h not in header]
+    if unknown or missing or len(set(header)) != len(header):
+        _reject([f"unknown column: {h}" for h in unknown] + [f"missing column: {h}" for h in missing] or ["duplicate columns"])
+
+    index = {h: i for i, h in enumerate(header)}
+    base: Dict[str, list] = {"code": [], "buy_rate": [], "sell_rate": [], "wholesale_buy_rate": [], "wholesale_sell_rate": []}
+    branches: Dict[str, list] = {c: [] for c in CSV_COLUMNS}
+    errors = []
+
+    def number(row, column, line, integer=False) -> Optional[float]:
+        i = index.get(column)
+        value = row[i].strip() if i is not None and i < len(row) else ""
+        if not value:
+            return None
+        try:
+            return int(value) if integer else float(value)
+        except ValueError:
+            errors.append(f"line {line}: {column} is not a number: {value!r}")
+            return None
+
+    for line, row in enumerate(reader, start=2):
+        if not any(v.strip() for v in row):
+            continue
+        if len(row) != len(header):
+            errors.append(f"line {line}: expected {len(header)} values, got {len(row)}")
+            continue
+        code = row[index["currency_code"]].strip()
+        values = {c: number(row, c, line) for c in ("buy_rate", "sell_rate", "wholesale_buy_rate", "wholesale_sell_rate")}
+        branch_id = number(row, "branch_id", line, integer=True)
+        if branch_id is None:
+            base["code"].append(code)
+            for c, v in values.items():
+                base[c].append(v if v is not None else (0.0 if c.startswith("wholesale") else float("nan")))
+        else:
+            branches["branch_id"].append(branch_id)
+            branches["currency_code"].append(code)
+            for c, v in values.items():
+                branches[c].append(v if v is not None or c.startswith("wholesale") else float("nan"))
+    if errors:
+        _reject(errors)
+
+    try:
+        return RatesIngestRequest(base=base, branches=branches if branches["branch_id"] else None)
+    except ValidationError as e:
+        _reject([f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()])
+
+
+def _columns(table, names, errors: List[str], prefix: str) -> Dict[str, np.ndarray]:
+    """Rate columns of a table as float arrays; checks lengths, missing wholesale becomes NaN."""
+    n = len(getattr(table, names[0]))
+    out = {}
+    for name in ("buy_rate", "sell_rate", "wholesale_buy_rate", "wholesale_sell_rate"):
+        column = getattr(table, name)
+        if column is None:
+            column = [None] * n
+        if len(column) != n:
+            errors.append(f"{prefix}.{name}: expected {n} values, got {len(column)}")
+            column = (list(column) + [None] * n)[:n]
+        out[name] = np.array([np.nan if v is None else v for v in column], dtype=np.float64)
+    return out
+
+
+def validate_rates_document(doc: RatesIngestRequest, branch_ids) -> List[str]:
+    """All problems of a document at once (vectorized checks over the rate columns)."""
+    errors = []
+    base = doc.base
+    codes = [c.strip().upper() for c in base.code]
+    base_rates = _columns(base, ("code",), errors, "base")
+    if len(codes) + (len(doc.branches.branch_id) if doc.branches else 0) > INGEST_MAX_ROWS:
+        return [f"at most {INGEST_MAX_ROWS} rows per document"]
+
+    if not codes:
+        errors.append("base.code: at least one currency is required")
+    bad_codes = [c for c in codes if not _CODE.match(c)]
+    if bad_codes:
+        errors.append(f"base.code: not ISO codes: {', '.join(bad_codes[:10])}")
+    seen, dupes = set(), set()
+    for c in codes:
+        (dupes if c in seen else seen).add(c)
+    if dupes:
+        errors.append(f"base.code: duplicates: {', '.join(sorted(dupes)[:10])}")
+
+    for name, values in base_rates.items():
+        required = not name.startswith("wholesale")
+        bad = ~np.isfinite(values) | (values <= 0) if required else np.isfinite(values) & (values < 0)
+        if bad.any():
+            errors.append(f"base.{name}: invalid for {', '.join(codes[i] for i in np.flatnonzero(bad)[:10])}")
+
+    if doc.branches:
+        br = doc.branches
+        n = len(br.branch_id)
+        if len(br.currency_code) != n:
+            errors.append(f"branches.currency_code: expected {n} values, got {len(br.currency_code)}")
+        rates = _columns(br, ("branch_id",), errors, "branches")
+        br_codes = [c.strip().upper() for c in br.currency_code[:n]]
+        unknown_branches = sorted(set(br.branch_id) - set(branch_ids))
+        if unknown_branches:
+            errors.append(f"branches.branch_id: unknown branches: {', '.join(map(str, unknown_branches[:10]))}")
+        not_in_base = sorted(set(br_codes) - seen)
+        if not_in_base:
+            errors.append(f"branches.currency_code: not in base rates: {', '.join(not_in_base[:10])}")
+        pairs = list(zip(br.branch_id, br_codes))
+        if len(set(pairs)) != len(pairs):
+            errors.append("branches: duplicate branch_id / currency_code pairs")
+        for name, values in rates.items():
+            required = not name.startswith("wholesale")
+            bad = ~np.isfinite(values) | (values <= 0) if required else np.isfinite(values) & (values < 0)
+            if bad.any():
+                rows = np.flatnonzero(bad)[:10].tolist()
+                errors.append(f"branches.{name}: invalid at rows {', '.join(map(str, rows))}")
+    return errors
+
+
+def apply_rates_ingest(db: Session, doc: RatesIngestRequest) -> RatesUploadResponseV2:
+    """Apply a validated columnar rates document in one transaction and publish it.
+
+    Same publish semantics as the Excel upload: the document's base rates
+    are the full list of active currencies (everything else is deactivated),
+    branches without their own row for a currency get the base rates, and
+    rates_updated_at is bumped once at the end.
+    """
+    store = RateUpsert(db)
+    errors = validate_rates_document(doc, store.branches.keys())
+    if errors:
+        _reject(errors)
+
+    base = doc.base
+    codes = [c.strip().upper() for c in base.code]
+    base_rates = _columns(base, ("code",), [], "base")
+    wholesale_buy = np.nan_to_num(base_rates["wholesale_buy_rate"])
+    wholesale_sell = np.nan_to_num(base_rates["wholesale_sell_rate"])
+
+    for i, code in enumerate(codes):
+        values = dict(
+            buy_rate=base_rates["buy_rate"][i].item(),
+            sell_rate=base_rates["sell_rate"][i].item(),
+            wholesale_buy_rate=wholesale_buy[i].item(),
+            wholesale_sell_rate=wholesale_sell[i].item(),
+            is_active=True,
+        )
+        curr = store.currency(code)
+        if curr:
+            store.set_currency(curr, **values)
+        else:
+            store.add_currency(
+                code=code, name=code, name_uk=code, flag=CURRENCY_FLAGS.get(code, "🏳️"),
+                is_popular=code in POPULAR_CURRENCIES, **values
+            )
+
+    explicit = set()
+    if doc.branches:
+        br = doc.branches
+        rates = _columns(br, ("branch_id",), [], "branches")
+        base_index = {code: i for i, code in enumerate(codes)}
+        for i, (branch_id, code) in enumerate(zip(br.branch_id, br.currency_code)):
+            code = code.strip().upper()
+            j = base_index[code]
+            # Branch wholesale falls back to the base wholesale, as in the Excel upload
+            w_buy = rates["wholesale_buy_rate"][i]
+            w_sell = rates["wholesale_sell_rate"][i]
+            values = dict(
+                buy_rate=rates["buy_rate"][i].item(),
+                sell_rate=rates["sell_rate"][i].item(),
+                wholesale_buy_rate=(w_buy if w_buy > 0 else wholesale_buy[j]).item(),
+                wholesale_sell_rate=(w_sell if w_sell > 0 else wholesale_sell[j]).item(),
+                is_active=True,
+            )
+            row = store.branch_rate(branch_id, code)
+            if row:
+                store.set_branch_rate(row, **values)
+            else:
+                store.add_branch_rate(branch_id=branch_id, currency_code=code, **values)
+            explicit.add((branch_id, code))
+
+    branch_updated = len(explicit) + store.final_sync(set(codes), explicit)
+    store.flush()
+    db.commit()
+    set_rates_updated_at(db)
+
+    return RatesUploadResponseV2(
+        success=True,
+        message=f"Курси оновлено о {get_rates_updated_at(db).strftime('%H:%M:%S')}",
+        base_rates_updated=len(codes),
+        branch_rates_updated=branch_updated,
+        errors=[]
+    )
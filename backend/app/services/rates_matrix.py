@@ -0,0 +1,154 @@
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+# Rate kinds (last axis of every matrix). Shared by Currency (base) and BranchRate (override).
+RATE_FIELDS = (
+    "buy_rate", "sell_rate",
+    "wholesale_buy_rate", "wholesale_sell_rate", "wholesale_threshold",
+    "wholesale2_buy_rate", "wholesale2_sell_rate", "wholesale2_threshold",
+)
+KIND = {f: i for i, f in enumerate(RATE_FIELDS)}
+THRESHOLD_KINDS = np.array([f.endswith("_threshold") for f in RATE_FIELDS])
+
+# Default BranchRate.wholesale_threshold; an override equal to it means "not customised"
+DEFAULT_WHOLESALE_THRESHOLD = 1000
+
+# Branch whose BranchRate rows stand in for currencies a branch has no row for
+DEFAULT_BRANCH_ID = 1
+
+
+class RateMatrix:
+    """Dense branches × currencies × rate-kind arrays of base and override rates.
+
+    All effective rates for all branches are resolved in one vectorized pass
+    at construction time:
+      * override value is used if > 0, otherwise the Currency base value;
+      * wholesale_threshold override is ignored when it equals the default 1000;
+      * a disabled override zeroes every rate and keeps the base thresholds.
+
+    Quotes and cross rates work on BranchRate values directly (as the
+    calculator always did): a branch without a row for a currency borrows
+    branch 1's row, and a disabled row makes the currency unavailable.
+    The buy/sell cross matrix of every branch (UAH included) is computed
+    here as well, so cross quotes are array lookups.
+    """
+
+    def __init__(self, currencies: List[Dict[str, Any]], overrides: Dict[int, Dict[str, Dict[str, Any]]]):
+        self.codes = [c["code"] for c in currencies]
+        self.branch_ids = sorted(overrides)
+        self._col = {code: j for j, code in enumerate(self.codes)}
+        self._row = {bid: i for i, bid in enumerate(self.branch_ids)}
+
+        n_branches, n_currencies, n_kinds = len(self.branch_ids), len(self.codes), len(RATE_FIELDS)
+
+        self.base = np.array(
+            [[c[f] or 0 for f in RATE_FIELDS] for c in currencies], dtype=np.float64
+        ).reshape(n_currencies, n_kinds)
+
+        self.raw = np.zeros((n_branches, n_currencies, n_kinds), dtype=np.float64)
+        self.has_override = np.zeros((n_branches, n_currencies), dtype=bool)
+        self.override_active = np.ones((n_branches, n_currencies), dtype=bool)
+
+        rows, cols, values, active = [], [], [], []
+        for bid, rates in overrides.items():
+            for code, entry in rates.items():
+                rows.append(self._row[bid])
+                cols.append(self._col[code])
+                values.append([entry[f] or 0 for f in RATE_FIELDS])
+                active.append(bool(entry["is_active"]))
+        if rows:
+            self.raw[rows, cols] = values
+            self.has_override[rows, cols] = True
+            self.override_active[rows, cols] = active
+
+        self._resolve()
+
+    def _resolve(self):
+        base = np.broadcast_to(self.base, self.raw.shape)
+        use_override = self.has_override[..., None] & (self.raw > 0)
+
+        effective = np.where(use_override, self.raw, base)
+
+        thr = KIND["wholesale_threshold"]
+        custom_threshold = use_override[..., thr] & (self.raw[..., thr] != DEFAULT_WHOLESALE_THRESHOLD)
+        effective[..., thr] = np.where(custom_threshold, self.raw[..., thr], base[..., thr])
+
+        disabled = self.has_override & ~self.override_active
+        effective[disabled] = np.where(THRESHOLD_KINDS, base[disabled], 0.0)
+
+        self.effective = effective
+        self.active = ~disabled
+        self.enabled_override = self.has_override & self.override_active
+
+        self._resolve_quote_rates()
+        self._resolve_cross()
+
+    def _resolve_quote_rates(self):
+        d = self._row.get(DEFAULT_BRANCH_ID)
+        thr = KIND["wholesale_threshold"]
+        if d is None:
+            borrow = np.zeros_like(self.has_override)
+            default_raw, default_threshold, default_enabled = self.raw, self.effective[..., thr], self.enabled_override
+        else:
+            borrow = ~self.has_override & self.has_override[d][None, :]
+            default_raw, default_threshold, default_enabled = self.raw[d][None], self.effective[d, :, thr][None], self.enabled_override[d][None]
+
+        self.quote_raw = np.where(borrow[..., None], default_raw, self.raw)
+        self.quote_threshold = np.where(borrow, default_threshold, self.effective[..., thr])
+        self.quote_available = np.where(borrow, default_enabled, self.enabled_override)
+
+    def _resolve_cross(self):
+        # Currency axis extended with UAH (rate 1) so pairs with UAH need no special case
+        n_branches = len(self.branch_ids)
+        ones = np.ones((n_branches, 1))
+        buy = np.concatenate([self.quote_raw[..., KIND["buy_rate"]], ones], axis=1)
+        sell = np.concatenate([self.quote_raw[..., KIND["sell_rate"]], ones], axis=1)
+        # A leg quoted at 0 (or below) is unavailable, not a 0 rate: NaN -> 404 like a missing currency
+        available = np.concatenate([self.quote_available, np.ones((n_branches, 1), dtype=bool)], axis=1) & (buy > 0) & (sell > 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # base -> UAH at the base buy rate, UAH -> quote at the quote sell rate (and the reverse)
+            cross_buy = buy[:, :, None] / sell[:, None, :]
+            cross_sell = sell[:, :, None] / buy[:, None, :]
+
+        pair_available = available[:, :, None] & available[:, None, :]
+        self.cross_codes = self.codes + ["UAH"]
+        self.cross_buy = np.where(pair_available, cross_buy, np.nan)
+        self.cross_sell = np.where(pair_available, cross_sell, np.nan)
+
+    def _index(self, branch_id: Optional[int]) -> Optional[int]:
+        return self._row.get(branch_id) if branch_id else None
+
+    def branch_index(self, branch_id: Optional[int]) -> int:
+        """Row of a branch in raw/effective, or -1."""
+        i = self._index(branch_id)
+        return -1 if i is None else i
+
+    def quote_index(self, branch_id: Optional[int]) -> int:
+        """Row used for quotes: the branch, or branch 1 for unknown branches (-1 if neither exists)."""
+        i = self.branch_index(branch_id)
+        return i if i >= 0 else self.branch_index(DEFAULT_BRANCH_ID)
+
+    def currency_index(self, code: str) -> int:
+        """Column of a currency code, or -1 (UAH and unknown/inactive codes)."""
+        return self._col.get(code, -1)
+
+    def effective_rates(self, branch_id: Optional[int]) -> np.ndarray:
+        """(currencies × kinds) effective rates; base rates for unknown branches."""
+        i = self._index(branch_id)
+        return self.base if i is None else self.effective[i]
+
+    def active_mask(self, branch_id: Optional[int]) -> np.ndarray:
+        """Currencies not explicitly disabled for the branch."""
+        i = self._index(branch_id)
+        return np.ones(len(self.codes), dtype=bool) if i is None else self.active[i]
+
+    def override_rates(self, branch_id: Optional[int]) -> np.ndarray:
+        """(currencies × kinds) raw BranchRate values (zeros where no override)."""
+        i = self._index(branch_id)
+        return np.zeros_like(self.base) if i is None else self.raw[i]
+
+    def enabled_override_mask(self, branch_id: Optional[int]) -> np.ndarray:
+        """Currencies with an active BranchRate row for the branch."""
+        i = self._index(branch_id)
+        return np.zeros(len(self.codes), dtype=bool) if i is None else self.enabled_override[i]
@@ -0,0 +1,226 @@
+import io
+import math
+from itertools import chain, islice
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from openpyxl import load_workbook
+
+Row = Tuple[Any, ...]
+
+# Rows scanned for the header row of the base rates sheet
+PREVIEW_ROWS = 10
+# Data rows looked at when the currency code column has to be guessed from values
+SAMPLE_ROWS = 50
+
+BASE_SHEET_NAMES = ("курси", "rates")
+BRANCH_SHEET_NAMES = ("відділення", "branches", "філії")
+
+
+def cell(row: Row, index: Optional[int]) -> Any:
+    """Value of a column, None past the end of a short row."""
+    if index is None or index < 0 or index >= len(row):
+        return None
+    return row[index]
+
+
+def cell_text(value: Any) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def parse_rate(value: Any) -> Optional[float]:
+    """Rate cell as float: accepts numbers and strings like '41,5' or '41 500'; None for empty, '-' or junk."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        text = str(value).replace(",", ".").replace(" ", "").replace("\xa0", "").strip()
+        if not text or text == "-":
+            return None
+        try:
+            number = float(text)
+        except ValueError:
+            return None
+    return number if math.isfinite(number) else None
+
+
+def rate_type(header: Any) -> Optional[str]:
+    """buy / sell / wholesale_buy / wholesale_sell from a branch column header ('Купівля', 'Опт продаж', ...)."""
+    text = cell_text(header).lower()
+    if "опт" in text:
+        if "куп" in text: return "wholesale_buy"
+        if "прод" in text: return "wholesale_sell"
+    else:
+        if "куп" in text: return "buy"
+        if "прод" in text: return "sell"
+    return None
+
+
+def column_names(headers: Sequence[Any]) -> List[str]:
+    """Lower-cased, stripped header names; blanks become 'unnamed: i', repeats get a _1, _2 suffix."""
+    names, counts = [], {}
+    for i, header in enumerate(headers):
+        name = cell_text(header).lower() or f"unnamed: {i}"
+        if name in counts:
+            counts[name] += 1
+            names.append(f"{name}_{counts[name]}")
+        else:
+            counts[name] = 0
+            names.append(name)
+    return names
+
+
+def find_column(names: Sequence[str], markers: Sequence[str], exclude: Sequence[str] = (), skip: Optional[int] = None) -> Optional[int]:
+    """Index of the first column whose name contains any marker and none of `exclude`."""
+    for i, name in enumerate(names):
+        if i != skip and any(m in name for m in markers) and not any(x in name for x in exclude):
+            return i
+    return None
+
+
+def find_header_row(preview: List[Row]) -> int:
+    """First row naming a code / currency column; 0 if none does."""
+    for i, row in enumerate(preview):
+        if any(m in cell_text(v).lower() for v in row for m in ("код", "code", "валют")):
+            return i
+    return 0
+
+
+class BaseRateRow(NamedTuple):
+    index: int  # data row number below the header, as in the sheet
+    code: str
+    name_uk: Optional[str]
+    flag: Optional[str]  # None when the sheet has no flag for the row
+    buy_rate: float
+    sell_rate: float
+    wholesale_buy_rate: float
+    wholesale_sell_rate: float
+    cells: Row  # the raw row, for branch columns
+
+
+class BaseRatesSheet:
+    """The base rates sheet, read in a single streaming pass.
+
+    Only the first PREVIEW_ROWS rows (plus a few data rows when the code
+    column has to be guessed) are buffered. The header row is the first one
+    naming a code / currency column, which covers the three layouts:
+      * 1 row: headers only;
+      * 2 rows: branch numbers or addresses, then headers;
+      * 3 rows: branch numbers, branch addresses, then headers.
+    Rows above the header are kept in `branch_header` for the branch columns.
+    """
+
+    def __init__(self, rows: Iterator[Row], detect_header: Callable[[List[Row]], int] = find_header_row):
+        self._rows = iter(rows)
+        preview = list(islice(self._rows, PREVIEW_ROWS))
+        self.header_row = detect_header(preview) if preview else 0
+        self.branch_header = preview[:self.header_row]
+        self.headers: Row = preview[self.header_row] if self.header_row < len(preview) else ()
+        self.width = max((len(r) for r in preview), default=0)
+        self.columns = column_names(self.headers)
+        self._buffer = preview[self.header_row + 1:]
+        self._locate_columns()
+
+    def _locate_columns(self):
+        names = self.columns
+        self.code_col = find_column(names, ("код", "code", "iso"))
+        if self.code_col is None:
+            self.code_col = find_column(names, ("валют", "currency"), exclude=("назва", "name"))
+        self.name_col = find_column(names, ("назва", "name", "валют", "currency"), skip=self.code_col)
+        self.buy_col = find_column(names, ("купів", "buy", "покуп"), exclude=("опт",))
+        self.sell_col = find_column(names, ("прода", "sell"), exclude=("опт",))
+        self.wholesale_buy_col = next((i for i, n in enumerate(names) if "опт" in n and any(m in n for m in ("купів", "buy", "покуп"))), None)
+        self.wholesale_sell_col = next((i for i, n in enumerate(names) if "опт" in n and any(m in n for m in ("прода", "sell"))), None)
+        self.flag_col = find_column(names, ("прапор", "flag"))
+
+        # A 'Валюта' column holding names rather than ISO codes is not the code column
+        if self.code_col is not None and "валют" in names[self.code_col] and "код" not in names[self.code_col]:
+            first = next((v for v in self._column_sample(self.code_col)), None)
+            if first is not None and len(str(first)) > 3:
+                self.code_col = None
+
+        if self.code_col is None or self.code_col in (self.buy_col, self.sell_col):
+            for i in range(len(names)):
+                sample = list(islice(self._column_sample(i), 3))
+                if sample and all(len(str(x).strip()) == 3 and str(x).strip().isalpha() for x in sample):
+                    self.code_col = i
+                    break
+
+    def _column_sample(self, index: int) -> Iterator[Any]:
+        if len(self._buffer) < SAMPLE_ROWS:
+            self._buffer += list(islice(self._rows, SAMPLE_ROWS - len(self._buffer)))
+        return (v for v in (cell(r, index) for r in self._buffer) if v is not None)
+
+    @property
+    def has_rates(self) -> bool:
+        return self.code_col is not None and self.buy_col is not None and self.sell_col is not None
+
+    def __iter__(self) -> Iterator[BaseRateRow]:
+        """Rows with a 3-letter code and positive buy and sell rates."""
+        if not self.has_rates:
+            return
+        for index, row in enumerate(chain(self._buffer, self._rows)):
+            code = cell_text(cell(row, self.code_col)).upper()
+            if len(code) != 3:
+                continue
+            buy, sell = parse_rate(cell(row, self.buy_col)), parse_rate(cell(row, self.sell_col))
+            if buy is None or sell is None or buy <= 0 or sell <= 0:
+                continue
+            yield BaseRateRow(
+                index=index,
+                code=code,
+                name_uk=cell_text(cell(row, self.name_col)) or None,
+                flag=cell_text(cell(row, self.flag_col)) or None,
+                buy_rate=buy,
+                sell_rate=sell,
+                wholesale_buy_rate=parse_rate(cell(row, self.wholesale_buy_col)) or 0.0,
+                wholesale_sell_rate=parse_rate(cell(row, self.wholesale_sell_col)) or 0.0,
+                cells=row,
+            )
+
+
+class SheetTable:
+    """A sheet with a single header row: normalised column names plus streamed data rows."""
+
+    def __init__(self, rows: Iterator[Row]):
+        self._rows = iter(rows)
+        self.columns = column_names(next(self._rows, ()))
+
+    def find(self, markers: Sequence[str], exclude: Sequence[str] = ()) -> Optional[int]:
+        return find_column(self.columns, markers, exclude)
+
+    def __iter__(self) -> Iterator[Row]:
+        return self._rows
+
+
+class RatesWorkbook:
+    """An uploaded .xlsx opened once in openpyxl read-only mode; sheets are streamed, never loaded whole."""
+
+    def __init__(self, contents: bytes):
+        self._wb = load_workbook(io.BytesIO(contents), read_only=True, data_only=True)
+        self.sheet_names: List[str] = self._wb.sheetnames
+
+    def find_sheet(self, names: Sequence[str]) -> Optional[str]:
+        lower = [s.lower() for s in self.sheet_names]
+        for name in names:
+            if name in lower:
+                return self.sheet_names[lower.index(name)]
+        return None
+
+    @property
+    def base_sheet(self) -> str:
+        return self.find_sheet(BASE_SHEET_NAMES) or self.sheet_names[0]
+
+    @property
+    def branch_sheet(self) -> Optional[str]:
+        """A separate branch rates sheet, if the workbook has one."""
+        name = self.find_sheet(BRANCH_SHEET_NAMES)
+        return name if name != self.base_sheet else None
+
+    def rows(self, sheet: str) -> Iterator[Row]:
+        ws = self._wb[sheet]
+        # Some exporters write a wrong <dimension>; read every row that is actually there
+        ws.reset_dimensions()
+        return ws.iter_rows(values_only=True)
+
+    def close(self):
+        self._wb.close()
@@ -0,0 +1,94 @@
+import numpy as np
+from typing import Any, Dict, List
+from app.schemas import QuoteRequest
+from app.services.rates_cache import RateSnapshot
+from app.services.rates_matrix import KIND, DEFAULT_BRANCH_ID
+
+MAX_QUOTES_PER_REQUEST = 1000
+
+
+def compute_quotes(snapshot: RateSnapshot, quotes: List[QuoteRequest]) -> List[Dict[str, Any]]:
+    """Evaluate many calculator quotes in one vectorized pass over the snapshot.
+
+    Same rules as GET /api/calculate, per branch:
+      * rates are RateMatrix.quote_raw (the branch's BranchRate values, or
+        branch 1's when the branch has no row for the currency);
+      * foreign -> UAH uses the buy rate, or wholesale buy once the foreign
+        amount reaches the wholesale threshold;
+      * UAH -> foreign uses the sell rate, or wholesale sell once the bought
+        amount reaches the threshold;
+      * foreign -> foreign goes through UAH at buy / sell without wholesale.
+    """
+    m = snapshot.matrix
+    n = len(quotes)
+    if n == 0:
+        return []
+
+    from_codes = [q.from_currency.upper() for q in quotes]
+    to_codes = [q.to_currency.upper() for q in quotes]
+    branch_ids = [q.branch_id or DEFAULT_BRANCH_ID for q in quotes]
+
+    amount = np.array([q.amount for q in quotes], dtype=np.float64)
+    from_uah = np.array([c == "UAH" for c in from_codes])
+    to_uah = np.array([c == "UAH" for c in to_codes])
+    row = np.array([m.quote_index(b) for b in branch_ids], dtype=np.int64)
+
+    def lookup(codes):
+        """(n x kinds) BranchRate values, thresholds and availability for one side of every quote."""
+        col = np.array([m.currency_index(c) for c in codes], dtype=np.int64)
+        r, c = np.maximum(row, 0), np.maximum(col, 0)
+        if not m.branch_ids or not m.codes:
+            return np.zeros((n, len(KIND))), np.zeros(n), np.zeros(n, dtype=bool)
+        found = (row >= 0) & (col >= 0) & m.quote_available[r, c]
+        return m.quote_raw[r, c], m.quote_threshold[r, c], found
+
+    from_rates, from_threshold, from_found = lookup(from_codes)
+    to_rates, to_threshold, to_found = lookup(to_codes)
+
+    buy = from_rates[:, KIND["buy_rate"]]
+    wholesale_buy = from_rates[:, KIND["wholesale_buy_rate"]]
+    sell = to_rates[:, KIND["sell_rate"]]
+    wholesale_sell = to_rates[:, KIND["wholesale_sell_rate"]]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Foreign -> UAH
+        sell_rate = np.where((amount >= from_threshold) & (wholesale_buy > 0), wholesale_buy, buy)
+        sell_result = amount * sell_rate
+
+        # UAH -> foreign (threshold checked on the foreign amount)
+        retail_amount = amount / sell
+        buy_rate = np.where((retail_amount >= to_threshold) & (wholesale_sell > 0), wholesale_sell, sell)
+        buy_result = amount / buy_rate
+
+        # Foreign -> foreign via UAH
+        cross_result = amount * buy / sell
+        cross_rate = cross_result / amount
+
+    result = np.select([to_uah, from_uah], [sell_result, buy_result], cross_result)
+    rate = np.select([to_uah, from_uah], [sell_rate, buy_rate], cross_rate)
+    found = np.select(
+        [from_uah & to_uah, to_uah, from_uah],
+        [np.zeros(n, dtype=bool), from_found, to_found],
+        from_found & to_found,
+    )
+    computable = np.isfinite(result) & np.isfinite(rate)
+
+    out = []
+    for i, (res, r, ok, fin) in enumerate(zip(result.tolist(), rate.tolist(), found.tolist(), computable.tolist())):
+        item = {
+            "from_amount": quotes[i].amount,
+            "from_currency": from_codes[i],
+            "to_amount": None,
+            "to_currency": to_codes[i],
+            "rate": None,
+            "branch_id": branch_ids[i],
+        }
+        if not ok:
+            item["error"] = "Currency not found"
+        elif not fin:
+            item["error"] = "Rate not available"
+        else:
+            item["to_amount"] = round(res, 2)
+            item["rate"] = r
+        out.append(item)
+    return out
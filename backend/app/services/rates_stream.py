@@ -0,0 +1,114 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import AsyncIterator, Optional, Set
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+from app.core.database import SessionLocal
+from app.core.state import get_rates_updated_at, on_rates_updated
+from app.services.rates_cache import get_rate_snapshot
+
+# How often one worker checks site_settings for rate changes made by other workers
+STREAM_POLL_SECONDS = 1.0
+# Comment line sent on idle connections so proxies do not close them
+STREAM_HEARTBEAT_SECONDS = 15.0
+
+
+def _read_version() -> datetime:
+    db = SessionLocal()
+    try:
+        return get_rates_updated_at(db)
+    finally:
+        db.close()
+
+
+def _read_currencies(branch_id: Optional[int]):
+    db = SessionLocal()
+    try:
+        return jsonable_encoder(get_rate_snapshot(db).currency_list(branch_id))
+    finally:
+        db.close()
+
+
+class RatesBroadcaster:
+    """Fans out rates version changes to the SSE subscribers of this worker.
+
+    Changes made in this process (set_rates_updated_at) are pushed immediately.
+    Changes made by other workers are picked up by a single shared version poll
+    that only runs while someone is subscribed.
+    """
+
+    def __init__(self):
+        self.version: Optional[datetime] = None
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._watcher: Optional[asyncio.Task] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.add(queue)
+        if self._watcher is None or self._watcher.done():
+            self._watcher = self._loop.create_task(self._watch())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def notify(self, version: datetime):
+        """Thread-safe entry point; set_rates_updated_at may run in a threadpool."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._publish, version)
+
+    def _publish(self, version: datetime):
+        if version == self.version:
+            return
+        self.version = version
+        for queue in list(self._subscribers):
+            # Only the newest version matters, so a slow client just skips intermediate ones
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(version)
+
+    async def _watch(self):
+        while self._subscribers:
+            await asyncio.sleep(STREAM_POLL_SECONDS)
+            try:
+                version = await run_in_threadpool(_read_version)
+            except Exception as e:
+                print(f"Rates stream poll failed: {e}")
+                continue
+            self._publish(version)
+
+
+broadcaster = RatesBroadcaster()
+on_rates_updated(broadcaster.notify)
+
+
+async def _format_event(version: datetime, branch_id: Optional[int], with_rates: bool) -> str:
+    data = {"version": version.isoformat(), "updated_at": version.isoformat()}
+    if with_rates:
+        data["branch_id"] = branch_id
+        data["currencies"] = await run_in_threadpool(_read_currencies, branch_id)
+    return f"id: {data['version']}\nevent: rates\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def rates_event_stream(request: Request, branch_id: Optional[int] = None, with_rates: bool = False) -> AsyncIterator[str]:
+    """One `rates` event with the current version on connect, then one per change."""
+    queue = broadcaster.subscribe()
+    try:
+        version = broadcaster.version or await run_in_threadpool(_read_version)
+        yield "retry: 5000\n\n"
+        yield await _format_event(version, branch_id, with_rates)
+        while not await request.is_disconnected():
+            try:
+                new_version = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if new_version != version:
+                version = new_version
+                yield await _format_event(version, branch_id, with_rates)
+    finally:
+        broadcaster.unsubscribe(queue)
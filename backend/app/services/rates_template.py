@@ -0,0 +1,131 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+from app.core.database import SessionLocal
+from app.core.state import get_rates_updated_at
+from app.models import models
+from app.services.rates_service import CURRENCY_FLAGS
+
+# Built templates, one file per rates version + branch list; older files are removed on rebuild
+TEMPLATE_CACHE_DIR = os.getenv("RATES_TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "svit_valut_templates"))
+TEMPLATE_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Superseded files are kept this long, in case another request is still sending one
+TEMPLATE_STALE_SECONDS = 60
+
+RATE_COLUMNS = ("Купівля", "Продаж", "Опт Купівля", "Опт Продаж")
+
+_HEADER_FONT = Font(bold=True)
+_CENTER = Alignment(horizontal="center", vertical="center")
+_FILLS = {
+    "Купівля": PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid"),  # Light Green
+    "Продаж": PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid"),  # Light Red/Pink
+    "Опт Купівля": PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid"),  # Pale Green
+    "Опт Продаж": PatternFill(start_color="FCE4D6", end_color="FCE4D6", fill_type="solid"),  # Pale Orange
+}
+_FILL_NEUTRAL = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")  # Grey
+
+# Only one build per process at a time; concurrent downloads of a stale template wait for it
+_build_lock = threading.Lock()
+
+
+def template_key(version, branches) -> str:
+    """Cache key of the template: rates version plus every branch's id, number and address in column order."""
+    parts = [version.isoformat()] + [f"{b.id}:{b.number}:{b.address}" for b in branches]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:20]
+
+
+def _header(ws, value, fill=None) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=value)
+    cell.font = _HEADER_FONT
+    cell.alignment = _CENTER
+    if fill is not None:
+        cell.fill = fill
+    return cell
+
+
+def write_rates_template(db, branches, codes: List[str], names: Dict[str, Tuple[str, str]], path: str):
+    """Write the vertical template (rows = `codes`, 4 columns per branch) row by row in write-only mode."""
+    rates_map = {
+        (r.branch_id, r.currency_code): (r.buy_rate, r.sell_rate, r.wholesale_buy_rate, r.wholesale_sell_rate)
+        for r in db.query(
+            models.BranchRate.branch_id, models.BranchRate.currency_code,
+            models.BranchRate.buy_rate, models.BranchRate.sell_rate,
+            models.BranchRate.wholesale_buy_rate, models.BranchRate.wholesale_sell_rate,
+        )
+    }
+    curr_info = {c.code: (c.flag, c.name_uk) for c in db.query(models.Currency.code, models.Currency.flag, models.Currency.name_uk)}
+    empty = (0.0, 0.0, 0.0, 0.0)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Курси")
+
+    # Column widths and merges must be set before the first row is written
+    for i in range(1, 4 + 4 * len(branches)):
+        ws.column_dimensions[get_column_letter(i)].width = 15 if i > 3 else 10
+    for n in range(len(branches)):
+        start, end = get_column_letter(4 + 4 * n), get_column_letter(7 + 4 * n)
+        ws.merged_cells.add(f"{start}1:{end}1")
+        ws.merged_cells.add(f"{start}2:{end}2")
+
+    # Row 1: branch numbers (editable), row 2: addresses (identify the branch if the number changes)
+    padding = [None] * 3
+    ws.append([None] * 3 + [c for b in branches for c in (_header(ws, f"№ {b.number if b.number else b.id}"), *padding)])
+    ws.append([None] * 3 + [c for b in branches for c in (_header(ws, b.address), *padding)])
+    ws.append(
+        [_header(ws, title, _FILL_NEUTRAL) for title in ("Код", "Прапор", "Валюта")]
+        + [_header(ws, title, _FILLS[title]) for _ in branches for title in RATE_COLUMNS]
+    )
+
+    for code in codes:
+        # Currencies not in the DB yet get the default flag and name
+        flag, name_uk = curr_info.get(code) or (CURRENCY_FLAGS.get(code, "🏳️"), names.get(code, (code, code))[1])
+        row = [code, flag, name_uk]
+        for branch in branches:
+            row.extend(rates_map.get((branch.id, code), empty))
+        ws.append(row)
+
+    wb.save(path)
+
+
+def rates_template_file(codes: List[str], names: Dict[str, Tuple[str, str]]) -> str:
+    """Path of the template for the current rates and branches, built only when either changed."""
+    db = SessionLocal()
+    try:
+        branches = db.query(models.Branch.id, models.Branch.number, models.Branch.address).order_by(models.Branch.number).all()
+        key = template_key(get_rates_updated_at(db), branches)
+        path = os.path.join(TEMPLATE_CACHE_DIR, f"rates_template_{key}.xlsx")
+        if os.path.exists(path):
+            return path
+
+        with _build_lock:
+            if os.path.exists(path):
+                return path
+            os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+            # Write next to the target and rename, so other workers never serve a half-written file
+            fd, tmp = tempfile.mkstemp(dir=TEMPLATE_CACHE_DIR, prefix=".rates_template_", suffix=".tmp")
+            os.close(fd)
+            try:
+                write_rates_template(db, branches, codes, names, tmp)
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+            for name in os.listdir(TEMPLATE_CACHE_DIR):
+                old = os.path.join(TEMPLATE_CACHE_DIR, name)
+                if name.startswith("rates_template_") and old != path:
+                    try:
+                        if os.path.getmtime(old) < time.time() - TEMPLATE_STALE_SECONDS:
+                            os.remove(old)
+                    except OSError:
+                        pass
+        return path
+    finally:
+        db.close()
@@ -0,0 +1,142 @@
+import json
+import traceback
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.models import models
+from app.schemas import RatesUploadJob, RatesUploadResponseV2
+
+# Finished jobs older than this are dropped when a new upload is queued
+JOB_RETENTION_DAYS = 7
+
+# progress(stage, rows_processed=None), called by the upload handler as it goes
+Progress = Callable[..., None]
+UploadHandler = Callable[[Session, bytes, Progress], RatesUploadResponseV2]
+
+# One upload at a time per worker: uploads rewrite the same rows, and parsing stays off the event loop
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rates-upload")
+
+# Live stage / row counter of jobs queued or running in this process. The table
+# is only written when a job starts and finishes, never while the upload's own
+# transaction is open (SQLite would block on the second writer).
+_live: Dict[str, Dict[str, Any]] = {}
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _to_schema(job: models.RateUploadJob) -> RatesUploadJob:
+    live = _live.get(job.id) if job.status in ("queued", "running") else None
+    return RatesUploadJob(
+        id=job.id,
+        status=job.status,
+        filename=job.filename,
+        stage=live["stage"] if live else job.stage,
+        rows_processed=live["rows_processed"] if live else job.rows_processed or 0,
+        success={"done": True, "failed": False}.get(job.status),
+        message=job.message,
+        base_rates_updated=job.base_rates_updated or 0,
+        branch_rates_updated=job.branch_rates_updated or 0,
+        errors=json.loads(job.errors) if job.errors else [],
+        created_at=_iso(job.created_at),
+        started_at=_iso(job.started_at),
+        finished_at=_iso(job.finished_at),
+    )
+
+
+def _save(job_id: str, **fields):
+    db = SessionLocal()
+    try:
+        db.query(models.RateUploadJob).filter(models.RateUploadJob.id == job_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+
+def submit_rates_upload(handler: UploadHandler, contents: bytes, filename: str, username: Optional[str] = None) -> RatesUploadJob:
+    """Record a queued job and hand the file to the upload worker; returns immediately."""
+    db = SessionLocal()
+    try:
+        db.query(models.RateUploadJob).filter(
+            models.RateUploadJob.status.in_(("done", "failed")),
+            models.RateUploadJob.created_at < datetime.utcnow() - timedelta(days=JOB_RETENTION_DAYS),
+        ).delete(synchronize_session=False)
+        job = models.RateUploadJob(id=uuid.uuid4().hex, status="queued", stage="queued", filename=filename, created_by=username)
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        _live[job.id] = {"stage": "queued", "rows_processed": 0}
+        result = _to_schema(job)
+    finally:
+        db.close()
+
+    _executor.submit(_run, job.id, handler, contents)
+    return result
+
+
+def run_on_upload_worker(handler: Callable[..., Any], *args) -> Future:
+    """Run handler(db, *args) on the upload worker, after any queued uploads.
+
+    Used for work that must not interleave with an upload (dry runs, ingests);
+    the session is rolled back and closed afterwards.
+    """
+    def run():
+        db = SessionLocal()
+        try:
+            return handler(db, *args)
+        finally:
+            db.rollback()
+            db.close()
+    return _executor.submit(run)
+
+
+def _run(job_id: str, handler: UploadHandler, contents: bytes):
+    live = _live[job_id]
+
+    def progress(stage: str, rows_processed: Optional[int] = None):
+        live["stage"] = stage
+        if rows_processed is not None:
+            live["rows_processed"] = rows_processed
+
+    _save(job_id, status="running", stage="started", started_at=datetime.utcnow())
+    live["stage"] = "started"
+
+    db = SessionLocal()
+    try:
+        # The handler commits everything and publishes the new rates version at the very end
+        result = handler(db, contents, progress)
+        fields = dict(
+            status="done",
+            message=result.message,
+            base_rates_updated=result.base_rates_updated,
+            branch_rates_updated=result.branch_rates_updated,
+            errors=json.dumps(result.errors, ensure_ascii=False),
+        )
+    except HTTPException as e:
+        db.rollback()
+        fields = dict(status="failed", message=str(e.detail))
+    except Exception as e:
+        db.rollback()
+        traceback.print_exc()
+        fields = dict(status="failed", message=f"Помилка обробки файлу: {str(e)}")
+    finally:
+        db.close()
+
+    try:
+        _save(job_id, stage=live["stage"], rows_processed=live["rows_processed"], finished_at=datetime.utcnow(), **fields)
+    finally:
+        _live.pop(job_id, None)
+
+
+def get_rates_upload_job(job_id: str) -> Optional[RatesUploadJob]:
+    db = SessionLocal()
+    try:
+        job = db.query(models.RateUploadJob).filter(models.RateUploadJob.id == job_id).first()
+        return _to_schema(job) if job else None
+    finally:
+        db.close()
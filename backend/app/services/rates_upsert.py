@@ -0,0 +1,219 @@
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+from app.models import models
+from app.services.branch_resolver import BranchResolver
+
+CURRENCY_COLUMNS = (
+    "id", "code", "name", "name_uk", "flag",
+    "buy_rate", "sell_rate", "wholesale_buy_rate", "wholesale_sell_rate", "is_active",
+)
+BRANCH_RATE_COLUMNS = (
+    "id", "branch_id", "currency_code",
+    "buy_rate", "sell_rate", "wholesale_buy_rate", "wholesale_sell_rate", "is_active",
+)
+RATE_FIELDS = ("buy_rate", "sell_rate", "wholesale_buy_rate", "wholesale_sell_rate")
+# Branch fields an upload can change on existing branches
+BRANCH_FIELDS = ("number", "address", "order")
+
+
+def _rate_changes(before: Dict[Any, Dict[str, Any]], after: Dict[Any, Dict[str, Any]], key_names: Sequence[str]) -> List[Dict[str, Any]]:
+    """Rows present in both maps whose rates differ, with old / new / delta per changed field."""
+    keys = [k for k in after if k in before]
+    if not keys:
+        return []
+    old = np.array([[before[k][f] or 0.0 for f in RATE_FIELDS] for k in keys], dtype=np.float64)
+    new = np.array([[after[k][f] or 0.0 for f in RATE_FIELDS] for k in keys], dtype=np.float64)
+    delta = new - old
+    changed = np.abs(delta) > 1e-9
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percent = np.where(old != 0, delta / old * 100, np.nan)
+
+    out = []
+    for i in np.flatnonzero(changed.any(axis=1)).tolist():
+        key = keys[i] if isinstance(keys[i], tuple) else (keys[i],)
+        item = dict(zip(key_names, key))
+        for j in np.flatnonzero(changed[i]).tolist():
+            item[RATE_FIELDS[j]] = {
+                "old": old[i, j].item(),
+                "new": new[i, j].item(),
+                "delta": round(delta[i, j].item(), 4),
+                "percent": round(percent[i, j].item(), 2) if np.isfinite(percent[i, j]) else None,
+            }
+        out.append(item)
+    return out
+
+
+def _activity_changes(before: Dict[Any, Dict[str, Any]], after: Dict[Any, Dict[str, Any]], active: bool) -> List[Any]:
+    return [k for k, row in after.items() if k in before and bool(before[k]["is_active"]) != active and bool(row["is_active"]) == active]
+
+
+class RateUpsert:
+    """Currencies, branch rates and branches of one upload, held in keyed maps and written back in bulk.
+
+    Each table is read with a single query up front. Lookups and changes
+    during the upload only touch these maps (rows are plain dicts), and
+    flush() writes every new row with one bulk INSERT and every changed row
+    with one bulk UPDATE by primary key per table. Values that did not change
+    are not written. Nothing is committed here.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.currencies: Dict[str, Dict[str, Any]] = {
+            row.code: row._asdict()
+            for row in db.query(*[getattr(models.Currency, c) for c in CURRENCY_COLUMNS])
+        }
+        self.branch_rates: Dict[Tuple[int, str], Dict[str, Any]] = {
+            (row.branch_id, row.currency_code): row._asdict()
+            for row in db.query(*[getattr(models.BranchRate, c) for c in BRANCH_RATE_COLUMNS])
+        }
+        # Branches are few and edited field by field (order, number), so they stay ORM objects
+        self.branches: Dict[int, models.Branch] = {b.id: b for b in db.query(models.Branch).all()}
+        # Header columns are matched to branches through this index, not queries
+        self.resolver = BranchResolver(self.branches.values())
+        # Rows as loaded, for diff()
+        self._loaded_currencies = {k: dict(v) for k, v in self.currencies.items()}
+        self._loaded_branch_rates = {k: dict(v) for k, v in self.branch_rates.items()}
+        self._loaded_branches = {b.id: {f: getattr(b, f) for f in BRANCH_FIELDS} for b in self.branches.values()}
+        self._new_branches: List[models.Branch] = []
+
+        self._new_currencies: List[Dict[str, Any]] = []
+        self._new_branch_rates: List[Dict[str, Any]] = []
+        self._changed_currencies: Dict[int, Dict[str, Any]] = {}
+        self._changed_branch_rates: Dict[int, Dict[str, Any]] = {}
+
+    def currency(self, code: str) -> Optional[Dict[str, Any]]:
+        return self.currencies.get(code)
+
+    def branch_rate(self, branch_id: int, code: str) -> Optional[Dict[str, Any]]:
+        return self.branch_rates.get((branch_id, code))
+
+    def add_currency(self, **values) -> Dict[str, Any]:
+        row = {"wholesale_buy_rate": 0.0, "wholesale_sell_rate": 0.0, "is_active": True, **values}
+        self.currencies[row["code"]] = row
+        self._new_currencies.append(row)
+        return row
+
+    def add_branch_rate(self, **values) -> Dict[str, Any]:
+        row = {"wholesale_buy_rate": 0.0, "wholesale_sell_rate": 0.0, "is_active": True, **values}
+        self.branch_rates[(row["branch_id"], row["currency_code"])] = row
+        self._new_branch_rates.append(row)
+        return row
+
+    def add_branch(self, branch: models.Branch) -> models.Branch:
+        """Insert a branch now (flush, no commit) so its id can be used for rate rows."""
+        self.db.add(branch)
+        self.db.flush()
+        self.branches[branch.id] = branch
+        self.resolver.add(branch)
+        self._new_branches.append(branch)
+        return branch
+
+    def set_currency(self, row: Dict[str, Any], **values):
+        self._set(row, values, self._changed_currencies)
+
+    def set_branch_rate(self, row: Dict[str, Any], **values):
+        self._set(row, values, self._changed_branch_rates)
+
+    @staticmethod
+    def _set(row: Dict[str, Any], values: Dict[str, Any], changed: Dict[int, Dict[str, Any]]):
+        for field, value in values.items():
+            if row.get(field) == value:
+                continue
+            row[field] = value
+            # Rows added in this upload are inserted with their final values
+            if row.get("id") is not None:
+                changed.setdefault(row["id"], {"id": row["id"]})[field] = value
+
+    def deactivate_missing(self, processed_codes: Set[str]):
+        """Deactivate currencies not in `processed_codes` and their branch rates (every upload layout)."""
+        for code, curr in self.currencies.items():
+            if curr['is_active'] and code not in processed_codes:
+                self.set_currency(curr, is_active=False)
+                print(f"SYNC: Deactivating currency {code} (missing from upload)")
+
+        for (_, code), br in self.branch_rates.items():
+            if code not in processed_codes:
+                self.set_branch_rate(br, is_active=False)
+
+    def final_sync(self, processed_codes: Set[str], explicit: Set[Tuple[int, str]]) -> int:
+        """FINAL SYNC of the main workbook upload and of JSON/CSV ingests.
+
+        Runs deactivate_missing, then every branch that was not given its own
+        rate for a processed currency (`explicit` (branch_id, code) pairs) gets
+        the base rates: active rows are updated, missing rows created, rows
+        disabled for the branch left alone. Returns the number of branch rates
+        synced. Service-layout uploads only call deactivate_missing.
+        """
+        self.deactivate_missing(processed_codes)
+
+        synced = 0
+        for code in processed_codes:
+            base_curr = self.currency(code)
+            if not base_curr:
+                continue
+            base_values = {f: base_curr[f] for f in RATE_FIELDS}
+            for branch_id in self.branches:
+                if (branch_id, code) in explicit:
+                    continue
+                br = self.branch_rate(branch_id, code)
+                if br:
+                    if br['is_active']:
+                        self.set_branch_rate(br, **base_values)
+                else:
+                    self.add_branch_rate(branch_id=branch_id, currency_code=code, is_active=True, **base_values)
+                synced += 1
+        return synced
+
+    @property
+    def pending(self) -> int:
+        return (len(self._new_currencies) + len(self._new_branch_rates)
+                + len(self._changed_currencies) + len(self._changed_branch_rates))
+
+    def diff(self) -> Dict[str, Dict[str, List[Any]]]:
+        """What flush() would change compared with the rows as loaded (call before flush / rollback)."""
+        loaded_cur, loaded_br = self._loaded_currencies, self._loaded_branch_rates
+        updated_branches = []
+        # Compared with the values as loaded: add_branch flushes, which clears the ORM change history
+        for branch_id, loaded in self._loaded_branches.items():
+            branch = self.branches[branch_id]
+            changes = {
+                field: {"old": loaded[field], "new": getattr(branch, field)}
+                for field in BRANCH_FIELDS if getattr(branch, field) != loaded[field]
+            }
+            if changes:
+                updated_branches.append({"id": branch.id, **changes})
+        return {
+            "currencies": {
+                "created": [row["code"] for row in self._new_currencies],
+                "deactivated": _activity_changes(loaded_cur, self.currencies, False),
+                "reactivated": _activity_changes(loaded_cur, self.currencies, True),
+                "changed": _rate_changes(loaded_cur, self.currencies, ("code",)),
+            },
+            "branch_rates": {
+                "created": [{"branch_id": row["branch_id"], "currency_code": row["currency_code"]} for row in self._new_branch_rates],
+                "deactivated": [{"branch_id": b, "currency_code": c} for b, c in _activity_changes(loaded_br, self.branch_rates, False)],
+                "reactivated": [{"branch_id": b, "currency_code": c} for b, c in _activity_changes(loaded_br, self.branch_rates, True)],
+                "changed": _rate_changes(loaded_br, self.branch_rates, ("branch_id", "currency_code")),
+            },
+            "branches": {
+                "created": [{"number": b.number, "address": b.address} for b in self._new_branches],
+                "updated": updated_branches,
+            },
+        }
+
+    def flush(self):
+        """Send all pending inserts and updates to the database (inside the caller's transaction)."""
+        self.db.flush()
+        if self._new_currencies:
+            self.db.execute(insert(models.Currency), self._new_currencies)
+        if self._changed_currencies:
+            self.db.execute(update(models.Currency), list(self._changed_currencies.values()))
+        if self._new_branch_rates:
+            self.db.execute(insert(models.BranchRate), self._new_branch_rates)
+        if self._changed_branch_rates:
+            self.db.execute(update(models.BranchRate), list(self._changed_branch_rates.values()))
+        self._new_currencies, self._new_branch_rates = [], []
+        self._changed_currencies, self._changed_branch_rates = {}, {}
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.core.database import SessionLocal
+from app.models import models
+from app.services.reservation_list import invalidate_reservation_counts
+from app.services.reservation_rollups import record_status_change, rollup_columns
+
+# How often pending reservations past expires_at are marked expired
+EXPIRY_INTERVAL_SECONDS = 30
+# A worker that stops renewing its lease for this long is replaced by another one
+EXPIRY_LEASE_SECONDS = 3 * EXPIRY_INTERVAL_SECONDS
+EXPIRY_LEASE_NAME = "reservation_expiry"
+
+EXPIRABLE_STATUSES = (models.ReservationStatus.PENDING, models.ReservationStatus.PENDING_ADMIN)
+
+_holder = f"{socket.gethostname()}:{os.getpid()}"
+_task: Optional[asyncio.Task] = None
+
+
+def kyiv_now() -> datetime:
+    """Naive Kyiv local time, the clock reservations' expires_at is set in."""
+    try:
+        from zoneinfo import ZoneInfo
+        return datetime.now(ZoneInfo("Europe/Kyiv")).replace(tzinfo=None)
+    except ImportError:
+        return datetime.utcnow() + timedelta(hours=2)
+
+
+def expire_reservations(db: Session, now: Optional[datetime] = None) -> int:
+    """Mark every pending reservation past its expires_at as expired; returns the row count.
+
+    One indexed UPDATE per expirable status, so the rollups know which
+    bucket each returned row leaves.
+    """
+    R = models.Reservation
+    now = now or kyiv_now()
+    expired = 0
+    for status in EXPIRABLE_STATUSES:
+        stmt = update(R).where(R.status == status, R.expires_at < now).values(
+            status=models.ReservationStatus.EXPIRED, updated_at=datetime.utcnow()
+        ).returning(*rollup_columns())
+        rows = db.execute(stmt.execution_options(synchronize_session=False)).all()
+        if rows:
+            record_status_change(db, rows, status)
+            expired += len(rows)
+    db.commit()
+    if expired:
+        # Bulk UPDATE skips the ORM events that normally clear the cached list totals
+        invalidate_reservation_counts()
+    return expired
+
+
+def acquire_lease(db: Session, name: str, holder: str, seconds: float) -> bool:
+    """Take or renew the lease `name` for `holder`; False while another holder's lease is still valid."""
+    now = datetime.utcnow()
+    until = now + timedelta(seconds=seconds)
+    taken = db.query(models.SchedulerLease).filter(
+        models.SchedulerLease.name == name,
+        or_(models.SchedulerLease.holder == holder, models.SchedulerLease.expires_at < now)
+    ).update({models.SchedulerLease.holder: holder, models.SchedulerLease.expires_at: until}, synchronize_session=False)
+    if not taken:
+        if db.query(models.SchedulerLease.name).filter(models.SchedulerLease.name == name).first():
+            db.rollback()
+            return False
+        db.add(models.SchedulerLease(name=name, holder=holder, expires_at=until))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another worker created the lease first
+        db.rollback()
+        return False
+    return True
+
+
+def run_expiry_once() -> Optional[int]:
+    """One sweep if this worker holds the lease; None when another worker does."""
+    db = SessionLocal()
+    try:
+        if not acquire_lease(db, EXPIRY_LEASE_NAME, _holder, EXPIRY_LEASE_SECONDS):
+            return None
+        return expire_reservations(db)
+    finally:
+        db.close()
+
+
+async def _expiry_loop():
+    while True:
+        try:
+            expired = await run_in_threadpool(run_expiry_once)
+            if expired:
+                print(f"Expired {expired} reservations")
+        except Exception as e:
+            print(f"Reservation expiry failed: {e}")
+        await asyncio.sleep(EXPIRY_INTERVAL_SECONDS)
+
+
+def start_reservation_expiry():
+    """Start the periodic sweep on the running event loop (called on app startup)."""
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.get_running_loop().create_task(_expiry_loop())
+
+
+def stop_reservation_expiry():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
@@ -0,0 +1,76 @@
+import base64
+import time
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import and_, event, or_
+from sqlalchemy.orm import Query, joinedload
+from app.models import models
+
+# Totals of the reservation lists are reused this long; writes made by this worker clear them at once
+RESERVATION_COUNT_TTL_SECONDS = 15.0
+
+_counts: Dict[Hashable, Tuple[float, int]] = {}
+
+
+def invalidate_reservation_counts(*args):
+    _counts.clear()
+
+
+# Any reservation written through the ORM in this process makes the cached totals stale
+for _event in ("after_insert", "after_update", "after_delete"):
+    event.listen(models.Reservation, _event, invalidate_reservation_counts)
+
+
+def cached_count(query: Query, key: Hashable) -> int:
+    """query.count(), reused for RESERVATION_COUNT_TTL_SECONDS per filter `key`."""
+    now = time.monotonic()
+    hit = _counts.get(key)
+    if hit and hit[0] > now:
+        return hit[1]
+    total = query.count()
+    _counts[key] = (now + RESERVATION_COUNT_TTL_SECONDS, total)
+    return total
+
+
+def encode_cursor(r: models.Reservation) -> str:
+    return base64.urlsafe_b64encode(f"{r.created_at.isoformat()}|{r.id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, rid = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(rid)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def page_reservations(query: Query, count_key: Hashable, page: int, limit: int, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """One page of a reservation list, newest first, with the branch preloaded.
+
+    Without `cursor` this is the classic page/offset listing. With it, rows
+    continue strictly after the cursor's (created_at, id), which the
+    ix_reservations_created_at_id index serves without skipping rows, so
+    deep pages cost the same as the first one. `next_cursor` is None on the
+    last page; `total` comes from cached_count.
+    """
+    total = cached_count(query, count_key)
+    R = models.Reservation
+    if cursor:
+        created_at, rid = decode_cursor(cursor)
+        query = query.filter(or_(R.created_at < created_at, and_(R.created_at == created_at, R.id < rid)))
+    query = query.options(joinedload(R.branch)).order_by(R.created_at.desc(), R.id.desc())
+    if not cursor:
+        query = query.offset((page - 1) * limit)
+
+    rows: List[models.Reservation] = query.limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "rows": rows,
+        "total": total,
+        "page": page,
+        "pages": (total + limit - 1) // limit,
+        "next_cursor": encode_cursor(rows[-1]) if more and rows else None,
+    }
@@ -0,0 +1,203 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, attributes
+from app.core.database import SessionLocal
+from app.models import models
+
+# Reservation columns a rollup bucket is derived from
+ROLLUP_FIELDS = ("branch_id", "give_currency", "give_amount", "get_currency", "get_amount", "status", "created_at")
+# Dimensions the analytics endpoint can group by; day / month are cut from the hourly buckets
+ROLLUP_GROUPS = ("branch", "currency", "status", "hour", "day", "month")
+_PERIOD_FORMATS = {"hour": "%Y-%m-%dT%H:00", "day": "%Y-%m-%d", "month": "%Y-%m"}
+
+# (branch_id or 0, foreign currency, status, creation hour) -> [count, uah_volume, foreign_volume]
+Key = Tuple[int, str, str, datetime]
+Deltas = Dict[Key, List[float]]
+
+
+def rollup_entry(branch_id, give_currency, give_amount, get_currency, get_amount, status, created_at) -> Optional[Tuple[Key, float, float]]:
+    """Bucket key plus UAH and foreign amounts of one reservation (arguments in ROLLUP_FIELDS order)."""
+    if created_at is None:
+        return None
+    if get_currency == "UAH":
+        currency, uah, foreign = give_currency, get_amount, give_amount
+    elif give_currency == "UAH":
+        currency, uah, foreign = get_currency, give_amount, get_amount
+    else:
+        # Cross deal without a UAH side: counted under the currency given
+        currency, uah, foreign = give_currency, 0.0, give_amount
+    key = (branch_id or 0, currency, getattr(status, "value", status), created_at.replace(minute=0, second=0, microsecond=0))
+    return key, uah or 0.0, foreign or 0.0
+
+
+def _add(deltas: Deltas, entry, sign: int):
+    if entry is None:
+        return
+    key, uah, foreign = entry
+    d = deltas.setdefault(key, [0, 0.0, 0.0])
+    d[0] += sign
+    d[1] += sign * uah
+    d[2] += sign * foreign
+
+
+def apply_rollup_deltas(conn, deltas: Deltas):
+    """Add the deltas to their buckets with one INSERT ... ON CONFLICT DO UPDATE (SQLite and Postgres)."""
+    rows = [
+        dict(branch_id=k[0], currency_code=k[1], status=k[2], hour=k[3], count=d[0], uah_volume=d[1], foreign_volume=d[2])
+        for k, d in deltas.items() if d[0] or d[1] or d[2]
+    ]
+    if not rows:
+        return
+    table = models.ReservationRollup.__table__
+    insert = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["branch_id", "currency_code", "status", "hour"],
+        set_={c: table.c[c] + stmt.excluded[c] for c in ("count", "uah_volume", "foreign_volume")},
+    )
+    conn.execute(stmt)
+
+
+def _old_values(obj: models.Reservation) -> tuple:
+    values = []
+    for field in ROLLUP_FIELDS:
+        history = attributes.get_history(obj, field)
+        values.append(history.deleted[0] if history.deleted else getattr(obj, field))
+    return tuple(values)
+
+
+def _new_values(obj: models.Reservation) -> tuple:
+    return tuple(getattr(obj, field) for field in ROLLUP_FIELDS)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_reservations(session: Session, flush_context):
+    """Move every reservation inserted, changed or deleted by this flush between buckets, in the same transaction."""
+    deltas: Deltas = {}
+    for obj in session.new:
+        if isinstance(obj, models.Reservation):
+            _add(deltas, rollup_entry(*_new_values(obj)), 1)
+    for obj in session.dirty:
+        if isinstance(obj, models.Reservation) and any(attributes.get_history(obj, f).has_changes() for f in ROLLUP_FIELDS):
+            _add(deltas, rollup_entry(*_old_values(obj)), -1)
+            _add(deltas, rollup_entry(*_new_values(obj)), 1)
+    for obj in session.deleted:
+        if isinstance(obj, models.Reservation):
+            _add(deltas, rollup_entry(*_old_values(obj)), -1)
+    if deltas:
+        apply_rollup_deltas(session.connection(), deltas)
+
+
+# Load the previous value on assignment even when the attribute was expired, so the old bucket is known
+for _field in ROLLUP_FIELDS:
+    event.listen(getattr(models.Reservation, _field), "set", lambda *args: None, active_history=True)
+
+
+def rollup_columns() -> tuple:
+    """Reservation columns in ROLLUP_FIELDS order, for SELECT / RETURNING lists."""
+    return tuple(getattr(models.Reservation, f) for f in ROLLUP_FIELDS)
+
+
+def record_status_change(db: Session, rows: Iterable[tuple], old_status):
+    """Rollup side of a bulk status UPDATE: `rows` are RETURNING rollup_columns() of the updated rows."""
+    deltas: Deltas = {}
+    status_index = ROLLUP_FIELDS.index("status")
+    for row in rows:
+        old = list(row)
+        old[status_index] = old_status
+        _add(deltas, rollup_entry(*old), -1)
+        _add(deltas, rollup_entry(*row), 1)
+    apply_rollup_deltas(db.connection(), deltas)
+
+
+def move_branch_rollups(db: Session, branch_id: int):
+    """Fold a deleted branch's buckets into branch 0, matching reservations whose branch_id was cleared."""
+    R = models.ReservationRollup
+    deltas: Deltas = {}
+    for row in db.query(R).filter(R.branch_id == branch_id):
+        deltas[(0, row.currency_code, row.status, row.hour)] = [row.count, row.uah_volume, row.foreign_volume]
+    db.query(R).filter(R.branch_id == branch_id).delete(synchronize_session=False)
+    apply_rollup_deltas(db.connection(), deltas)
+
+
+def rebuild_reservation_rollups(db: Session) -> int:
+    """Recompute every bucket from the reservations table (one pass over its rollup columns); returns the bucket count."""
+    deltas: Deltas = {}
+    for row in db.query(*rollup_columns()).yield_per(5000):
+        _add(deltas, rollup_entry(*row), 1)
+    db.query(models.ReservationRollup).delete(synchronize_session=False)
+    apply_rollup_deltas(db.connection(), deltas)
+    db.commit()
+    return len(deltas)
+
+
+def ensure_reservation_rollups():
+    """Build the rollups once for a database that has reservations from before the table existed."""
+    db = SessionLocal()
+    try:
+        if db.query(models.ReservationRollup.id).first() or not db.query(models.Reservation.id).first():
+            return
+        buckets = rebuild_reservation_rollups(db)
+        print(f"Built {buckets} reservation rollup buckets")
+    except IntegrityError:
+        # Another worker built them at the same time
+        db.rollback()
+    finally:
+        db.close()
+
+
+def reservation_analytics(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    group_by: List[str],
+    branch_id: Optional[int] = None,
+    currency: Optional[str] = None,
+    statuses: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Counts and volumes of reservations created in [start, end), summed from the hourly buckets.
+
+    `group_by` picks the ROLLUP_GROUPS dimensions of the result rows; an empty
+    list gives a single row. Buckets are read as plain tuples, so the cost
+    depends on the number of buckets in range, not on the reservations table.
+    """
+    R = models.ReservationRollup
+    query = db.query(R.branch_id, R.currency_code, R.status, R.hour, R.count, R.uah_volume, R.foreign_volume).filter(
+        R.hour >= start, R.hour < end
+    )
+    if branch_id is not None:
+        query = query.filter(R.branch_id == branch_id)
+    if currency:
+        query = query.filter(R.currency_code == currency)
+    if statuses:
+        query = query.filter(R.status.in_(statuses))
+
+    period = next((g for g in group_by if g in _PERIOD_FORMATS), None)
+    groups: Dict[tuple, List[float]] = {}
+    total = [0, 0.0, 0.0]
+    for branch, code, status, hour, count, uah, foreign in query:
+        key = (
+            branch if "branch" in group_by else None,
+            code if "currency" in group_by else None,
+            status if "status" in group_by else None,
+            hour.strftime(_PERIOD_FORMATS[period]) if period else None,
+        )
+        g = groups.setdefault(key, [0, 0.0, 0.0])
+        for acc in (g, total):
+            acc[0] += count
+            acc[1] += uah
+            acc[2] += foreign
+
+    def row(key, values) -> Dict[str, Any]:
+        return dict(
+            branch_id=key[0], currency_code=key[1], status=key[2], period=key[3],
+            count=values[0], uah_volume=round(values[1], 2), foreign_volume=round(values[2], 2),
+        )
+
+    rows = [row(k, v) for k, v in groups.items() if v[0]]
+    # Periods in time order, then by branch / currency / status; missing dimensions are None
+    rows.sort(key=lambda r: tuple((r[f] is None, r[f] if r[f] is not None else 0) for f in ("period", "branch_id", "currency_code", "status")))
+    return {"rows": rows, "total": row((None,) * 4, total)}
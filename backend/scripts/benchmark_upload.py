@@ -0,0 +1,266 @@
+"""Benchmark for the Excel rates upload.
+
+Generates synthetic workbooks in every supported layout, uploads them into a
+throwaway SQLite database through RatesService.process_excel_upload and the
+main.py upload handler, and reports wall time, SQL statement count and peak
+Python memory.
+
+    cd backend
+    ./venv/bin/python3 -m scripts.benchmark_upload --branches 10,50,200 --currencies 36
+    ./venv/bin/python3 -m scripts.benchmark_upload --layouts three_row --branches 200 --budget-ms 2000
+
+Every case starts from a fresh database with the branches already created.
+A first upload inserts all rates ("insert"); a second upload of the same
+layout with different rates measures the usual daily update ("update").
+With --budget-ms the script exits with status 1 if any median time is over budget.
+Rate history is recorded after each publish on its own thread; it is waited
+for between runs but neither timed nor counted.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from string import ascii_uppercase
+
+LAYOUTS = ("three_row", "two_row", "plain", "branch_sheet")
+PATHS = ("service", "endpoint")
+RATE_HEADERS = ("Купівля", "Продаж", "Опт Купівля", "Опт Продаж")
+
+
+def currency_codes(count: int, known: list) -> list:
+    codes = list(known[:count])
+    for a in ascii_uppercase:
+        for b in ascii_uppercase:
+            if len(codes) >= count:
+                return codes
+            codes.append(f"Q{a}{b}")
+    return codes
+
+
+def _rates(rng: random.Random, base: float) -> list:
+    buy = round(base * rng.uniform(0.98, 1.02), 4)
+    sell = round(buy * 1.015, 4)
+    return [buy, sell, round(buy * 1.003, 4), round(sell * 0.997, 4)]
+
+
+def make_workbook(layout: str, codes: list, branches: int, seed: int = 0) -> bytes:
+    """A rates workbook in one of LAYOUTS for `codes` x branches 1..`branches`."""
+    from openpyxl import Workbook
+    from app.main import CURRENCY_NAMES
+
+    names = {code: CURRENCY_NAMES.get(code, (code, code))[1] for code in codes}
+
+    rng = random.Random(seed)
+    bases = {code: rng.uniform(0.5, 60) for code in codes}
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Курси")
+
+    if layout == "three_row":
+        # Same shape as GET /api/admin/rates/template
+        numbers, addresses, headers = [None] * 3, [None] * 3, ["Код", "Прапор", "Валюта"]
+        for n in range(1, branches + 1):
+            numbers += [f"№ {n}", None, None, None]
+            addresses += [f"вул. Тестова, {n}", None, None, None]
+            headers += RATE_HEADERS
+        ws.append(numbers)
+        ws.append(addresses)
+        ws.append(headers)
+        for code in codes:
+            row = [code, None, names[code]]
+            for _ in range(branches):
+                row += _rates(rng, bases[code])
+            ws.append(row)
+
+    elif layout == "two_row":
+        numbers, headers = [None] * 4, ["Код", "Валюта", "Купівля", "Продаж"]
+        for n in range(1, branches + 1):
+            numbers += [f"№ {n}", None, None, None]
+            headers += RATE_HEADERS
+        ws.append(numbers)
+        ws.append(headers)
+        for code in codes:
+            row = [code, names[code]] + _rates(rng, bases[code])[:2]
+            for _ in range(branches):
+                row += _rates(rng, bases[code])
+            ws.append(row)
+
+    else:
+        ws.append(["Код", "Назва", "Купівля", "Продаж", "Опт купівля", "Опт продаж"])
+        for code in codes:
+            ws.append([code, names[code]] + _rates(rng, bases[code]))
+
+        if layout == "branch_sheet":
+            # One row per branch, a buy / sell column pair per currency
+            sheet = wb.create_sheet("Відділення")
+            header = ["Відділення"]
+            for code in codes:
+                header += [code, code]
+            sheet.append(header)
+            for n in range(1, branches + 1):
+                row = [n]
+                for code in codes:
+                    row += _rates(rng, bases[code])[:2]
+                sheet.append(row)
+
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+class Bench:
+    """Fresh tables and a statement counter on the app's engine."""
+
+    def __init__(self):
+        from sqlalchemy import event
+        from app.core.database import engine, SessionLocal
+        from app.models import models
+
+        self.engine, self.SessionLocal, self.models = engine, SessionLocal, models
+        self.statements = 0
+
+        self.thread = threading.get_ident()
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _count(*args):
+            # Only the upload's own statements, not the rate history thread
+            if threading.get_ident() == self.thread:
+                self.statements += 1
+
+    def reset(self, branches: int):
+        models = self.models
+        models.Base.metadata.drop_all(bind=self.engine)
+        models.Base.metadata.create_all(bind=self.engine)
+        db = self.SessionLocal()
+        try:
+            db.add(models.SiteSettings())
+            for n in range(1, branches + 1):
+                db.add(models.Branch(
+                    id=n, number=n, address=f"вул. Тестова, {n}", order=n,
+                    hours="щодня: 8:00-20:00", lat=50.45, lng=30.52, is_open=True,
+                ))
+            db.commit()
+        finally:
+            db.close()
+
+    def run(self, path: str, contents: bytes, trace: bool = False) -> dict:
+        from app.services.rate_history import wait_for_rate_history
+        if path == "service":
+            from app.services.rates_service import RatesService
+            upload = lambda db: RatesService(db).process_excel_upload(contents)
+        else:
+            from app.main import apply_rates_upload
+            upload = lambda db: apply_rates_upload(db, contents)
+
+        db = self.SessionLocal()
+        self.statements = 0
+        if trace:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            with redirect_stdout(io.StringIO()):
+                result = upload(db)
+        finally:
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] if trace else None
+            if trace:
+                tracemalloc.stop()
+            db.close()
+            # Before the next reset drops the tables under the recorder
+            wait_for_rate_history()
+        return {
+            "ms": elapsed * 1000,
+            "queries": self.statements,
+            "peak_kb": peak / 1024 if peak is not None else None,
+            "base": result.base_rates_updated,
+            "branch": result.branch_rates_updated,
+        }
+
+
+def benchmark(bench: Bench, path: str, layout: str, codes: list, branches: int, repeat: int) -> dict:
+    first = make_workbook(layout, codes, branches, seed=1)
+    second = make_workbook(layout, codes, branches, seed=2)
+    phases = {"insert": [], "update": []}
+    for i in range(repeat + 1):
+        # The last round only measures memory; tracemalloc slows everything down
+        trace = i == repeat
+        bench.reset(branches)
+        phases["insert"].append(bench.run(path, first, trace))
+        phases["update"].append(bench.run(path, second, trace))
+
+    report = {"path": path, "layout": layout, "currencies": len(codes), "branches": branches, "workbook_kb": round(len(second) / 1024, 1)}
+    for phase, runs in phases.items():
+        timed = runs[:-1]
+        report[phase] = {
+            "median_ms": round(statistics.median(r["ms"] for r in timed), 1),
+            "min_ms": round(min(r["ms"] for r in timed), 1),
+            "queries": timed[-1]["queries"],
+            "peak_kb": round(runs[-1]["peak_kb"]),
+            "branch_rates_updated": timed[-1]["branch"],
+        }
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--branches", default="10,50,200", help="comma separated branch counts (up to 200 is realistic)")
+    parser.add_argument("--currencies", type=int, default=36)
+    parser.add_argument("--layouts", default=",".join(LAYOUTS), help=f"comma separated subset of {','.join(LAYOUTS)}")
+    parser.add_argument("--paths", default=",".join(PATHS), help="service (RatesService) and/or endpoint (main.apply_rates_upload)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail when any median time exceeds this")
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    args = parser.parse_args(argv)
+
+    layouts = [l for l in args.layouts.split(",") if l]
+    paths = [p for p in args.paths.split(",") if p]
+    unknown = set(layouts) - set(LAYOUTS) | set(paths) - set(PATHS)
+    if unknown:
+        parser.error(f"unknown layout / path: {', '.join(sorted(unknown))}")
+
+    # The app binds its engine on import, so the database must be chosen first
+    workdir = tempfile.mkdtemp(prefix="svit-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    with redirect_stdout(io.StringIO()):
+        import app.main  # noqa: F401 - registers rate listeners and migrations like the server does
+    from app.services.rates_service import ORDERED_CURRENCIES
+
+    bench = Bench()
+    codes = currency_codes(args.currencies, ORDERED_CURRENCIES)
+    reports = []
+    for branches in [int(b) for b in args.branches.split(",") if b]:
+        for layout in layouts:
+            for path in paths:
+                if path == "service" and layout == "branch_sheet":
+                    continue  # RatesService only reads the base sheet
+                report = benchmark(bench, path, layout, codes, branches, args.repeat)
+                reports.append(report)
+                if not args.json:
+                    print(
+                        f"{path:8} {layout:12} {report['currencies']:>3}x{branches:<4} "
+                        + "  ".join(
+                            f"{phase}: {report[phase]['median_ms']:>8.1f} ms {report[phase]['queries']:>5} q {report[phase]['peak_kb']:>7} KB"
+                            for phase in ("insert", "update")
+                        ),
+                        flush=True,
+                    )
+    if args.json:
+        print(json.dumps(reports, indent=2, ensure_ascii=False))
+
+    if args.budget_ms is not None:
+        over = [r for r in reports for phase in ("insert", "update") if r[phase]["median_ms"] > args.budget_ms]
+        if over:
+            print(f"Over budget ({args.budget_ms} ms): " + ", ".join(f"{r['path']}/{r['layout']}/{r['branches']}" for r in over), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
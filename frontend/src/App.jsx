@@ -103,12 +103,34 @@ function PublicLayout() {
   useEffect(() => {
     fetchData();
 
-    // Setup polling every 10 seconds
-    const intervalId = setInterval(() => {
-      fetchData(true);
-    }, 10000);
+    // Rate changes are pushed over SSE; polling every 10 seconds is only the fallback
+    let intervalId = null;
+    const startPolling = () => {
+      if (!intervalId) intervalId = setInterval(() => fetchData(true), 10000);
+    };
+    const stopPolling = () => {
+      if (intervalId) clearInterval(intervalId);
+      intervalId = null;
+    };
 
-    return () => clearInterval(intervalId);
+    let lastVersion = null;
+    const stream = currencyService.openRatesStream();
+    if (stream) {
+      stream.addEventListener('rates', (event) => {
+        const { version } = JSON.parse(event.data);
+        if (lastVersion && version !== lastVersion) fetchData(true);
+        lastVersion = version;
+      });
+      stream.onopen = stopPolling;
+      stream.onerror = startPolling; // EventSource reconnects by itself; poll meanwhile
+    } else {
+      startPolling();
+    }
+
+    return () => {
+      stopPolling();
+      if (stream) stream.close();
+    };
   }, []);
 
   // Distance Calculation (Haversine)
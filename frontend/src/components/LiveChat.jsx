@@ -1,6 +1,6 @@
 import { useState, useEffect, useRef } from 'react';
 import { X, Send, MessageSquare, Minimize2, User, Paperclip, Loader2 } from 'lucide-react';
-import { chatService, getStaticUrl } from '../services/api';
+import { chatService, applyChatEvent, mergeChatMessages, lastChatMessageId, getStaticUrl } from '../services/api';
 
 // Generate unique chat ID
 const getChatId = () => {
@@ -23,6 +23,8 @@ export default function LiveChat({ isOpen, onClose }) {
   const fileInputRef = useRef(null);
   const chatId = getChatId();
   const pollIntervalRef = useRef(null);
+  const messagesRef = useRef([]);
+  useEffect(() => { messagesRef.current = messages; }, [messages]);
 
   // Chat availability — 08:00–20:00 Kyiv time
   const isChatAvailable = () => {
@@ -47,10 +49,41 @@ export default function LiveChat({ isOpen, onClose }) {
     chatService.initSession({ session_id: chatId }).catch(console.error);
 
     fetchMessages();
-    pollIntervalRef.current = setInterval(fetchMessages, 3000);
 
-    return () => {
+    // Live updates over WebSocket; poll every 3 seconds only while it is unavailable
+    const startPolling = () => {
+      if (!pollIntervalRef.current) pollIntervalRef.current = setInterval(fetchNewMessages, 3000);
+    };
+    const stopPolling = () => {
       if (pollIntervalRef.current) clearInterval(pollIntervalRef.current);
+      pollIntervalRef.current = null;
+    };
+
+    const socket = chatService.openSocket(chatId);
+    if (socket) {
+      socket.onopen = () => {
+        stopPolling();
+        fetchMessages();
+      };
+      socket.onmessage = (e) => {
+        const event = JSON.parse(e.data);
+        setMessages(prev => applyChatEvent(prev, event));
+        // Chat is open, so a new admin message is read right away
+        if (event.type === 'message' && event.message.sender === 'admin' && socket.readyState === WebSocket.OPEN) {
+          socket.send(JSON.stringify({ type: 'read' }));
+        }
+      };
+      socket.onclose = startPolling;
+    } else {
+      startPolling();
+    }
+
+    return () => {
+      stopPolling();
+      if (socket) {
+        socket.onclose = null;
+        socket.close();
+      }
     };
   }, [chatId, isOpen]);
 
@@ -65,6 +98,20 @@ export default function LiveChat({ isOpen, onClose }) {
     }
   };
 
+  // Polling fallback: only messages after the newest one we already have
+  const fetchNewMessages = async () => {
+    const afterId = lastChatMessageId(messagesRef.current);
+    if (!afterId) return fetchMessages();
+    try {
+      const res = await chatService.getMessages(chatId, afterId);
+      if (res && res.data && res.data.length) {
+        setMessages(prev => mergeChatMessages(prev, res.data));
+      }
+    } catch (err) {
+      console.error('Error fetching messages:', err);
+    }
+  };
+
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [messages]);
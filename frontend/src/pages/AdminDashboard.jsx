@@ -10,7 +10,7 @@ import BranchRateCard from '../components/admin/BranchRateCard';
 import BranchBalancesTab from '../components/admin/BranchBalancesTab';
 import SeoEditRow from '../components/admin/SeoEditRow';
 
-import { adminService, currencyService, chatService } from '../services/api';
+import { adminService, currencyService, chatService, applyChatEvent, mergeChatMessages, lastChatMessageId } from '../services/api';
 import SettingsPage from './SettingsPage';
 import { useAudioNotification } from '../hooks/useAudioNotification';
 import { getStaticUrl } from '../services/api';
@@ -229,8 +229,14 @@ export default function AdminDashboard({ user, onLogout }) {
   };
 
 
-  // Chat polling
+  // Live chat: WebSocket events, with 3-second polling only while the socket is down
   const prevUnreadRef = useRef(0);
+  const activeChatIdRef = useRef(null);
+  const [chatSocketOpen, setChatSocketOpen] = useState(false);
+  useEffect(() => { activeChatIdRef.current = activeChatId; }, [activeChatId]);
+  const chatMessagesRef = useRef([]);
+  useEffect(() => { chatMessagesRef.current = chatMessages; }, [chatMessages]);
+
   useEffect(() => {
     const fetchChats = async () => {
       try {
@@ -252,8 +258,54 @@ export default function AdminDashboard({ user, onLogout }) {
       } catch (err) { }
     };
     fetchChats();
-    const chatInterval = setInterval(fetchChats, 3000);
-    return () => clearInterval(chatInterval);
+
+    let chatInterval = null;
+    const startPolling = () => {
+      setChatSocketOpen(false);
+      if (!chatInterval) chatInterval = setInterval(fetchChats, 3000);
+    };
+    const stopPolling = () => {
+      if (chatInterval) clearInterval(chatInterval);
+      chatInterval = null;
+    };
+
+    // Several events often arrive together (message + read receipt); refresh the list once
+    let refreshTimer = null;
+    const scheduleRefresh = () => {
+      if (!refreshTimer) refreshTimer = setTimeout(() => { refreshTimer = null; fetchChats(); }, 300);
+    };
+
+    const socket = adminService.openChatSocket();
+    if (socket) {
+      socket.onmessage = (e) => {
+        const event = JSON.parse(e.data);
+        if (event.type === 'ready') {
+          stopPolling();
+          setChatSocketOpen(true);
+          fetchChats();
+          return;
+        }
+        if (event.session_id === activeChatIdRef.current) {
+          setChatMessages(prev => applyChatEvent(prev, event));
+          if (event.type === 'message' && event.message.sender === 'user') {
+            socket.send(JSON.stringify({ type: 'read', session_id: event.session_id }));
+          }
+        }
+        scheduleRefresh();
+      };
+      socket.onclose = startPolling;
+    } else {
+      startPolling();
+    }
+
+    return () => {
+      stopPolling();
+      if (refreshTimer) clearTimeout(refreshTimer);
+      if (socket) {
+        socket.onclose = null;
+        socket.close();
+      }
+    };
   }, [playNotification]);
 
   useEffect(() => {
@@ -263,15 +315,32 @@ export default function AdminDashboard({ user, onLogout }) {
           const res = await adminService.getChatMessages(activeChatId);
           if (res?.data) {
             setChatMessages(res.data);
-            adminService.markChatRead(activeChatId).catch(() => { });
+            if (res.data.some(m => m.sender === 'user' && !m.is_read)) {
+              adminService.markChatRead(activeChatId).catch(() => { });
+            }
+          }
+        } catch (err) { }
+      };
+      // Polling fallback: only messages after the newest one already loaded
+      const fetchNewMsgs = async () => {
+        const afterId = lastChatMessageId(chatMessagesRef.current);
+        if (!afterId) return fetchMsgs();
+        try {
+          const res = await adminService.getChatMessages(activeChatId, afterId);
+          if (res?.data?.length) {
+            setChatMessages(prev => mergeChatMessages(prev, res.data));
+            if (res.data.some(m => m.sender === 'user' && !m.is_read)) {
+              adminService.markChatRead(activeChatId).catch(() => { });
+            }
           }
         } catch (err) { }
       };
       fetchMsgs();
-      const msgInterval = setInterval(fetchMsgs, 3000);
+      if (chatSocketOpen) return;
+      const msgInterval = setInterval(fetchNewMsgs, 3000);
       return () => clearInterval(msgInterval);
     }
-  }, [activeChatId]);
+  }, [activeChatId, chatSocketOpen]);
 
   useEffect(() => {
     chatMessagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -34,6 +34,16 @@ export const getStaticUrl = (path) => {
 
 const API_BASE_URL = getApiUrl();
 
+// WebSocket URL for an API path (same host as the REST API)
+const getWsUrl = (path) => {
+  const base = API_BASE_URL.startsWith('http')
+    ? API_BASE_URL.replace(/^http/, 'ws')
+    : `${window.location.protocol === 'https:' ? 'wss' : 'ws'}://${window.location.host}${API_BASE_URL}`;
+  return base + path;
+};
+
+const openSocket = (path) => (typeof WebSocket !== 'undefined' ? new WebSocket(getWsUrl(path)) : null);
+
 const api = axios.create({
   baseURL: API_BASE_URL,
   headers: {
@@ -107,12 +117,20 @@ export const currencyService = {
   getOne: (code) => api.get(`/currencies/${code}`),
   getRates: () => api.get('/rates'),
   getCrossRates: () => api.get('/rates/cross'),
+  // Chart series for currency pages: params { branch_id, days | start/end, points, mode: 'lttb' | 'ohlc' }
+  getRateHistory: (code, params = {}) => api.get(`/rates/history/${code}`, { params }),
+  // Full buy/sell cross matrix for a branch: { currencies, buy: [[...]], sell: [[...]] }
+  getCrossMatrix: (branchId) => api.get('/rates/cross/matrix', { params: branchId ? { branch_id: branchId } : {} }),
   getBranchRates: (branchId) => api.get('/currencies', { params: { branch_id: branchId } }),
   calculate: (amount, fromCurrency, toCurrency = 'UAH') =>
     api.get('/calculate', { params: { amount, from_currency: fromCurrency, to_currency: toCurrency } }),
   calculateCross: (amount, fromCurrency, toCurrency) =>
     api.get('/calculate/cross', { params: { amount, from_currency: fromCurrency, to_currency: toCurrency } }),
+  // quotes: [{ amount, from_currency, to_currency, branch_id }] evaluated in one request
+  calculateBatch: (quotes) => api.post('/calculate/batch', { quotes }),
   getAllCurrencyInfo: () => api.get('/currencies/info/all'),
+  // Server-Sent Events: emits a `rates` event whenever the published rates change
+  openRatesStream: () => (typeof EventSource !== 'undefined' ? new EventSource(`${API_BASE_URL}/rates/stream`) : null),
 };
 
 export const orderService = {
@@ -202,6 +220,7 @@ export const adminService = {
       const cleanParams = {};
       if (params.limit) cleanParams.limit = params.limit;
       if (params.page) cleanParams.page = params.page;
+      if (params.cursor) cleanParams.cursor = params.cursor;
       if (params.date_from) cleanParams.date_from = params.date_from;
       if (params.date_to) cleanParams.date_to = params.date_to;
       if (params.status) cleanParams.status = params.status;
@@ -216,7 +235,7 @@ export const adminService = {
 
       items.sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
 
-      return { data: { items, total: response.data?.total || items.length, page: response.data?.page || 1, pages: response.data?.pages || 1 } };
+      return { data: { items, total: response.data?.total || items.length, page: response.data?.page || 1, pages: response.data?.pages || 1, next_cursor: response.data?.next_cursor || null } };
     } catch (error) {
       console.error('Error fetching reservations:', error);
       return { data: { items: [], total: 0, page: 1, pages: 1 } };
@@ -225,10 +244,28 @@ export const adminService = {
   updateReservation: (id, data) => api.put(`/admin/reservations/${id}`, data),
   createReservation: (data) => api.post(`/admin/reservations`, data),
   assignReservation: (id) => api.post(`/admin/reservations/${id}/assign`),
-  uploadRates: (file) => {
+  uploadRates: async (file) => {
+    const formData = new FormData();
+    formData.append('file', file);
+    const { data: job } = await api.post('/admin/rates/upload', formData, {
+      headers: {
+        'Content-Type': undefined
+      }
+    });
+    // The file is processed in the background; wait for the job to finish
+    let status = job;
+    while (status.status === 'queued' || status.status === 'running') {
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+      status = (await api.get(`/admin/rates/upload/${job.id}`)).data;
+    }
+    return { data: status };
+  },
+  getRatesUploadJob: (jobId) => api.get(`/admin/rates/upload/${jobId}`),
+  previewRatesUpload: (file) => {
     const formData = new FormData();
     formData.append('file', file);
     return api.post('/admin/rates/upload', formData, {
+      params: { dry_run: true },
       headers: {
         'Content-Type': undefined
       }
@@ -258,6 +295,8 @@ export const adminService = {
   updateBranchRate: (branchId, currencyCode, data) =>
     api.put(`/admin/rates/branch/${branchId}/${currencyCode}`, data),
   getCrossRates: () => api.get('/rates/cross'),
+  // Full buy/sell cross matrix for a branch: { currencies, buy: [[...]], sell: [[...]] }
+  getCrossMatrix: (branchId) => api.get('/rates/cross/matrix', { params: branchId ? { branch_id: branchId } : {} }),
 
   // Currency management
   getCurrencies: async () => {
@@ -282,12 +321,23 @@ export const adminService = {
 
   // Chat management
   getChatSessions: () => api.get('/admin/chat/sessions'),
-  getChatMessages: (sessionId) => api.get(`/admin/chat/sessions/${sessionId}/messages`),
+  getChatMessages: (sessionId, afterId) =>
+    api.get(`/admin/chat/sessions/${sessionId}/messages`, { params: afterId ? { after_id: afterId } : {} }),
   sendChatMessage: (sessionId, data) => api.post(`/admin/chat/sessions/${sessionId}/messages`, data),
   editChatMessage: (messageId, data) => api.put(`/admin/chat/messages/${messageId}`, data),
   deleteChatMessage: (messageId) => api.delete(`/admin/chat/messages/${messageId}`),
   markChatRead: (sessionId) => api.post(`/admin/chat/sessions/${sessionId}/read`),
   closeChatSession: (sessionId) => api.put(`/admin/chat/sessions/${sessionId}/close`),
+  // Live chat events for all sessions; authenticates with the stored Basic token on open
+  openChatSocket: () => {
+    const socket = openSocket('/chat/admin/ws');
+    if (socket) {
+      socket.addEventListener('open', () => {
+        socket.send(JSON.stringify({ type: 'auth', token: localStorage.getItem('authToken') }));
+      });
+    }
+    return socket;
+  },
 
   // Cross-rate pair management
   getAdminCrossRates: () => api.get('/admin/cross-rates'),
@@ -299,7 +349,11 @@ export const adminService = {
 // Public Chat Service
 export const chatService = {
   initSession: (data) => api.post('/chat/session', data),
-  getMessages: (sessionId) => api.get('/chat/messages', { params: { session_id: sessionId } }),
+  // Live chat events for one session (messages, read receipts, session open/close)
+  openSocket: (sessionId) => openSocket(`/chat/ws?session_id=${encodeURIComponent(sessionId)}`),
+  // afterId: only messages newer than this id (incremental refresh)
+  getMessages: (sessionId, afterId) =>
+    api.get('/chat/messages', { params: afterId ? { session_id: sessionId, after_id: afterId } : { session_id: sessionId } }),
   sendMessage: (sessionId, data) => api.post('/chat/messages', data, { params: { session_id: sessionId } }),
   uploadImage: (sessionId, file) => {
     const formData = new FormData();
@@ -318,6 +372,35 @@ export const chatService = {
   },
 };
 
+// Append messages fetched with after_id, replacing optimistic copies
+export const mergeChatMessages = (messages, newer) =>
+  newer.reduce((acc, message) => applyChatEvent(acc, { type: 'message', message }), messages);
+
+// Id of the newest persisted message (cursor for after_id)
+export const lastChatMessageId = (messages) =>
+  messages.reduce((max, m) => (m.session_id !== undefined && m.id > max ? m.id : max), 0);
+
+// Apply a live chat event to a message list
+export const applyChatEvent = (messages, event) => {
+  switch (event.type) {
+    case 'message': {
+      const msg = event.message;
+      if (messages.some(m => m.id === msg.id)) return messages;
+      // Drop the optimistic copy (no session_id yet) of the same message
+      const rest = messages.filter(m => !(m.session_id === undefined && m.sender === msg.sender && m.content === msg.content));
+      return [...rest, msg];
+    }
+    case 'message_updated':
+      return messages.map(m => (m.id === event.message.id ? event.message : m));
+    case 'message_deleted':
+      return messages.filter(m => m.id !== event.message_id);
+    case 'read':
+      return messages.map(m => (event.message_ids.includes(m.id) ? { ...m, is_read: true } : m));
+    default:
+      return messages;
+  }
+};
+
 // Operator service
 export const operatorService = {
   getDashboard: () => api.get('/operator/dashboard').then(r => r).catch(() => ({
@@ -121,6 +121,7 @@ export default defineConfig({
         target: process.env.VITE_API_URL || 'http://localhost:8000',
         changeOrigin: true,
         secure: false,
+        ws: true,
       },
       '/static': {
         target: process.env.VITE_API_URL || 'http://localhost:8000',